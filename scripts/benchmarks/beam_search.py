@@ -0,0 +1,127 @@
+import argparse
+import functools
+import time
+
+import torch
+from torch.utils.data import DataLoader
+
+from virtex.config import Config
+from virtex.data import CocoCaptionsEvalDataset
+from virtex.factories import PretrainingModelFactory
+from virtex.utils.checkpointing import CheckpointManager
+
+
+# fmt: off
+parser = argparse.ArgumentParser(
+    description="""Measure time of beam search decoding of a captioning model
+    on COCO val images with different batch sizes, keeping finished images in
+    the batch until all captions are finished (as done previously), and
+    dropping every image from the batch as soon as its caption is finished.
+    Visual features are computed before measuring, only decoding is measured."""
+)
+parser.add_argument(
+    "--config", default="configs/_base_bicaptioning_R_50_L1_H1024.yaml",
+    help="Path to a pretraining config file.",
+)
+parser.add_argument(
+    "--config-override", nargs="*", default=[],
+    help="A sequence of key-value pairs specifying certain config arguments.",
+)
+parser.add_argument(
+    "--checkpoint-path", default=None,
+    help="""Path to load checkpoint from, randomly initialized model if not
+    given (captions of such a model rarely finish early).""",
+)
+parser.add_argument(
+    "-b", "--batch-sizes", type=int, nargs="+", default=[1, 16, 64, 256],
+    help="Batch sizes to decode images with.",
+)
+parser.add_argument(
+    "-n", "--num-images", type=int, default=256,
+    help="Number of val images to decode with every batch size.",
+)
+parser.add_argument(
+    "--cpu", action="store_true",
+    help="Decode on CPU even if a GPU is available.",
+)
+# fmt: on
+
+
+def _decode(model, projected_visual_features: torch.Tensor, drop_finished: bool):
+    r"""
+    Decode captions with beam search, same as model during evaluation. Step
+    function gets visual features bound to it if finished images are not
+    dropped, so beam search cannot select them.
+    """
+    start_predictions = projected_visual_features.new_full(
+        (projected_visual_features.size(0),), model.sos_index
+    ).long()
+    decoding_context = model.textual.make_decoding_context(
+        projected_visual_features
+    )
+    if drop_finished:
+        predictions, _ = model.decoder.search(
+            start_predictions,
+            model.decoding_step,
+            start_state={},
+            context=decoding_context,
+        )
+    else:
+        decoding_step = functools.partial(model.decoding_step, decoding_context)
+        predictions, _ = model.decoder.search(
+            start_predictions, decoding_step, start_state={}
+        )
+    return predictions[:, 0, :]
+
+
+if __name__ == "__main__":
+    _A = parser.parse_args()
+    _C = Config(_A.config, _A.config_override)
+
+    use_gpu = torch.cuda.is_available() and not _A.cpu
+    device = torch.device("cuda" if use_gpu else "cpu")
+
+    model = PretrainingModelFactory.from_config(_C).to(device)
+    if _A.checkpoint_path is not None:
+        CheckpointManager(model=model).load(_A.checkpoint_path)
+    model.eval()
+
+    # Project visual features of all images before measuring decoding.
+    dataloader = DataLoader(CocoCaptionsEvalDataset(_C.DATA.ROOT), batch_size=16)
+    all_features = []
+    with torch.no_grad():
+        for batch in dataloader:
+            image = batch["image"].to(device)
+            visual_features = model.visual(image)
+            visual_features = visual_features.view(
+                image.size(0), model.visual.visual_feature_size, -1
+            ).permute(0, 2, 1)
+            all_features.append(model.visual_projection(visual_features))
+            if sum(features.size(0) for features in all_features) >= _A.num_images:
+                break
+
+    all_features = torch.cat(all_features)[: _A.num_images]
+    num_images = all_features.size(0)
+    print(f"Decoding {num_images} images on {device}, ms/image:")
+    print(f"{'batch size':>10} | {'keep finished':>13} | {'drop finished':>13}")
+
+    for batch_size in _A.batch_sizes:
+        elapsed_ms = {}
+        for drop_finished in [False, True]:
+            with torch.no_grad():
+                # Warm up (allocations, kernel selection) before measuring.
+                _decode(model, all_features[:batch_size], drop_finished)
+                if use_gpu:
+                    torch.cuda.synchronize()
+
+                start_time = time.time()
+                for features in all_features.split(batch_size):
+                    _decode(model, features, drop_finished)
+                if use_gpu:
+                    torch.cuda.synchronize()
+                elapsed_ms[drop_finished] = (time.time() - start_time) * 1000
+
+        print(
+            f"{batch_size:>10} | {elapsed_ms[False] / num_images:>13.2f} | "
+            f"{elapsed_ms[True] / num_images:>13.2f}"
+        )
@@ -0,0 +1,126 @@
+import argparse
+import time
+
+import torch
+from torch.utils.data import DataLoader
+
+from virtex.config import Config
+from virtex.data import CocoCaptionsEvalDataset
+from virtex.factories import DecoderFactory, PretrainingModelFactory
+from virtex.utils.checkpointing import CheckpointManager
+
+
+# fmt: off
+parser = argparse.ArgumentParser(
+    description="""Measure throughput of every decoder of DecoderFactory
+    (beam search, greedy search, top-k and nucleus sampling), decoding
+    captions of COCO val images with a captioning model. Visual features are
+    computed before measuring, only decoding is measured. Other parameters of
+    decoders (beam size, top-k, top-p) are taken from config."""
+)
+parser.add_argument(
+    "--config", default="configs/_base_bicaptioning_R_50_L1_H1024.yaml",
+    help="Path to a pretraining config file.",
+)
+parser.add_argument(
+    "--config-override", nargs="*", default=[],
+    help="A sequence of key-value pairs specifying certain config arguments.",
+)
+parser.add_argument(
+    "--checkpoint-path", default=None,
+    help="Path to load checkpoint from, randomly initialized model if not given.",
+)
+parser.add_argument(
+    "-b", "--batch-size", type=int, default=64,
+    help="Number of images in a batch.",
+)
+parser.add_argument(
+    "-n", "--num-images", type=int, default=256,
+    help="Number of val images to decode with every decoder.",
+)
+parser.add_argument(
+    "-d", "--decoders", nargs="+", default=list(DecoderFactory.PRODUCTS),
+    choices=list(DecoderFactory.PRODUCTS),
+    help="Names of decoders to measure throughput of.",
+)
+parser.add_argument(
+    "--cpu", action="store_true",
+    help="Decode on CPU even if a GPU is available.",
+)
+# fmt: on
+
+
+def _decode(model, projected_visual_features: torch.Tensor) -> torch.Tensor:
+    r"""Decode captions with decoder of model, same as during evaluation."""
+    start_predictions = projected_visual_features.new_full(
+        (projected_visual_features.size(0),), model.sos_index
+    ).long()
+    decoding_context = model.textual.make_decoding_context(
+        projected_visual_features
+    )
+    predictions, _ = model.decoder.search(
+        start_predictions,
+        model.decoding_step,
+        start_state={},
+        context=decoding_context,
+    )
+    return predictions[:, 0, :]
+
+
+if __name__ == "__main__":
+    _A = parser.parse_args()
+    _C = Config(_A.config, _A.config_override)
+
+    use_gpu = torch.cuda.is_available() and not _A.cpu
+    device = torch.device("cuda" if use_gpu else "cpu")
+
+    model = PretrainingModelFactory.from_config(_C).to(device)
+    if _A.checkpoint_path is not None:
+        CheckpointManager(model=model).load(_A.checkpoint_path)
+    model.eval()
+
+    # Project visual features of all images before measuring decoding.
+    dataloader = DataLoader(
+        CocoCaptionsEvalDataset(_C.DATA.ROOT), batch_size=_A.batch_size
+    )
+    all_features = []
+    with torch.no_grad():
+        for batch in dataloader:
+            image = batch["image"].to(device)
+            visual_features = model.visual(image)
+            visual_features = visual_features.view(
+                image.size(0), model.visual.visual_feature_size, -1
+            ).permute(0, 2, 1)
+            all_features.append(model.visual_projection(visual_features))
+            if sum(features.size(0) for features in all_features) >= _A.num_images:
+                break
+
+    num_images = sum(features.size(0) for features in all_features)
+    print(f"Decoding {num_images} images on {device}.")
+    print(f"{'decoder':>12} | {'images/sec':>10} | {'caption length':>14}")
+
+    for name in _A.decoders:
+        config = Config(
+            _A.config, _A.config_override + ["MODEL.DECODER.NAME", name]
+        )
+        model.decoder = DecoderFactory.from_config(config)
+
+        with torch.no_grad():
+            # Warm up (allocations, kernel selection) before measuring.
+            _decode(model, all_features[0])
+            if use_gpu:
+                torch.cuda.synchronize()
+
+            start_time = time.time()
+            num_tokens = 0
+            for features in all_features:
+                predictions = _decode(model, features)
+                num_tokens += (predictions != _C.DATA.EOS_INDEX).sum().item()
+            if use_gpu:
+                torch.cuda.synchronize()
+            elapsed = time.time() - start_time
+
+        print(
+            f"{name:>12} | {num_images / elapsed:>10.1f} | "
+            f"{num_tokens / num_images:>14.1f}"
+        )
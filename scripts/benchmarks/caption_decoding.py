@@ -0,0 +1,132 @@
+import argparse
+import time
+
+import torch
+from torch.utils.data import DataLoader
+
+from virtex.config import Config
+from virtex.data import CocoCaptionsEvalDataset
+from virtex.factories import PretrainingModelFactory
+from virtex.utils.checkpointing import CheckpointManager
+from virtex.utils.decoding import RepetitionPenalty
+
+
+# fmt: off
+parser = argparse.ArgumentParser(
+    description="""Measure time of beam search decoding of a captioning model
+    on COCO val images, with repetitions penalized by a Python loop over
+    partial captions (as done previously) and by vectorized n-gram blocking of
+    different sizes. Visual features are computed once per batch, only
+    decoding is measured."""
+)
+parser.add_argument(
+    "--config", default="configs/_base_bicaptioning_R_50_L1_H1024.yaml",
+    help="Path to a pretraining config file.",
+)
+parser.add_argument(
+    "--config-override", nargs="*", default=[],
+    help="A sequence of key-value pairs specifying certain config arguments.",
+)
+parser.add_argument(
+    "--checkpoint-path", default=None,
+    help="Path to load checkpoint from, randomly initialized model if not given.",
+)
+parser.add_argument(
+    "-b", "--batch-size", type=int, default=64,
+    help="Number of images in a batch.",
+)
+parser.add_argument(
+    "-n", "--num-batches", type=int, default=10,
+    help="Number of val batches to decode with every penalty.",
+)
+parser.add_argument(
+    "--ngram-sizes", type=int, nargs="+", default=[0, 2, 3],
+    help="Sizes of n-grams to block with vectorized penalty (zero for none).",
+)
+parser.add_argument(
+    "--cpu", action="store_true",
+    help="Decode on CPU even if a GPU is available.",
+)
+# fmt: on
+
+
+def _loop_penalty(logprobs: torch.Tensor, partial_captions: torch.Tensor):
+    r"""Penalize last predicted tokens with a loop, as done previously."""
+    for index in range(partial_captions.size(0)):
+        logprobs[index, partial_captions[index, -1]] = -1000000
+    return logprobs
+
+
+def _decode(model, projected_visual_features: torch.Tensor) -> torch.Tensor:
+    r"""Decode captions with beam search, same as model during evaluation."""
+    start_predictions = projected_visual_features.new_full(
+        (projected_visual_features.size(0),), model.sos_index
+    ).long()
+    decoding_context = model.textual.make_decoding_context(
+        projected_visual_features
+    )
+    predictions, _ = model.decoder.search(
+        start_predictions,
+        model.decoding_step,
+        start_state={},
+        context=decoding_context,
+    )
+    return predictions[:, 0, :]
+
+
+if __name__ == "__main__":
+    _A = parser.parse_args()
+    _C = Config(_A.config, _A.config_override)
+
+    use_gpu = torch.cuda.is_available() and not _A.cpu
+    device = torch.device("cuda" if use_gpu else "cpu")
+
+    model = PretrainingModelFactory.from_config(_C).to(device)
+    if _A.checkpoint_path is not None:
+        CheckpointManager(model=model).load(_A.checkpoint_path)
+    model.eval()
+
+    dataloader = DataLoader(
+        CocoCaptionsEvalDataset(_C.DATA.ROOT), batch_size=_A.batch_size
+    )
+    # Project visual features of all batches before measuring decoding.
+    all_features = []
+    with torch.no_grad():
+        for iteration, batch in enumerate(dataloader):
+            if iteration == _A.num_batches:
+                break
+            image = batch["image"].to(device)
+            visual_features = model.visual(image)
+            visual_features = visual_features.view(
+                image.size(0), model.visual.visual_feature_size, -1
+            ).permute(0, 2, 1)
+            all_features.append(model.visual_projection(visual_features))
+
+    penalties = {"loop (last token)": _loop_penalty}
+    for ngram_size in _A.ngram_sizes:
+        penalties[f"vectorized ({ngram_size}-gram)"] = RepetitionPenalty(
+            no_repeat_ngram_size=ngram_size
+        )
+
+    num_images = sum(features.size(0) for features in all_features)
+    print(f"Decoding {num_images} images on {device}.")
+    print(f"{'penalty':>22} | {'ms/batch':>8} | {'ms/image':>8}")
+    for name, penalty in penalties.items():
+        model.repetition_penalty = penalty
+        with torch.no_grad():
+            # Warm up (allocations, kernel selection) before measuring.
+            _decode(model, all_features[0])
+            if use_gpu:
+                torch.cuda.synchronize()
+
+            start_time = time.time()
+            for features in all_features:
+                _decode(model, features)
+            if use_gpu:
+                torch.cuda.synchronize()
+            elapsed = (time.time() - start_time) * 1000
+
+        print(
+            f"{name:>22} | {elapsed / len(all_features):>8.1f} | "
+            f"{elapsed / num_images:>8.2f}"
+        )
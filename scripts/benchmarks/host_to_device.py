@@ -0,0 +1,93 @@
+import argparse
+import copy
+import time
+
+import numpy as np
+import torch
+
+from virtex.data.structures import ImageCaptionBatch, ImageCaptionInstance
+
+
+# fmt: off
+parser = argparse.ArgumentParser(
+    description="""Measure host to device transfer time of an image-caption
+    batch: copying the batch on host and transferring pageable memory (as done
+    previously), against transferring pinned memory asynchronously."""
+)
+parser.add_argument(
+    "-b", "--batch-size", type=int, default=64,
+    help="Number of instances in a batch.",
+)
+parser.add_argument(
+    "-s", "--image-size", type=int, default=224,
+    help="Height and width of (square) images.",
+)
+parser.add_argument(
+    "--uint8", action="store_true",
+    help="Transfer uint8 images (to be normalized on device) instead of floats.",
+)
+parser.add_argument(
+    "-n", "--num-iterations", type=int, default=50,
+    help="Number of transfers to average time over.",
+)
+# fmt: on
+
+
+def _deepcopy_to(batch, device):
+    r"""Transfer a batch as done previously: deepcopy on host, then transfer."""
+    new_batch = copy.deepcopy(batch)
+    for key in new_batch:
+        new_batch[key] = new_batch[key].to(device)
+    return new_batch
+
+
+def _timeit(transfer_fn, batch, device, num_iterations: int) -> float:
+    r"""Return average time (in milliseconds) of transferring a batch."""
+    transfer_fn(batch, device)
+    torch.cuda.synchronize()
+
+    start_time = time.time()
+    for _ in range(num_iterations):
+        transfer_fn(batch, device)
+    torch.cuda.synchronize()
+    return (time.time() - start_time) / num_iterations * 1000
+
+
+if __name__ == "__main__":
+    _A = parser.parse_args()
+    if not torch.cuda.is_available():
+        raise RuntimeError("This benchmark needs a GPU.")
+
+    device = torch.device("cuda")
+    dtype = np.uint8 if _A.uint8 else np.float32
+    batch = ImageCaptionBatch(
+        [
+            ImageCaptionInstance(
+                idx,
+                np.ones((3, _A.image_size, _A.image_size), dtype),
+                [1] * 20,
+                keep_uint8=_A.uint8,
+            )
+            for idx in range(_A.batch_size)
+        ]
+    )
+    batch_megabytes = sum(
+        tensor.numel() * tensor.element_size() for tensor in batch.values()
+    ) / 2 ** 20
+    print(f"Batch size: {batch_megabytes:.1f} MB")
+
+    pageable_ms = _timeit(_deepcopy_to, batch, device, _A.num_iterations)
+    pinned_ms = _timeit(
+        lambda batch, device: batch.to(device, non_blocking=True),
+        batch.pin_memory(),
+        device,
+        _A.num_iterations,
+    )
+
+    print(f"{'transfer':>24} | {'ms/batch':>8} | {'GB/sec':>6}")
+    for name, milliseconds in [
+        ("deepcopy + pageable", pageable_ms),
+        ("pinned + non_blocking", pinned_ms),
+    ]:
+        speed = batch_megabytes / 2 ** 10 / (milliseconds / 1000)
+        print(f"{name:>24} | {milliseconds:>8.2f} | {speed:>6.2f}")
@@ -0,0 +1,73 @@
+import argparse
+import glob
+import os
+import time
+
+from virtex.factories import ImageDecoderFactory
+
+
+# fmt: off
+parser = argparse.ArgumentParser(
+    description="""Measure time to decode images with every image decoder
+    backend, at full scale and at reduced scale (for images which are resized
+    to a smaller size after decoding). Backends which are not installed are
+    skipped."""
+)
+parser.add_argument(
+    "-i", "--image-dir", default="datasets/coco/val2017",
+    help="Path to a directory of JPEG images.",
+)
+parser.add_argument(
+    "-n", "--num-images", type=int, default=500,
+    help="Number of images to decode with every backend.",
+)
+parser.add_argument(
+    "-m", "--min-sizes", type=int, nargs="+", default=[0, 256],
+    help="""Minimum shorter edge of decoded images, zero for full scale (no
+    reduced scale decoding).""",
+)
+parser.add_argument(
+    "-b", "--backends", nargs="+", default=list(ImageDecoderFactory.PRODUCTS),
+    choices=list(ImageDecoderFactory.PRODUCTS),
+    help="Image decoder backends to measure time with.",
+)
+# fmt: on
+
+
+if __name__ == "__main__":
+    _A = parser.parse_args()
+
+    # Read image files in memory, only decoding is measured.
+    image_paths = sorted(glob.glob(os.path.join(_A.image_dir, "*.jpg")))
+    image_paths = image_paths[: _A.num_images]
+    images_bytes = []
+    for path in image_paths:
+        with open(path, "rb") as image_file:
+            images_bytes.append(image_file.read())
+
+    print(f"{'backend':>10} | {'min size':>8} | {'ms/image':>8} | {'decoded size':>12}")
+    for backend in _A.backends:
+        for min_size in _A.min_sizes:
+            try:
+                decoder = ImageDecoderFactory.create(
+                    backend, min_size=min_size if min_size > 0 else None
+                )
+                decoder.decode(images_bytes[0])
+            except ImportError as error:
+                print(f"{backend:>10} | skipped: {error}")
+                break
+
+            start_time = time.time()
+            num_pixels = 0
+            for image_bytes in images_bytes:
+                image = decoder.decode(image_bytes)
+                num_pixels += image.shape[0] * image.shape[1]
+            elapsed = time.time() - start_time
+
+            # Average decoded image size (as a square image of same area).
+            side = int((num_pixels / len(images_bytes)) ** 0.5)
+            print(
+                f"{backend:>10} | {min_size or 'full':>8} | "
+                f"{elapsed / len(images_bytes) * 1000:>8.2f} | "
+                f"{f'~{side}x{side}':>12}"
+            )
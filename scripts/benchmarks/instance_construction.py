@@ -0,0 +1,119 @@
+import argparse
+from functools import partial
+import time
+
+import numpy as np
+import torch
+from torch.profiler import ProfilerActivity, profile
+
+from virtex.data.structures import ImageCaptionBatch, ImageCaptionInstance
+
+
+# fmt: off
+parser = argparse.ArgumentParser(
+    description="""Count tensor allocations (and bytes allocated) per sample
+    while making image-caption instances and collating them into a batch, and
+    compare with copying images and captions (as done previously)."""
+)
+parser.add_argument(
+    "-s", "--image-size", type=int, default=224,
+    help="Height and width of (square) images.",
+)
+parser.add_argument(
+    "-l", "--caption-length", type=int, default=15,
+    help="Number of tokens in every caption.",
+)
+parser.add_argument(
+    "-b", "--batch-size", type=int, default=64,
+    help="Number of instances to collate in a batch.",
+)
+parser.add_argument(
+    "-n", "--num-batches", type=int, default=20,
+    help="Number of batches to measure time with.",
+)
+# fmt: on
+
+
+def _copying_instance(image_id, image, caption_tokens):
+    r"""Make an instance as done previously: copy image and captions twice."""
+    return {
+        "image_id": torch.tensor(image_id, dtype=torch.long),
+        "image": torch.tensor(image, dtype=torch.float),
+        "caption_tokens": torch.tensor(caption_tokens, dtype=torch.long),
+        "noitpac_tokens": torch.tensor(caption_tokens, dtype=torch.long).flip(0),
+        "caption_lengths": torch.tensor(len(caption_tokens), dtype=torch.long),
+    }
+
+
+def _copying_batch(instances):
+    image_id = torch.stack([ins["image_id"] for ins in instances], dim=0)
+    image = torch.stack([ins["image"] for ins in instances], dim=0)
+    caption_tokens = torch.nn.utils.rnn.pad_sequence(
+        [ins["caption_tokens"] for ins in instances], batch_first=True
+    )
+    noitpac_tokens = torch.nn.utils.rnn.pad_sequence(
+        [ins["noitpac_tokens"] for ins in instances], batch_first=True
+    )
+    caption_lengths = torch.stack([ins["caption_lengths"] for ins in instances])
+    return image_id, image, caption_tokens, noitpac_tokens, caption_lengths
+
+
+def _make_batch(samples, make_instance, make_batch):
+    return make_batch([make_instance(*sample) for sample in samples])
+
+
+if __name__ == "__main__":
+    _A = parser.parse_args()
+
+    # Images after transforms are HWC arrays, and datasets give their CHW views.
+    image_shape = (_A.image_size, _A.image_size, 3)
+    samples = {
+        dtype: [
+            (
+                idx,
+                np.transpose(np.ones(image_shape, dtype), (2, 0, 1)),
+                list(range(_A.caption_length)),
+            )
+            for idx in range(_A.batch_size)
+        ]
+        for dtype in [np.float32, np.uint8]
+    }
+    methods = {
+        "copying": (_copying_instance, _copying_batch),
+        "zero-copy": (
+            partial(ImageCaptionInstance, keep_uint8=True),
+            ImageCaptionBatch,
+        ),
+    }
+
+    print(
+        f"{'method':>10} | {'image':>7} | {'allocs/sample':>13} | "
+        f"{'KB/sample':>9} | {'us/sample':>9}"
+    )
+    for name, (make_instance, make_batch) in methods.items():
+        for dtype, batch_samples in samples.items():
+            # Copying method always casts images to float.
+            if name == "copying" and dtype == np.uint8:
+                continue
+
+            with profile(
+                activities=[ProfilerActivity.CPU], profile_memory=True
+            ) as prof:
+                _make_batch(batch_samples, make_instance, make_batch)
+
+            # Count calls of operators which allocate memory by themselves.
+            events = [e for e in prof.key_averages() if e.self_cpu_memory_usage > 0]
+            num_allocations = sum(e.count for e in events)
+            num_bytes = sum(e.self_cpu_memory_usage for e in events)
+
+            start_time = time.time()
+            for _ in range(_A.num_batches):
+                _make_batch(batch_samples, make_instance, make_batch)
+            elapsed = time.time() - start_time
+
+            print(
+                f"{name:>10} | {np.dtype(dtype).name:>7} | "
+                f"{num_allocations / _A.batch_size:>13.1f} | "
+                f"{num_bytes / _A.batch_size / 2 ** 10:>9.1f} | "
+                f"{elapsed / _A.num_batches / _A.batch_size * 1e6:>9.1f}"
+            )
@@ -0,0 +1,108 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import albumentations as alb
+import lmdb
+
+from virtex.data import serialization
+from virtex.data.readers import LmdbReader, SimpleCocoCaptionsReader
+
+
+# fmt: off
+parser = argparse.ArgumentParser(
+    description="""Compare disk footprint and random read throughput of LMDB
+    files serialized with different record formats."""
+)
+parser.add_argument(
+    "-d", "--data-root", default="datasets/coco",
+    help="Path to the root directory of COCO dataset.",
+)
+parser.add_argument(
+    "-s", "--split", choices=["train", "val"], default="val",
+    help="Which split to read images from, either `train` or `val`.",
+)
+parser.add_argument(
+    "-n", "--num-images", type=int, default=1000,
+    help="Number of images to serialize in every format.",
+)
+parser.add_argument(
+    "-f", "--image-formats", nargs="+", default=serialization.IMAGE_FORMATS,
+    choices=serialization.IMAGE_FORMATS,
+    help="Record formats to compare.",
+)
+parser.add_argument(
+    "-e", "--short-edge-size", type=int, default=None,
+    help="Resize shorter edge of images to this size before serializing.",
+)
+parser.add_argument(
+    "-q", "--quality", type=int, default=90,
+    help="Quality of compressed images for `jpg` and `webp` formats.",
+)
+parser.add_argument(
+    "-o", "--output-dir", default=None,
+    help="Directory to save LMDB files (default: a temporary directory).",
+)
+# fmt: on
+
+
+if __name__ == "__main__":
+    _A = parser.parse_args()
+    output_dir = _A.output_dir or tempfile.mkdtemp()
+    os.makedirs(output_dir, exist_ok=True)
+
+    dset = SimpleCocoCaptionsReader(_A.data_root, _A.split)
+    num_images = min(_A.num_images, len(dset))
+
+    # Decode all images once, so every format serializes the same arrays.
+    instances = [dset[idx] for idx in range(num_images)]
+    if _A.short_edge_size is not None:
+        resize = alb.SmallestMaxSize(max_size=_A.short_edge_size, always_apply=True)
+        for instance in instances:
+            instance["image"] = resize(image=instance["image"])["image"]
+
+    print(
+        f"{'format':>8} | {'size (MB)':>10} | {'write (img/s)':>13} | "
+        f"{'read (img/s)':>12}"
+    )
+    for image_format in _A.image_formats:
+        lmdb_path = os.path.join(output_dir, f"{image_format}.lmdb")
+        db = lmdb.open(lmdb_path, map_size=1099511627776, subdir=False)
+
+        start_time = time.time()
+        with db.begin(write=True) as txn:
+            for idx, instance in enumerate(instances):
+                txn.put(
+                    f"{idx}".encode("ascii"),
+                    serialization.serialize_instance(
+                        instance["image_id"],
+                        instance["image"],
+                        instance["captions"],
+                        image_format=image_format,
+                        quality=_A.quality,
+                    ),
+                )
+            txn.put(
+                serialization.METADATA_KEY,
+                serialization.make_metadata(image_format, num_images),
+            )
+        write_speed = num_images / (time.time() - start_time)
+        db.close()
+
+        # Read all records in random order, like a shuffled dataloader.
+        reader = LmdbReader(lmdb_path)
+        indices = list(range(len(reader)))
+        random.shuffle(indices)
+
+        start_time = time.time()
+        for idx in indices:
+            reader[idx]
+        read_speed = num_images / (time.time() - start_time)
+
+        size = os.path.getsize(lmdb_path) / 2 ** 20
+        print(
+            f"{image_format:>8} | {size:>10.1f} | {write_speed:>13.1f} | "
+            f"{read_speed:>12.1f}"
+        )
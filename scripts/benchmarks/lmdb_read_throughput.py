@@ -0,0 +1,87 @@
+import argparse
+import time
+
+from torch.utils.data import DataLoader, RandomSampler
+
+from virtex.data.readers import LmdbReader
+from virtex.data.samplers import PrefetchingSampler
+
+
+# fmt: off
+parser = argparse.ArgumentParser(
+    description="""Measure random read throughput of an LMDB file through
+    `LmdbReader`, with different number of dataloader workers. For numbers
+    representative of a cold start, drop page cache before every run (for
+    example, `sync; echo 3 > /proc/sys/vm/drop_caches` as root)."""
+)
+parser.add_argument(
+    "-l", "--lmdb-path", default="datasets/coco/serialized_train.lmdb",
+    help="Path to a serialized LMDB file.",
+)
+parser.add_argument(
+    "-w", "--num-workers", type=int, nargs="+", default=[0, 1, 2, 4, 8],
+    help="Number of dataloader workers to measure throughput with.",
+)
+parser.add_argument(
+    "-n", "--num-images", type=int, default=5000,
+    help="Number of (randomly sampled) images to read in every run.",
+)
+parser.add_argument(
+    "-b", "--batch-size", type=int, default=32,
+    help="Batch size of dataloader.",
+)
+parser.add_argument(
+    "--readahead", action="store_true",
+    help="Let the OS read ahead pages of LMDB file beyond the pages requested.",
+)
+parser.add_argument(
+    "--max-readers", type=int, default=126,
+    help="Maximum number of simultaneous read transactions on LMDB file.",
+)
+parser.add_argument(
+    "--prefetch", type=int, default=0,
+    help="Prefetch these many upcoming sampled records into page cache.",
+)
+# fmt: on
+
+
+def _count(instances):
+    # Do not collate images, only the reading and decoding is measured.
+    return len(instances)
+
+
+if __name__ == "__main__":
+    _A = parser.parse_args()
+
+    reader = LmdbReader(
+        _A.lmdb_path, readahead=_A.readahead, max_readers=_A.max_readers
+    )
+    print(f"Records: {len(reader)}, format: {reader.image_format}")
+
+    print(f"{'workers':>8} | {'images/sec':>10} | {'images/sec/worker':>17}")
+    for num_workers in _A.num_workers:
+        sampler = RandomSampler(reader, replacement=True, num_samples=_A.num_images)
+        if _A.prefetch > 0:
+            sampler = PrefetchingSampler(sampler, reader, lookahead=_A.prefetch)
+
+        dataloader = DataLoader(
+            reader,
+            batch_size=_A.batch_size,
+            sampler=sampler,
+            num_workers=num_workers,
+            collate_fn=_count,
+        )
+
+        # Start timer after workers are spawned, with the first batch.
+        iterator = iter(dataloader)
+        num_read = next(iterator)
+        start_time = time.time()
+
+        for batch_size in iterator:
+            num_read += batch_size
+
+        speed = (num_read - _A.batch_size) / (time.time() - start_time)
+        print(
+            f"{num_workers:>8} | {speed:>10.1f} | "
+            f"{speed / max(num_workers, 1):>17.1f}"
+        )
@@ -0,0 +1,99 @@
+import argparse
+
+from torch.utils.data import BatchSampler, DataLoader, RandomSampler
+
+from virtex.config import Config
+from virtex.data import CaptioningDataset
+from virtex.data.samplers import BucketedDistributedBatchSampler
+from virtex.factories import TokenizerFactory
+
+
+# fmt: off
+parser = argparse.ArgumentParser(
+    description="""Report the fraction of caption tokens in batches which are
+    padding, with batches sampled randomly and with batches of similar caption
+    lengths (bucketed). Only captions are read, images are skipped."""
+)
+parser.add_argument(
+    "--config", default="configs/_base_bicaptioning_R_50_L1_H1024.yaml",
+    help="Path to a pretraining config file.",
+)
+parser.add_argument(
+    "--config-override", nargs="*", default=[],
+    help="A sequence of key-value pairs specifying certain config arguments.",
+)
+parser.add_argument(
+    "-s", "--split", choices=["train", "val"], default="train",
+    help="Which split to read the dataset from.",
+)
+parser.add_argument(
+    "-b", "--batch-size", type=int, default=64,
+    help="Batch size of a single process.",
+)
+parser.add_argument(
+    "-r", "--num-replicas", type=int, default=1,
+    help="Number of processes, batches of the first process are measured.",
+)
+parser.add_argument(
+    "--bucket-sizes", type=int, nargs="+", default=[10, 100, 1000],
+    help="Number of global batches in a bucket, for bucketed batches.",
+)
+parser.add_argument(
+    "-w", "--num-workers", type=int, default=4,
+    help="Number of dataloader workers.",
+)
+# fmt: on
+
+
+def _padding_ratio(dataset, batch_sampler, num_workers: int):
+    r"""Return fraction of padding tokens, and average padded caption length."""
+    dataloader = DataLoader(
+        dataset,
+        batch_sampler=batch_sampler,
+        num_workers=num_workers,
+        collate_fn=dataset.collate_fn,
+    )
+    num_tokens, num_padded_tokens, num_batches = 0, 0, 0
+    for batch in dataloader:
+        num_tokens += batch["caption_lengths"].sum().item()
+        num_padded_tokens += batch["caption_tokens"].numel()
+        num_batches += 1
+
+    padded_length = num_padded_tokens / (num_batches * batch_sampler.batch_size)
+    return 1 - num_tokens / num_padded_tokens, padded_length
+
+
+if __name__ == "__main__":
+    _A = parser.parse_args()
+    _C = Config(_A.config, _A.config_override)
+
+    dataset = CaptioningDataset(
+        _C.DATA.ROOT,
+        _A.split,
+        TokenizerFactory.from_config(_C),
+        max_caption_length=_C.DATA.MAX_CAPTION_LENGTH,
+        use_single_caption=_C.DATA.USE_SINGLE_CAPTION,
+        captions_only=True,
+        pretokenized=_C.DATA.PRETOKENIZED_CAPTIONS,
+    )
+    lengths = dataset.caption_lengths()
+
+    batch_samplers = {
+        "random": BatchSampler(
+            RandomSampler(dataset), _A.batch_size, drop_last=True
+        )
+    }
+    for bucket_size in _A.bucket_sizes:
+        batch_samplers[f"bucketed ({bucket_size})"] = BucketedDistributedBatchSampler(
+            lengths,
+            _A.batch_size,
+            num_replicas=_A.num_replicas,
+            rank=0,
+            drop_last=True,
+            bucket_size=bucket_size,
+        )
+
+    print(f"{'batches':>16} | {'padding %':>9} | {'padded length':>13}")
+    for name, batch_sampler in batch_samplers.items():
+        ratio, padded_length = _padding_ratio(dataset, batch_sampler, _A.num_workers)
+        print(f"{name:>16} | {ratio * 100:>9.1f} | {padded_length:>13.1f}")
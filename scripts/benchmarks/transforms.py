@@ -0,0 +1,81 @@
+import argparse
+import glob
+import os
+import time
+
+import albumentations as alb
+
+from virtex.data.image_decoders import OpenCVDecoder
+from virtex.factories import ImageTransformsFactory
+
+
+# fmt: off
+parser = argparse.ArgumentParser(
+    description="""Measure time to apply every image transform of
+    ImageTransformsFactory to decoded images, one transform at a time (always
+    applied). Transforms are applied to images as they would be in a pipeline:
+    full size images for resize and crop transforms, and images of crop size
+    for the rest."""
+)
+parser.add_argument(
+    "-i", "--image-dir", default="datasets/coco/val2017",
+    help="Path to a directory of JPEG images.",
+)
+parser.add_argument(
+    "-n", "--num-images", type=int, default=200,
+    help="Number of images to apply every transform on.",
+)
+parser.add_argument(
+    "-s", "--crop-size", type=int, default=224,
+    help="Size of images after resize and crop transforms.",
+)
+parser.add_argument(
+    "-t", "--transforms", nargs="+", default=list(ImageTransformsFactory.PRODUCTS),
+    choices=list(ImageTransformsFactory.PRODUCTS),
+    help="Names of transforms to measure time with.",
+)
+# fmt: on
+
+
+def _create_transform(name: str, crop_size: int):
+    r"""Create a transform (always applied) with same arguments as datasets."""
+    if name.startswith("resize_center_crop"):
+        transform = ImageTransformsFactory.create(name, crop_size + 32, crop_size)
+    elif name == "smallest_resize":
+        transform = ImageTransformsFactory.create(name, crop_size + 32)
+    elif "resize" in name or "crop" in name:
+        transform = ImageTransformsFactory.create(name, crop_size)
+    else:
+        transform = ImageTransformsFactory.create(name)
+
+    transform.always_apply = True
+    return alb.Compose([transform])
+
+
+if __name__ == "__main__":
+    _A = parser.parse_args()
+
+    image_paths = sorted(glob.glob(os.path.join(_A.image_dir, "*.jpg")))
+    decoder = OpenCVDecoder()
+    full_images = [decoder.read(path) for path in image_paths[: _A.num_images]]
+
+    # Images of crop size, as seen by transforms after resize and crop.
+    center_crop = _create_transform("resize_center_crop", _A.crop_size)
+    crop_images = [center_crop(image=image)["image"] for image in full_images]
+
+    print(f"{'transform':>28} | {'input size':>10} | {'ms/image':>8}")
+    for name in _A.transforms:
+        transform = _create_transform(name, _A.crop_size)
+        resizes = "resize" in name or "crop" in name
+        images = full_images if resizes else crop_images
+
+        # Warm up (allocations, OpenCV thread pools) before measuring.
+        transform(image=images[0])
+
+        start_time = time.time()
+        for image in images:
+            transform(image=image)
+        elapsed = time.time() - start_time
+
+        input_size = "full" if resizes else f"{_A.crop_size}x{_A.crop_size}"
+        print(f"{name:>28} | {input_size:>10} | {elapsed / len(images) * 1000:>8.3f}")
@@ -0,0 +1,95 @@
+import argparse
+import time
+
+import torch
+from torch.utils.data import DataLoader
+
+from virtex.config import Config
+from virtex.data.device_transforms import ImageNormalize
+from virtex.factories import PretrainingDatasetFactory
+
+
+# fmt: off
+parser = argparse.ArgumentParser(
+    description="""Compare dataloading throughput with images normalized in
+    dataloader workers (float32 transport) and normalized on device (uint8
+    transport)."""
+)
+parser.add_argument(
+    "--config", default="configs/_base_bicaptioning_R_50_L1_H1024.yaml",
+    help="Path to a pretraining config file.",
+)
+parser.add_argument(
+    "--config-override", nargs="*", default=[],
+    help="A sequence of key-value pairs specifying certain config arguments.",
+)
+parser.add_argument(
+    "-s", "--split", choices=["train", "val"], default="train",
+    help="Which split to read the dataset from.",
+)
+parser.add_argument(
+    "-w", "--num-workers", type=int, default=4,
+    help="Number of dataloader workers.",
+)
+parser.add_argument(
+    "-b", "--batch-size", type=int, default=64,
+    help="Batch size of dataloader.",
+)
+parser.add_argument(
+    "-n", "--num-batches", type=int, default=50,
+    help="Number of batches to read in every setting.",
+)
+# fmt: on
+
+
+if __name__ == "__main__":
+    _A = parser.parse_args()
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    print(
+        f"{'images':>8} | {'MB/batch':>8} | {'images/sec':>10} | "
+        f"{'device ms/batch':>15}"
+    )
+    for normalize_on_device in [False, True]:
+        _C = Config(
+            _A.config,
+            _A.config_override + ["DATA.NORMALIZE_ON_DEVICE", normalize_on_device],
+        )
+        dataset = PretrainingDatasetFactory.from_config(_C, split=_A.split)
+        dataloader = DataLoader(
+            dataset,
+            batch_size=_A.batch_size,
+            shuffle=not isinstance(dataset, torch.utils.data.IterableDataset),
+            num_workers=_A.num_workers,
+            pin_memory=device.type == "cuda",
+            drop_last=True,
+            collate_fn=dataset.collate_fn,
+        )
+        image_normalize = ImageNormalize().to(device)
+
+        # Start timer after workers are spawned, with the first batch.
+        iterator = iter(dataloader)
+        batch = next(iterator)
+        image = batch["image"]
+        batch_megabytes = image.numel() * image.element_size() / 2 ** 20
+
+        num_batches, device_time = 0, 0.0
+        start_time = time.time()
+        for batch in iterator:
+            # Host to device transfer and normalization (no-op for floats).
+            device_start_time = time.time()
+            image = image_normalize(batch["image"].to(device, non_blocking=True))
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+            device_time += time.time() - device_start_time
+
+            num_batches += 1
+            if num_batches == _A.num_batches:
+                break
+
+        speed = num_batches * _A.batch_size / (time.time() - start_time)
+        print(
+            f"{'uint8' if normalize_on_device else 'float32':>8} | "
+            f"{batch_megabytes:>8.1f} | {speed:>10.1f} | "
+            f"{device_time / max(num_batches, 1) * 1000:>15.2f}"
+        )
@@ -53,7 +53,7 @@ def main(_A: argparse.Namespace):
 
     for val_iteration, val_batch in enumerate(val_dataloader, start=1):
         for key in val_batch:
-            val_batch[key] = val_batch[key].to(device)
+            val_batch[key] = val_batch[key].to(device, non_blocking=True)
 
         # Make a dictionary of predictions in COCO format.
         with torch.no_grad():
@@ -0,0 +1,78 @@
+import argparse
+import os
+import platform
+
+import lmdb
+from tqdm import tqdm
+
+from virtex.data import serialization
+from virtex.data.readers import LmdbReader
+
+
+# fmt: off
+parser = argparse.ArgumentParser(
+    description="""Convert a serialized LMDB file (for example, one with pickled
+    records) to another record format."""
+)
+parser.add_argument(
+    "-i", "--input", required=True,
+    help="Path to an existing serialized LMDB file, in any record format.",
+)
+parser.add_argument(
+    "-o", "--output", required=True,
+    help="Path to store the converted LMDB file.",
+)
+parser.add_argument(
+    "-f", "--image-format", choices=serialization.IMAGE_FORMATS, default="raw",
+    help="Record format of the converted LMDB file.",
+)
+parser.add_argument(
+    "-q", "--quality", type=int, default=90,
+    help="Quality of compressed images for `jpg` and `webp` formats.",
+)
+parser.add_argument(
+    "-b", "--commit-every", type=int, default=1000,
+    help="Number of records to write to LMDB in a single write transaction.",
+)
+# fmt: on
+
+
+if __name__ == "__main__":
+
+    _A = parser.parse_args()
+    os.makedirs(os.path.dirname(_A.output), exist_ok=True)
+
+    # Read all records in order (keys are not shuffled with 100% data).
+    reader = LmdbReader(_A.input, percentage=100.0)
+
+    map_size = 1099511627776 * 2 if platform.system() == "Linux" else 1280000
+    db = lmdb.open(
+        _A.output, map_size=map_size, subdir=False, meminit=False, map_async=True
+    )
+
+    # Keys are same as input LMDB file: integers (cast as string) from `0`.
+    txn = db.begin(write=True)
+    for idx in tqdm(range(len(reader)), unit="img"):
+        image_id, image, captions = reader[idx]
+        txn.put(
+            f"{idx}".encode("ascii"),
+            serialization.serialize_instance(
+                image_id,
+                image,
+                captions,
+                image_format=_A.image_format,
+                quality=_A.quality,
+            ),
+        )
+        if (idx + 1) % _A.commit_every == 0:
+            txn.commit()
+            txn = db.begin(write=True)
+
+    txn.put(
+        serialization.METADATA_KEY,
+        serialization.make_metadata(_A.image_format, len(reader)),
+    )
+    txn.commit()
+
+    db.sync()
+    db.close()
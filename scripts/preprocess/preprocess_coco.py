@@ -1,13 +1,21 @@
 import argparse
+import io
+import json
+import multiprocessing as mp
 import os
-import pickle
 import platform
+import tarfile
+import time
+from typing import Iterator, List, Optional, Tuple
 
 import albumentations as alb
 import lmdb
+import numpy as np
 from tqdm import tqdm
 
+from virtex.data import serialization
 from virtex.data.readers import SimpleCocoCaptionsReader
+from virtex.factories import ImageDecoderFactory
 
 
 # fmt: off
@@ -26,47 +34,286 @@ parser.add_argument(
     before serializing. Useful for saving disk memory, and faster read.
     If None, no images are resized."""
 )
+parser.add_argument(
+    "--image-decoder", choices=ImageDecoderFactory.PRODUCTS.keys(), default="opencv",
+    help="""Library to decode images with. With `--short-edge-size`, JPEGs are
+    decoded at a reduced scale (if much larger) before resizing them.""",
+)
 parser.add_argument(
     "-o", "--output", default="datasets/serialized/coco_train2017.lmdb",
-    help="Path to store the file containing serialized dataset.",
+    help="""Path to store the file containing serialized dataset. A side file
+    with captions only is also saved as `[output]_captions.json`.""",
+)
+parser.add_argument(
+    "-f", "--image-format", choices=serialization.IMAGE_FORMATS, default="pickle",
+    help="""Format to serialize images: `pickle` stores decoded arrays, others
+    store compressed image bytes (decoded while reading).""",
+)
+parser.add_argument(
+    "-q", "--quality", type=int, default=90,
+    help="Quality of compressed images for `jpg` and `webp` formats.",
+)
+parser.add_argument(
+    "--output-format", choices=["lmdb", "tar"], default="lmdb",
+    help="""Write the dataset as LMDB file(s) for random access, or as tar
+    shards (of compressed images) to be streamed sequentially. Tar shards are
+    always saved as `[output]-[shard]-of-[num_shards].tar`.""",
+)
+parser.add_argument(
+    "-n", "--num-shards", type=int, default=1,
+    help="""Number of LMDB files (shards) to split the dataset into. Shards are
+    saved as `[output]-[shard]-of-[num_shards].lmdb`, for example,
+    `serialized_train-00000-of-00008.lmdb` for `--output serialized_train.lmdb`.""",
+)
+parser.add_argument(
+    "-j", "--num-workers", type=int, default=4,
+    help="""Number of worker processes to decode and resize images in parallel.
+    Set as zero to serialize everything in the main process.""",
+)
+parser.add_argument(
+    "-b", "--commit-every", type=int, default=1000,
+    help="Number of records to write to LMDB in a single write transaction.",
 )
+# fmt: on
 
 
-if __name__ == "__main__":
+# Dataset reader, resize transform and serialization args of current worker
+# process. These are set once per process by `_init_worker` instead of pickling
+# them for every task.
+_DSET: Optional[SimpleCocoCaptionsReader] = None
+_RESIZE: Optional[alb.SmallestMaxSize] = None
+_IMAGE_FORMAT: str = "pickle"
+_QUALITY: int = 90
 
-    _A = parser.parse_args()
-    os.makedirs(os.path.dirname(_A.output), exist_ok=True)
 
-    dset = SimpleCocoCaptionsReader(_A.data_root, _A.split)
+def _init_worker(
+    dset: SimpleCocoCaptionsReader,
+    short_edge_size: Optional[int],
+    image_format: str,
+    quality: int,
+):
+    global _DSET, _RESIZE, _IMAGE_FORMAT, _QUALITY
+    _DSET = dset
+    _IMAGE_FORMAT = image_format
+    _QUALITY = quality
+
+    # Transform to resize shortest edge and keep aspect ratio same.
+    if short_edge_size is not None:
+        _RESIZE = alb.SmallestMaxSize(max_size=short_edge_size, always_apply=True)
+
+
+def _read_instance(idx: int) -> Tuple[int, np.ndarray, List[str]]:
+    r"""Read, decode (and optionally resize) an image with its captions."""
+    instance = _DSET[idx]
+
+    # Resize image from instance.
+    image = instance["image"]
+    if _RESIZE is not None:
+        image = _RESIZE(image=image)["image"]
+
+    return instance["image_id"], image, instance["captions"]
+
+
+def _encode_instance(idx: int) -> Tuple[int, bytes, List[str]]:
+    r"""
+    Read an image with its captions, and compress the image to bytes in an
+    image file format (``jpg``, ``png`` or ``webp``).
+    """
+    # Original COCO images are JPEGs: copy their bytes as-is if they need not
+    # be resized, instead of decoding and encoding them again.
+    if _IMAGE_FORMAT == "jpg" and _RESIZE is None:
+        image_id, filename = _DSET.id_filename[idx]
+        with open(filename, "rb") as image_file:
+            image_bytes = image_file.read()
+
+        return image_id, image_bytes, _DSET._id_to_captions[image_id]
+
+    image_id, image, captions = _read_instance(idx)
+    image_bytes = serialization.encode_image(image, _IMAGE_FORMAT, _QUALITY)
+    return image_id, image_bytes, captions
+
 
+def _serialize_instance(idx: int) -> bytes:
+    r"""
+    Read an image with its captions and serialize it to bytes of an LMDB
+    record. This is executed in worker processes, so the main process only has
+    to write these bytes to LMDB.
+    """
+    if _IMAGE_FORMAT in {"pickle", "raw"}:
+        image_id, image, captions = _read_instance(idx)
+        return serialization.serialize_instance(
+            image_id, image, captions, image_format=_IMAGE_FORMAT
+        )
+
+    return serialization.serialize_encoded_instance(*_encode_instance(idx))
+
+
+def _write_lmdb_shard(
+    path: str, length: int, serialized_instances: Iterator[bytes], progress_bar
+) -> int:
+    r"""
+    Write next ``length`` serialized instances to an LMDB file, and return the
+    total number of bytes written.
+    """
     # Open an LMDB database.
     # Set a sufficiently large map size for LMDB (based on platform).
     map_size = 1099511627776 * 2 if platform.system() == "Linux" else 1280000
     db = lmdb.open(
-        _A.output, map_size=map_size, subdir=False, meminit=False, map_async=True
+        path, map_size=map_size, subdir=False, meminit=False, map_async=True
     )
+    # Serialize each instance (as per `--image-format`). Key will be an integer
+    # (cast as string) starting from `0`. Only the main process writes to
+    # LMDB, and it commits a batch of records per transaction.
+    total_bytes = 0
+    txn = db.begin(write=True)
+    for idx in range(length):
+        instance_bytes = next(serialized_instances)
+        txn.put(f"{idx}".encode("ascii"), instance_bytes)
+        total_bytes += len(instance_bytes)
+        progress_bar.update(1)
 
-    # Transform to resize shortest edge and keep aspect ratio same.
-    if _A.short_edge_size is not None:
-        resize = alb.SmallestMaxSize(max_size=_A.short_edge_size, always_apply=True)
+        if (idx + 1) % _A.commit_every == 0:
+            txn.commit()
+            txn = db.begin(write=True)
+
+    # Record the format of serialized instances along with them.
+    txn.put(
+        serialization.METADATA_KEY,
+        serialization.make_metadata(_A.image_format, length),
+    )
+    txn.commit()
+
+    db.sync()
+    db.close()
+    return total_bytes
 
-    # Serialize each instance (as a dictionary). Use `pickle.dumps`. Key will
-    # be an integer (cast as string) starting from `0`.
-    for idx in tqdm(range(len(dset))):
 
-        # Convert dict to an (image_id, image, captions) tuple for compactness.
-        instance = dset[idx]
+def _write_tar_shard(
+    path: str,
+    length: int,
+    encoded_instances: Iterator[Tuple[int, bytes, List[str]]],
+    start_key: int,
+    progress_bar,
+) -> int:
+    r"""
+    Write next ``length`` encoded instances to a tar file, and return the total
+    number of bytes written. Every instance is saved as two consecutive files
+    with a common key (zero-padded index): image as ``[key].[image_format]``
+    and its image ID and captions as ``[key].json``.
+    """
+    total_bytes = 0
+    with tarfile.open(path, "w") as tar:
+        for key in range(start_key, start_key + length):
+            image_id, image_bytes, captions = next(encoded_instances)
+            json_bytes = json.dumps(
+                {"image_id": image_id, "captions": captions}
+            ).encode("utf-8")
 
-        # Resize image from instance and convert instance to tuple.
-        image = instance["image"]
-        if _A.short_edge_size is not None:
-            image = resize(image=image)["image"]
+            for name, data in [
+                (f"{key:09d}.{_A.image_format}", image_bytes),
+                (f"{key:09d}.json", json_bytes),
+            ]:
+                tarinfo = tarfile.TarInfo(name)
+                tarinfo.size = len(data)
+                tar.addfile(tarinfo, io.BytesIO(data))
+                total_bytes += len(data)
 
-        instance = (instance["image_id"], image, instance["captions"])
+            progress_bar.update(1)
 
-        txn = db.begin(write=True)
-        txn.put(f"{idx}".encode("ascii"), pickle.dumps(instance, protocol=-1))
-        txn.commit()
+    return total_bytes
 
-    db.sync()
-    db.close()
+
+if __name__ == "__main__":
+
+    _A = parser.parse_args()
+    os.makedirs(os.path.dirname(_A.output), exist_ok=True)
+
+    dset = SimpleCocoCaptionsReader(
+        _A.data_root,
+        _A.split,
+        image_decoder=ImageDecoderFactory.create(
+            _A.image_decoder, min_size=_A.short_edge_size
+        ),
+    )
+
+    if _A.output_format == "tar" and _A.image_format in {"pickle", "raw"}:
+        raise ValueError(
+            "Tar shards only store compressed images, use `--image-format` as "
+            "one of `jpg`, `png` or `webp`."
+        )
+
+    # Split instances into contiguous chunks of (almost) equal sizes, one per
+    # shard. Keys start from `0` in every LMDB shard, so each shard is a valid
+    # LMDB file on its own. Tar shards are always named with shard numbers.
+    output_prefix = os.path.splitext(_A.output)[0]
+    if _A.output_format == "tar":
+        shard_paths = [
+            f"{output_prefix}-{shard:05d}-of-{_A.num_shards:05d}.tar"
+            for shard in range(_A.num_shards)
+        ]
+    elif _A.num_shards > 1:
+        shard_paths = [
+            f"{output_prefix}-{shard:05d}-of-{_A.num_shards:05d}.lmdb"
+            for shard in range(_A.num_shards)
+        ]
+    else:
+        shard_paths = [_A.output]
+
+    shard_lengths = [
+        len(dset) // _A.num_shards + (1 if shard < len(dset) % _A.num_shards else 0)
+        for shard in range(_A.num_shards)
+    ]
+
+    # Decode and serialize instances in a pool of workers. `imap` preserves the
+    # order of inputs, so key of every instance is same as serial processing.
+    process_fn = _encode_instance if _A.output_format == "tar" else _serialize_instance
+    if _A.num_workers > 0:
+        pool = mp.Pool(
+            _A.num_workers,
+            initializer=_init_worker,
+            initargs=(dset, _A.short_edge_size, _A.image_format, _A.quality),
+        )
+        processed_instances = pool.imap(process_fn, range(len(dset)), chunksize=16)
+    else:
+        _init_worker(dset, _A.short_edge_size, _A.image_format, _A.quality)
+        processed_instances = map(process_fn, range(len(dset)))
+
+    progress_bar = tqdm(total=len(dset), unit="img")
+    start_time = time.time()
+    total_bytes = 0
+
+    start_key = 0
+    for shard_path, shard_length in zip(shard_paths, shard_lengths):
+        if _A.output_format == "tar":
+            total_bytes += _write_tar_shard(
+                shard_path, shard_length, processed_instances, start_key, progress_bar
+            )
+        else:
+            total_bytes += _write_lmdb_shard(
+                shard_path, shard_length, processed_instances, progress_bar
+            )
+        start_key += shard_length
+
+    progress_bar.close()
+
+    # Write a side file with image IDs and captions of all instances in same
+    # order as they are serialized, to read captions without images.
+    image_ids = [image_id for image_id, _ in dset.id_filename]
+    with open(f"{output_prefix}_captions.json", "w") as captions_file:
+        json.dump(
+            {
+                "image_ids": image_ids,
+                "captions": [dset._id_to_captions[i] for i in image_ids],
+            },
+            captions_file,
+        )
+    if _A.num_workers > 0:
+        pool.close()
+        pool.join()
+
+    elapsed = time.time() - start_time
+    print(
+        f"Serialized {len(dset)} instances ({total_bytes / 2 ** 20:.1f} MB) in "
+        f"{elapsed:.1f} sec: {len(dset) / elapsed:.1f} images/sec, "
+        f"{total_bytes / 2 ** 20 / elapsed:.1f} MB/sec."
+    )
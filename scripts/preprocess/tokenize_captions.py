@@ -0,0 +1,97 @@
+import argparse
+
+import albumentations as alb
+import numpy as np
+from tqdm import tqdm
+
+from virtex.data import transforms as T
+from virtex.data.readers import CaptionsReader
+from virtex.data.tokenizers import SentencePieceBPETokenizer
+
+
+# fmt: off
+parser = argparse.ArgumentParser(
+    description="""Normalize and tokenize all captions of a serialized dataset
+    once, and save them to be used directly by `CaptioningDataset` during
+    training (instead of tokenizing captions on the fly)."""
+)
+parser.add_argument(
+    "-c", "--captions", default="datasets/coco/serialized_train_captions.json",
+    help="""Path to captions side file written by `preprocess_coco.py` along
+    with serialized LMDB file(s).""",
+)
+parser.add_argument(
+    "-v", "--vocab", default="datasets/vocab/coco_10k.vocab",
+    help="Path to .vocab file generated by `sentencepiece`.",
+)
+parser.add_argument(
+    "-m", "--model", default="datasets/vocab/coco_10k.model",
+    help="Path to .model file generated by `sentencepiece`.",
+)
+parser.add_argument(
+    "-o", "--output", default="datasets/coco/serialized_train_tokens.npz",
+    help="Path to save tokenized captions (a numpy .npz file).",
+)
+# fmt: on
+
+
+if __name__ == "__main__":
+    _A = parser.parse_args()
+
+    tokenizer = SentencePieceBPETokenizer(_A.vocab, _A.model)
+    reader = CaptionsReader(_A.captions)
+
+    # Same transforms as `CaptioningDataset`, except truncation: captions are
+    # saved with full length, and truncated while reading.
+    caption_transform = alb.Compose(
+        [T.NormalizeCaption(), T.TokenizeCaption(tokenizer)]
+    )
+    flip = T.HorizontalFlip(p=1.0)
+
+    # Tokens of all captions are concatenated to a flat array, with offsets to
+    # slice each of them. Captions of an image are contiguous, images are
+    # sorted by their IDs for lookup by binary search.
+    image_ids = []
+    caption_starts = [0]
+    tokens, flipped_tokens = [], []
+    offsets, flipped_offsets = [0], [0]
+
+    # fmt: off
+    instances = sorted(
+        (reader[idx] for idx in range(len(reader))), key=lambda ins: ins[0]
+    )
+    for image_id, captions in tqdm(instances):
+        image_ids.append(image_id)
+        caption_starts.append(caption_starts[-1] + len(captions))
+
+        for caption in captions:
+            # Flipped caption has "left" and "right" swapped before tokenizing,
+            # exactly like `HorizontalFlip` followed by caption transforms.
+            caption_tokens = caption_transform(caption=caption)["caption"]
+            flipped_caption_tokens = caption_transform(
+                caption=flip.apply_to_caption(caption)
+            )["caption"]
+
+            tokens.extend(caption_tokens)
+            offsets.append(offsets[-1] + len(caption_tokens))
+            flipped_tokens.extend(flipped_caption_tokens)
+            flipped_offsets.append(flipped_offsets[-1] + len(flipped_caption_tokens))
+    # fmt: on
+
+    # Use the smallest integer type which can hold all token IDs.
+    token_dtype = np.int16 if tokenizer.get_vocab_size() <= 2 ** 15 else np.int32
+
+    np.savez(
+        _A.output,
+        image_ids=np.array(image_ids, dtype=np.int64),
+        caption_starts=np.array(caption_starts, dtype=np.int64),
+        tokens=np.array(tokens, dtype=token_dtype),
+        offsets=np.array(offsets, dtype=np.int64),
+        flipped_tokens=np.array(flipped_tokens, dtype=token_dtype),
+        flipped_offsets=np.array(flipped_offsets, dtype=np.int64),
+        tokenizer_hash=np.array(tokenizer.model_hash()),
+    )
+    print(
+        f"Saved {len(offsets) - 1} tokenized captions of {len(image_ids)} images "
+        f"to {_A.output}"
+    )
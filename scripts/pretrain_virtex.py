@@ -4,17 +4,25 @@ from collections import Counter
 from loguru import logger
 import torch
 from torch import nn
-from torch.utils.data import DataLoader, DistributedSampler
+from torch.utils.data import DataLoader, DistributedSampler, IterableDataset
 from torch.utils.tensorboard import SummaryWriter
 
 # fmt: off
 from virtex.config import Config
+from virtex.data.device_transforms import ImageNormalize
+from virtex.data.readers import ShardedLmdbReader
+from virtex.data.samplers import (
+    BucketedDistributedBatchSampler,
+    PrefetchingSampler,
+    ResumableDistributedSampler,
+    ShardedDistributedSampler,
+)
 from virtex.factories import (
     TokenizerFactory, PretrainingDatasetFactory, PretrainingModelFactory,
-    OptimizerFactory, LRSchedulerFactory,
+    OptimizerFactory, LRSchedulerFactory, DeviceTransformsFactory,
 )
 from virtex.utils.checkpointing import CheckpointManager
-from virtex.utils.common import common_parser, common_setup, cycle
+from virtex.utils.common import DataPrefetcher, common_parser, common_setup
 import virtex.utils.distributed as dist
 from virtex.utils.timer import Timer
 
@@ -61,14 +69,55 @@ def main(_A: argparse.Namespace):
     train_dataset = PretrainingDatasetFactory.from_config(_C, split="train")
     val_dataset = PretrainingDatasetFactory.from_config(_C, split="val")
 
+    # Sample batches of captions with similar lengths if bucketing by length.
+    # Else assign LMDB shards to processes if dataset is serialized in shards,
+    # or every process samples from the whole dataset. Streaming datasets split
+    # tar shards across processes by themselves, and do not use a sampler.
+    batch_size = _C.OPTIM.BATCH_SIZE // dist.get_world_size()
+    if _C.DATA.LENGTH_BUCKET_SIZE > 0:
+        if isinstance(train_dataset, IterableDataset):
+            raise ValueError("Bucketing by caption length needs random access.")
+
+        train_sampler = BucketedDistributedBatchSampler(
+            train_dataset.caption_lengths(),
+            batch_size,
+            shuffle=True,
+            drop_last=True,
+            bucket_size=_C.DATA.LENGTH_BUCKET_SIZE,
+        )
+    elif isinstance(train_dataset, IterableDataset):
+        train_sampler = None
+    elif isinstance(getattr(train_dataset, "reader", None), ShardedLmdbReader):
+        train_sampler = ShardedDistributedSampler(
+            train_dataset.reader.shard_lengths, shuffle=True
+        )
+    else:
+        train_sampler = ResumableDistributedSampler(train_dataset, shuffle=True)
+
+    # Prefetch records of upcoming indices into page cache, if dataset has an
+    # LMDB reader (not applicable for streaming datasets).
+    if _C.DATA.LMDB_PREFETCH > 0 and hasattr(
+        getattr(train_dataset, "reader", None), "prefetch"
+    ):
+        train_sampler = PrefetchingSampler(
+            train_sampler, train_dataset.reader, lookahead=_C.DATA.LMDB_PREFETCH
+        )
+
+    if _C.DATA.LENGTH_BUCKET_SIZE > 0:
+        train_sampler_kwargs = {"batch_sampler": train_sampler}
+    else:
+        train_sampler_kwargs = {
+            "batch_size": batch_size,
+            "sampler": train_sampler,
+            "drop_last": True,
+        }
+
     train_dataloader = DataLoader(
         train_dataset,
-        batch_size=_C.OPTIM.BATCH_SIZE // dist.get_world_size(),
-        sampler=DistributedSampler(train_dataset, shuffle=True),
         num_workers=_A.cpu_workers,
         pin_memory=True,
-        drop_last=True,
         collate_fn=train_dataset.collate_fn,
+        **train_sampler_kwargs,
     )
     val_dataloader = DataLoader(
         val_dataset,
@@ -81,6 +130,16 @@ def main(_A: argparse.Namespace):
     )
 
     model = PretrainingModelFactory.from_config(_C).to(device)
+
+    # Normalize `uint8` images on device, if they are not normalized in workers.
+    image_normalize = None
+    if _C.DATA.NORMALIZE_ON_DEVICE:
+        image_normalize = ImageNormalize().to(device)
+
+    # Augment training batches on device, if workers only resize images.
+    device_transform = None
+    if _C.DATA.AUGMENT_ON_DEVICE:
+        device_transform = DeviceTransformsFactory.from_config(_C).to(device)
     optimizer = OptimizerFactory.from_config(_C, model.named_parameters())
     scheduler = LRSchedulerFactory.from_config(_C, optimizer)
 
@@ -96,13 +155,19 @@ def main(_A: argparse.Namespace):
     else:
         start_iteration = 0
 
+    # Create an iterator from dataloader to sample batches perpetually. Next
+    # batch is transferred to device while model runs on the current batch.
+    # Its position in epoch is derived from `start_iteration`, and restored
+    # exactly from checkpoint if saved there (to resume mid-epoch).
+    train_dataloader_iter = DataPrefetcher(train_dataloader, device, start_iteration)
+    if _A.resume_from is not None:
+        CheckpointManager(dataloader=train_dataloader_iter).load(_A.resume_from)
+
     # Keep track of time per iteration and ETA.
     timer = Timer(
         start_from=start_iteration + 1,
         total_iterations=_C.OPTIM.NUM_ITERATIONS,
     )
-    # Create an iterator from dataloader to sample batches perpetually.
-    train_dataloader_iter = cycle(train_dataloader, device, start_iteration)
 
     # Wrap model and optimizer using NVIDIA Apex for mixed precision training.
     # NOTE: Always do this before wrapping model with DistributedDataParallel.
@@ -127,6 +192,7 @@ def main(_A: argparse.Namespace):
             model=model,
             optimizer=optimizer,
             scheduler=scheduler,
+            dataloader=train_dataloader_iter,
         )
         tensorboard_writer = SummaryWriter(log_dir=_A.serialization_dir)
         tensorboard_writer.add_text("config", f"```\n{_C}\n```")
@@ -141,6 +207,11 @@ def main(_A: argparse.Namespace):
         batch_loss = torch.tensor(0.0, device=device)
 
         batch = next(train_dataloader_iter)
+        if device_transform is not None:
+            batch = device_transform(batch)
+        if image_normalize is not None:
+            batch["image"] = image_normalize(batch["image"])
+
         output_dict = model(batch)
 
         loss = output_dict["loss"]
@@ -167,8 +238,12 @@ def main(_A: argparse.Namespace):
         # ---------------------------------------------------------------------
         if iteration % _A.log_every == 0 and dist.is_master_process():
             logger.info(
-                f"{timer.stats} | Loss: {batch_loss:.3f} | "
-                f"GPU mem: {dist.gpu_mem_usage()} MB"
+                f"{timer.stats} | Data wait: "
+                f"{train_dataloader_iter.wait_time:.3f} sec | "
+                f"Loss: {batch_loss:.3f} | GPU mem: {dist.gpu_mem_usage()} MB"
+            )
+            tensorboard_writer.add_scalar(
+                "data_wait_time", train_dataloader_iter.wait_time, iteration
             )
             tensorboard_writer.add_scalars(
                 "learning_rate",
@@ -198,7 +273,9 @@ def main(_A: argparse.Namespace):
 
             for val_iteration, val_batch in enumerate(val_dataloader, start=1):
                 for key in val_batch:
-                    val_batch[key] = val_batch[key].to(device)
+                    val_batch[key] = val_batch[key].to(device, non_blocking=True)
+                if image_normalize is not None:
+                    val_batch["image"] = image_normalize(val_batch["image"])
                 output_dict = model(val_batch)
 
                 # This will have a key named "loss_components": these are
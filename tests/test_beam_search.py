@@ -0,0 +1,225 @@
+import functools
+
+import pytest
+import torch
+from torch.nn import functional as F
+
+from virtex.models.captioning import CaptioningModel
+from virtex.modules.textual_heads import TransformerTextualHead
+from virtex.modules.visual_backbones import BlindVisualBackbone
+from virtex.utils.beam_search import AutoRegressiveBeamSearch
+
+
+VOCAB_SIZE = 50
+HIDDEN_SIZE = 32
+SOS_INDEX, EOS_INDEX = 1, 2
+
+
+def _captioning_model(norm_type: str) -> CaptioningModel:
+    r"""
+    Make a small captioning model in eval mode (no dropout), with double
+    precision so that different orders of operations give same predictions.
+    """
+    torch.manual_seed(0)
+    textual = TransformerTextualHead(
+        VOCAB_SIZE,
+        HIDDEN_SIZE,
+        num_layers=2,
+        attention_heads=4,
+        feedforward_size=4 * HIDDEN_SIZE,
+        norm_type=norm_type,
+    )
+    model = CaptioningModel(
+        BlindVisualBackbone(HIDDEN_SIZE),
+        textual,
+        sos_index=SOS_INDEX,
+        eos_index=EOS_INDEX,
+    )
+    return model.double().eval()
+
+
+def _full_step(model: CaptioningModel, visual_features: torch.Tensor):
+    r"""
+    Make a step function which runs a full forward pass of textual head over
+    all tokens of partial captions (with visual features repeated for every
+    beam) and keeps log probs at the last position, like decoding without a
+    cache of keys and values.
+    """
+
+    def step(partial_captions: torch.Tensor) -> torch.Tensor:
+        # Only the start token at first time-step.
+        if partial_captions.dim() == 1:
+            partial_captions = partial_captions.unsqueeze(1)
+
+        group_size, timesteps = partial_captions.size()
+        features = visual_features.repeat_interleave(
+            group_size // visual_features.size(0), dim=0
+        )
+        lengths = partial_captions.new_full((group_size,), timesteps)
+        logits = model.textual(partial_captions, lengths, features)
+
+        logprobs = F.log_softmax(logits[:, -1], dim=1)
+        return model.repetition_penalty(logprobs, partial_captions)
+
+    return step
+
+
+@pytest.mark.parametrize("norm_type", ["pre", "post"])
+@pytest.mark.parametrize("beam_size", [1, 5])
+@torch.no_grad()
+def test_search_with_start_state_matches_full_step(norm_type, beam_size):
+    model = _captioning_model(norm_type)
+    batch_size, max_steps = 4, 8
+
+    visual_features = torch.randn(batch_size, 7, HIDDEN_SIZE, dtype=torch.double)
+    start_predictions = torch.full((batch_size,), SOS_INDEX, dtype=torch.long)
+    beam_search = AutoRegressiveBeamSearch(
+        EOS_INDEX, max_steps=max_steps, beam_size=beam_size
+    )
+    expected_predictions, expected_log_probs = beam_search.search(
+        start_predictions, _full_step(model, visual_features)
+    )
+    # Incremental step function of model, with a cache in state.
+    context = model.textual.make_decoding_context(visual_features)
+    predictions, log_probs = beam_search.search(
+        start_predictions,
+        functools.partial(model.decoding_step, context),
+        start_state={},
+    )
+    assert predictions.size() == (batch_size, beam_size, max_steps)
+    assert torch.equal(predictions, expected_predictions)
+    torch.testing.assert_close(log_probs, expected_log_probs)
+
+
+class _Context(object):
+    r"""
+    Context of a synthetic step function: logits over vocabulary for every
+    example and time-step, and a record of group sizes it is called with.
+    """
+
+    def __init__(self, logits: torch.Tensor, group_sizes=None):
+        self.logits = logits
+        self.group_sizes = [] if group_sizes is None else group_sizes
+
+    def index_select(self, indices: torch.Tensor) -> "_Context":
+        return _Context(self.logits.index_select(0, indices), self.group_sizes)
+
+
+def _synthetic_context(finish_steps, max_steps: int) -> _Context:
+    r"""
+    Make random logits for every example, such that all its beams predict the
+    end token at a given time-step (``None`` to never predict it).
+    """
+    torch.manual_seed(0)
+    logits = torch.randn(len(finish_steps), max_steps, VOCAB_SIZE)
+    logits[:, :, EOS_INDEX] = -100.0
+    for example, finish_step in enumerate(finish_steps):
+        if finish_step is not None:
+            logits[example, finish_step:, EOS_INDEX] = 100.0
+    return _Context(logits)
+
+
+def _synthetic_step(context: _Context, last_predictions: torch.Tensor, state):
+    r"""
+    Return log probs from context at the time-step of every partial caption,
+    which is counted in state. Logits do not depend on predicted tokens, this
+    only checks bookkeeping of examples and beams.
+    """
+    group_size = last_predictions.size(0)
+    context.group_sizes.append(group_size)
+
+    # shape: (group_size, max_steps, vocab_size)
+    logits = context.logits.repeat_interleave(
+        group_size // context.logits.size(0), dim=0
+    )
+    timesteps = state["timesteps"]
+    logits = logits[torch.arange(group_size), timesteps.squeeze(1)]
+    return F.log_softmax(logits, dim=1), {"timesteps": timesteps + 1}
+
+
+@pytest.mark.parametrize("beam_size", [1, 5])
+def test_search_drops_finished_examples(beam_size):
+    # Examples finish at different time-steps, last one never finishes.
+    finish_steps, max_steps = [1, 3, None, 5], 8
+    batch_size = len(finish_steps)
+
+    start_predictions = torch.full((batch_size,), SOS_INDEX, dtype=torch.long)
+    start_state = {"timesteps": torch.zeros(batch_size, 1, dtype=torch.long)}
+    beam_search = AutoRegressiveBeamSearch(
+        EOS_INDEX, max_steps=max_steps, beam_size=beam_size
+    )
+    # Step function gets same context for all time-steps, if it is not passed
+    # to beam search (no examples are dropped).
+    full_context = _synthetic_context(finish_steps, max_steps)
+    expected_predictions, expected_log_probs = beam_search.search(
+        start_predictions,
+        functools.partial(_synthetic_step, full_context),
+        start_state=start_state,
+    )
+    context = _synthetic_context(finish_steps, max_steps)
+    predictions, log_probs = beam_search.search(
+        start_predictions, _synthetic_step, start_state=start_state, context=context
+    )
+    assert torch.equal(predictions, expected_predictions)
+    torch.testing.assert_close(log_probs, expected_log_probs)
+
+    # Captions end at their finish steps, and step function only runs for
+    # examples which are not finished.
+    for example, finish_step in enumerate(finish_steps):
+        if finish_step is not None:
+            assert (predictions[example, :, finish_step] == EOS_INDEX).all()
+            assert (predictions[example, :, :finish_step] != EOS_INDEX).all()
+
+    assert full_context.group_sizes == [batch_size] + [batch_size * beam_size] * (
+        max_steps - 1
+    )
+    assert context.group_sizes == [batch_size] + [
+        beam_size * sum(step is None or step >= timestep for step in finish_steps)
+        for timestep in range(1, max_steps)
+    ]
+
+
+@pytest.mark.parametrize("length_penalty", [0.0, 1.0])
+def test_search_ranks_beams_by_normalized_log_probs(length_penalty):
+    finish_steps, max_steps, beam_size = [1, 3, None, 5], 8, 5
+    batch_size = len(finish_steps)
+
+    # Make beams of an example end at different time-steps.
+    context = _synthetic_context(finish_steps, max_steps)
+    context.logits[:, 1:, EOS_INDEX] = context.logits[:, 1:].max(dim=2)[0] - 0.5
+
+    start_predictions = torch.full((batch_size,), SOS_INDEX, dtype=torch.long)
+    start_state = {"timesteps": torch.zeros(batch_size, 1, dtype=torch.long)}
+    unnormalized_predictions, unnormalized_log_probs = AutoRegressiveBeamSearch(
+        EOS_INDEX, max_steps=max_steps, beam_size=beam_size
+    ).search(start_predictions, _synthetic_step, start_state, context)
+    predictions, log_probs = AutoRegressiveBeamSearch(
+        EOS_INDEX,
+        max_steps=max_steps,
+        beam_size=beam_size,
+        length_penalty=length_penalty,
+    ).search(start_predictions, _synthetic_step, start_state, context)
+
+    # Beams are same, sorted by normalized log probs (no change in ranking and
+    # log probs without normalization).
+    assert (log_probs[:, :-1] >= log_probs[:, 1:]).all()
+    if length_penalty == 0.0:
+        assert torch.equal(predictions, unnormalized_predictions)
+        assert torch.equal(log_probs, unnormalized_log_probs)
+
+    is_end = (predictions == EOS_INDEX).long()
+    lengths = (is_end.cumsum(dim=2) == 0).sum(dim=2) + 1
+    lengths = lengths.clamp(max=predictions.size(2))
+    for example in range(batch_size):
+        expected = {
+            tuple(caption.tolist()): log_prob.item()
+            for caption, log_prob in zip(
+                unnormalized_predictions[example], unnormalized_log_probs[example]
+            )
+        }
+        for caption, log_prob, length in zip(
+            predictions[example], log_probs[example], lengths[example]
+        ):
+            assert log_prob.item() == pytest.approx(
+                expected[tuple(caption.tolist())] / length.item() ** length_penalty
+            )
@@ -0,0 +1,173 @@
+import functools
+
+import pytest
+import torch
+
+from virtex.models.captioning import CaptioningModel
+from virtex.modules.textual_heads import TransformerTextualHead
+from virtex.modules.visual_backbones import BlindVisualBackbone
+from virtex.utils.beam_search import AutoRegressiveBeamSearch
+from virtex.utils.decoding import (
+    AutoRegressiveGreedySearch,
+    AutoRegressiveSampling,
+    RepetitionPenalty,
+)
+
+
+VOCAB_SIZE = 50
+HIDDEN_SIZE = 32
+SOS_INDEX, EOS_INDEX = 1, 2
+
+
+def _captioning_model() -> CaptioningModel:
+    r"""
+    Make a small captioning model in eval mode, with double precision. Weights
+    are larger than usual initialization so that predictions depend on visual
+    features, and captions of some images end before others.
+    """
+    torch.manual_seed(0)
+    textual = TransformerTextualHead(
+        VOCAB_SIZE,
+        HIDDEN_SIZE,
+        num_layers=2,
+        attention_heads=4,
+        feedforward_size=4 * HIDDEN_SIZE,
+    )
+    for parameter in textual.parameters():
+        if parameter.dim() > 1:
+            parameter.data.normal_(mean=0.0, std=0.3)
+    model = CaptioningModel(
+        BlindVisualBackbone(HIDDEN_SIZE),
+        textual,
+        sos_index=SOS_INDEX,
+        eos_index=EOS_INDEX,
+    )
+    return model.double().eval()
+
+
+def _search(decoder, model: CaptioningModel, visual_features: torch.Tensor, **kwargs):
+    r"""Decode captions with the incremental step function of model."""
+    start_predictions = torch.full(
+        (visual_features.size(0),), SOS_INDEX, dtype=torch.long
+    )
+    context = model.textual.make_decoding_context(visual_features)
+    if kwargs.pop("drop_finished", True):
+        kwargs["context"] = context
+        step = model.decoding_step
+    else:
+        step = functools.partial(model.decoding_step, context)
+
+    return decoder.search(start_predictions, step, start_state={}, **kwargs)
+
+
+@pytest.mark.parametrize("drop_finished", [True, False])
+@torch.no_grad()
+def test_greedy_search_matches_beam_size_one(drop_finished):
+    model = _captioning_model()
+    visual_features = torch.randn(8, 7, HIDDEN_SIZE, dtype=torch.double)
+
+    expected_predictions, expected_log_probs = _search(
+        AutoRegressiveBeamSearch(EOS_INDEX, max_steps=12, beam_size=1),
+        model,
+        visual_features,
+        drop_finished=drop_finished,
+    )
+    predictions, log_probs = _search(
+        AutoRegressiveGreedySearch(EOS_INDEX, max_steps=12),
+        model,
+        visual_features,
+        drop_finished=drop_finished,
+    )
+    assert predictions.size() == expected_predictions.size()
+    assert torch.equal(predictions, expected_predictions)
+    torch.testing.assert_close(log_probs, expected_log_probs)
+
+
+@torch.no_grad()
+def test_greedy_search_ends_captions_at_different_steps():
+    # Make sure the test above covers captions which end at different steps.
+    model = _captioning_model()
+    visual_features = torch.randn(8, 7, HIDDEN_SIZE, dtype=torch.double)
+
+    predictions, _ = _search(
+        AutoRegressiveGreedySearch(EOS_INDEX, max_steps=12), model, visual_features
+    )
+    caption_lengths = (predictions[:, 0] != EOS_INDEX).sum(dim=1)
+    assert caption_lengths.unique().numel() > 2
+
+
+@torch.no_grad()
+def test_top_k_sampling_with_one_token_matches_greedy_search():
+    model = _captioning_model()
+    visual_features = torch.randn(8, 7, HIDDEN_SIZE, dtype=torch.double)
+
+    expected_predictions, expected_log_probs = _search(
+        AutoRegressiveGreedySearch(EOS_INDEX, max_steps=12), model, visual_features
+    )
+    predictions, log_probs = _search(
+        AutoRegressiveSampling(EOS_INDEX, max_steps=12, top_k=1),
+        model,
+        visual_features,
+    )
+    assert torch.equal(predictions, expected_predictions)
+    torch.testing.assert_close(log_probs, expected_log_probs)
+
+
+def test_deprecated_beam_search_aliases():
+    model = _captioning_model()
+    with pytest.warns(DeprecationWarning):
+        assert model.beam_search is model.decoder
+
+    decoder = AutoRegressiveGreedySearch(EOS_INDEX)
+    with pytest.warns(DeprecationWarning):
+        model.beam_search = decoder
+    assert model.decoder is decoder
+
+
+def _looped_repetition_penalty(
+    logprobs: torch.Tensor,
+    partial_captions: torch.Tensor,
+    block_last_token: bool,
+    no_repeat_ngram_size: int,
+    penalty: float,
+) -> torch.Tensor:
+    r"""Reference of :class:`RepetitionPenalty` with a loop over captions."""
+    logprobs = logprobs.clone()
+    size = no_repeat_ngram_size
+    for row, caption in enumerate(partial_captions.tolist()):
+        blocked = {caption[-1]} if block_last_token else set()
+        if size > 0:
+            prefix = caption[len(caption) - size + 1 :] if size > 1 else []
+            for start in range(len(caption) - size + 1):
+                if caption[start : start + size - 1] == prefix:
+                    blocked.add(caption[start + size - 1])
+
+        for token in blocked:
+            logprobs[row, token] = penalty
+    return logprobs
+
+
+@pytest.mark.parametrize("no_repeat_ngram_size", [0, 1, 2, 3])
+@pytest.mark.parametrize("timesteps", [1, 2, 3, 12])
+@pytest.mark.parametrize("block_last_token", [True, False])
+def test_repetition_penalty_matches_looped_reference(
+    no_repeat_ngram_size, timesteps, block_last_token
+):
+    torch.manual_seed(timesteps)
+    # Small vocabulary, so that partial captions repeat tokens and n-grams.
+    logprobs = torch.randn(64, 6).log_softmax(dim=1)
+    partial_captions = torch.randint(0, 6, (64, timesteps))
+
+    repetition_penalty = RepetitionPenalty(
+        block_last_token=block_last_token,
+        no_repeat_ngram_size=no_repeat_ngram_size,
+        penalty=-1000.0,
+    )
+    expected = _looped_repetition_penalty(
+        logprobs,
+        partial_captions,
+        block_last_token,
+        no_repeat_ngram_size,
+        penalty=-1000.0,
+    )
+    assert torch.equal(repetition_penalty(logprobs.clone(), partial_captions), expected)
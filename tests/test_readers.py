@@ -0,0 +1,156 @@
+import io
+import json
+import os
+import tarfile
+from typing import List
+
+import cv2
+import lmdb
+import numpy as np
+import pytest
+from torch.utils.data import DataLoader
+
+from virtex.data import serialization
+from virtex.data.readers import LmdbReader, ShardedLmdbReader, TarShardReader
+from virtex.utils.common import _epochs
+
+
+def _write_lmdb(path: str, records: List[bytes], image_format: str = "png") -> str:
+    r"""Write serialized records to an LMDB file like ``preprocess_coco.py``."""
+    env = lmdb.open(path, map_size=1 << 24, subdir=False)
+    with env.begin(write=True) as txn:
+        for idx, record in enumerate(records):
+            txn.put(f"{idx}".encode("ascii"), record)
+        txn.put(
+            serialization.METADATA_KEY,
+            serialization.make_metadata(image_format, len(records)),
+        )
+    env.close()
+    return path
+
+
+def _encoded_record(image_id: int, image_format: str = "png") -> bytes:
+    image = np.full((4, 4, 3), image_id % 256, dtype=np.uint8)
+    return serialization.serialize_instance(
+        image_id, image, [f"caption {image_id}"], image_format
+    )
+
+
+def _write_tar_shards(directory: str, shard_lengths: List[int]) -> List[str]:
+    r"""
+    Write tar shards like ``preprocess_coco.py``, with a tiny image and image
+    ID of every datapoint. Image IDs are ``1000 * shard + index``.
+    """
+    _, image_bytes = cv2.imencode(".png", np.zeros((4, 4, 3), dtype=np.uint8))
+
+    tar_paths = []
+    for shard, length in enumerate(shard_lengths):
+        tar_path = os.path.join(directory, f"shard-{shard:05d}.tar")
+        with tarfile.open(tar_path, "w") as tar:
+            for index in range(length):
+                annotations = {"image_id": 1000 * shard + index, "captions": []}
+                files = {
+                    f"{shard}_{index}.png": image_bytes.tobytes(),
+                    f"{shard}_{index}.json": json.dumps(annotations).encode(),
+                }
+                for name, data in files.items():
+                    tarinfo = tarfile.TarInfo(name)
+                    tarinfo.size = len(data)
+                    tar.addfile(tarinfo, io.BytesIO(data))
+
+        tar_paths.append(tar_path)
+    return tar_paths
+
+
+def _collate_image_ids(datapoints):
+    return [image_id for image_id, _, _ in datapoints]
+
+
+def test_tar_shards_are_read_once_per_epoch_by_all_ranks(tmp_path):
+    # Shards have different lengths, so ranks finish epochs at different
+    # iterations (with a batch size of two).
+    shard_lengths = [5, 4, 4, 4, 3, 4]
+    tar_paths = _write_tar_shards(str(tmp_path), shard_lengths)
+
+    world_size, num_epochs = 2, 2
+    image_ids_per_epoch = [[] for _ in range(num_epochs)]
+
+    for rank in range(world_size):
+        reader = TarShardReader(tar_paths, shuffle_buffer_size=3)
+        reader.rank, reader.world_size = rank, world_size
+        dataloader = DataLoader(reader, batch_size=2, collate_fn=_collate_image_ids)
+
+        # Count epochs of this rank by change in seed yielded with batches.
+        seeds = []
+        for seed, image_ids in _epochs(dataloader):
+            if seed not in seeds:
+                seeds.append(seed)
+            if len(seeds) > num_epochs:
+                break
+            image_ids_per_epoch[len(seeds) - 1].extend(image_ids)
+
+    all_image_ids = sorted(
+        1000 * shard + index
+        for shard, length in enumerate(shard_lengths)
+        for index in range(length)
+    )
+    for image_ids in image_ids_per_epoch:
+        assert sorted(image_ids) == all_image_ids
+
+
+def test_tar_shards_must_be_divisible_by_workers(tmp_path):
+    tar_paths = _write_tar_shards(str(tmp_path), [2, 2, 2])
+
+    reader = TarShardReader(tar_paths)
+    reader.rank, reader.world_size = 0, 2
+    with pytest.raises(ValueError):
+        next(iter(reader))
+
+    # Every shard is read once without shuffling, irrespective of split.
+    reader = TarShardReader(tar_paths, shuffle=False)
+    reader.rank, reader.world_size = 1, 2
+    assert [image_id for image_id, _, _ in reader] == [1000, 1001]
+
+
+def test_lmdb_reader_names_key_of_corrupt_record(tmp_path):
+    # Second record has a valid header and captions, but corrupt image bytes.
+    corrupt_record = _encoded_record(1)[:-20] + bytes(20)
+    lmdb_path = _write_lmdb(
+        str(tmp_path / "serialized.lmdb"), [_encoded_record(0), corrupt_record]
+    )
+    reader = LmdbReader(lmdb_path)
+    assert reader[0][0] == 0
+
+    with pytest.raises(ValueError, match="key 1"):
+        reader[1]
+
+
+def test_decode_image_rejects_corrupt_bytes():
+    with pytest.raises(ValueError):
+        serialization.decode_image(b"not an image")
+
+
+def test_sharded_lmdb_reader_set_keys(tmp_path):
+    # Two shards with three and two records, image IDs are global keys.
+    lmdb_paths = [
+        _write_lmdb(
+            str(tmp_path / f"serialized-{shard}.lmdb"),
+            [_encoded_record(image_id) for image_id in image_ids],
+        )
+        for shard, image_ids in enumerate([[0, 1, 2], [3, 4]])
+    ]
+    reader = ShardedLmdbReader(lmdb_paths)
+    assert reader.get_keys().tolist() == [0, 1, 2, 3, 4]
+
+    # Keys are split into shards, and indexed in order of shards.
+    reader.set_keys([4, 0, 2])
+    assert reader.get_keys().tolist() == [0, 2, 4]
+    assert reader.shard_lengths == [2, 1]
+    assert [reader[idx][0] for idx in range(len(reader))] == [0, 2, 4]
+
+    # Binary keys from older checkpoints are supported.
+    reader.set_keys([b"1", b"3"])
+    assert [reader[idx][0] for idx in range(len(reader))] == [1, 3]
+
+    with pytest.raises(ValueError):
+        reader.set_keys([5])
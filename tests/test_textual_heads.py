@@ -0,0 +1,98 @@
+import pytest
+import torch
+
+from virtex.modules.textual_heads import TransformerTextualHead
+
+
+VOCAB_SIZE = 50
+HIDDEN_SIZE = 32
+
+
+def _textual_head(norm_type: str) -> TransformerTextualHead:
+    r"""
+    Make a small textual head in eval mode (no dropout), with double precision
+    so that different orders of operations give (nearly) same logits.
+    """
+    torch.manual_seed(0)
+    head = TransformerTextualHead(
+        VOCAB_SIZE,
+        HIDDEN_SIZE,
+        num_layers=2,
+        attention_heads=4,
+        feedforward_size=4 * HIDDEN_SIZE,
+        norm_type=norm_type,
+    )
+    return head.double().eval()
+
+
+@pytest.mark.parametrize("norm_type", ["pre", "post"])
+@torch.no_grad()
+def test_forward_step_matches_forward(norm_type):
+    head = _textual_head(norm_type)
+    batch_size, num_tokens = 3, 8
+
+    visual_features = torch.randn(batch_size, 7, HIDDEN_SIZE, dtype=torch.double)
+    # Avoid padding index (zero), embeddings of padding tokens are zeroed.
+    caption_tokens = torch.randint(1, VOCAB_SIZE, (batch_size, num_tokens))
+    caption_lengths = torch.full((batch_size,), num_tokens, dtype=torch.long)
+
+    # shape: (batch_size, num_tokens, vocab_size)
+    expected_logits = head(caption_tokens, caption_lengths, visual_features)
+
+    context = head.make_decoding_context(visual_features)
+    cache = {}
+    for timestep in range(num_tokens):
+        logits, cache = head.forward_step(caption_tokens[:, timestep], context, cache)
+        assert cache["keys_0"].size(1) == timestep + 1
+
+        torch.testing.assert_close(logits, expected_logits[:, timestep])
+
+        # Logits of full forward pass over the partial caption, at its last
+        # position (like decoding without a cache).
+        partial_logits = head(
+            caption_tokens[:, : timestep + 1],
+            caption_lengths.clamp(max=timestep + 1),
+            visual_features,
+        )
+        torch.testing.assert_close(logits, partial_logits[:, -1])
+
+
+@pytest.mark.parametrize("norm_type", ["pre", "post"])
+@torch.no_grad()
+def test_forward_step_with_groups_matches_repeated_memory(norm_type):
+    head = _textual_head(norm_type)
+    batch_size, group_size, num_tokens = 2, 5, 6
+
+    visual_features = torch.randn(batch_size, 7, HIDDEN_SIZE, dtype=torch.double)
+    caption_tokens = torch.randint(
+        1, VOCAB_SIZE, (batch_size * group_size, num_tokens)
+    )
+    # Context of every image is shared by its group of partial captions, it
+    # should give same logits as repeating visual features for each of them.
+    context = head.make_decoding_context(visual_features)
+    repeated_context = head.make_decoding_context(
+        visual_features.repeat_interleave(group_size, dim=0)
+    )
+    assert context.batch_size == batch_size
+    cache, repeated_cache = {}, {}
+    for timestep in range(num_tokens):
+        logits, cache = head.forward_step(caption_tokens[:, timestep], context, cache)
+        repeated_logits, repeated_cache = head.forward_step(
+            caption_tokens[:, timestep], repeated_context, repeated_cache
+        )
+        torch.testing.assert_close(logits, repeated_logits)
+
+
+@torch.no_grad()
+def test_decoding_context_index_select():
+    head = _textual_head("pre")
+    visual_features = torch.randn(4, 7, HIDDEN_SIZE, dtype=torch.double)
+    indices = torch.tensor([3, 1])
+
+    context = head.make_decoding_context(visual_features).index_select(indices)
+    expected = head.make_decoding_context(visual_features[indices])
+    assert context.batch_size == 2
+    for key, expected_key in zip(context.memory_keys, expected.memory_keys):
+        torch.testing.assert_close(key, expected_key)
+    for value, expected_value in zip(context.memory_values, expected.memory_values):
+        torch.testing.assert_close(value, expected_value)
@@ -0,0 +1,144 @@
+import random
+
+import albumentations as alb
+import cv2
+import numpy as np
+import pytest
+
+from virtex.data import transforms as T
+
+
+# Typical sizes (height, width) of COCO and ImageNet images, and a few extremes.
+IMAGE_SIZES = [
+    (480, 640),
+    (640, 480),
+    (375, 500),
+    (333, 500),
+    (427, 640),
+    (1024, 768),
+    (300, 1000),
+    (256, 256),
+]
+
+
+def _photo_like_image(height: int, width: int, seed: int = 0) -> np.ndarray:
+    r"""
+    Make an image with smooth regions (like photos) and fine noise, so both
+    interpolation weights and sampling positions affect resized pixels.
+    """
+    rng = np.random.RandomState(seed)
+    coarse = rng.randint(0, 256, (height // 8 + 1, width // 8 + 1, 3), np.uint8)
+    image = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    noise = rng.randint(-40, 40, image.shape)
+    return np.clip(image.astype(np.int64) + noise, 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize("height, width", IMAGE_SIZES)
+def test_resize_center_crop_matches_unfused(height, width):
+    image = _photo_like_image(height, width)
+
+    expected = alb.Compose([alb.SmallestMaxSize(256), T.CenterSquareCrop(224)])(
+        image=image
+    )["image"]
+    fused = T.ResizeCenterCropNormalize(256, 224)(image=image)["image"]
+    assert fused.shape == expected.shape == (224, 224, 3)
+    assert fused.dtype == np.uint8
+
+    # `cv2.warpAffine` quantizes sampling positions to 1/32 pixel, unlike
+    # `cv2.resize`: allow a few levels on rare pixels, one level on others.
+    difference = np.abs(fused.astype(np.int64) - expected.astype(np.int64))
+    assert difference.max() <= 3
+    assert (difference > 1).mean() <= 0.01
+    assert difference.mean() <= 0.5
+
+
+@pytest.mark.parametrize("height, width", IMAGE_SIZES)
+def test_resize_center_crop_normalize_matches_default_transform(height, width):
+    image = _photo_like_image(height, width)
+
+    # Default transform is the unfused chain of resize, crop and normalize.
+    expected = T.DEFAULT_IMAGE_TRANSFORM(image=image)["image"]
+    fused = alb.Compose(
+        [
+            T.ResizeCenterCropNormalize(
+                256, 224, mean=T.IMAGENET_COLOR_MEAN, std=T.IMAGENET_COLOR_STD
+            )
+        ]
+    )(image=image)["image"]
+    assert fused.shape == expected.shape == (224, 224, 3)
+    assert fused.dtype == np.float32
+
+    # Same tolerance as above (three intensity levels), after normalization.
+    tolerance = 3 / (255 * min(T.IMAGENET_COLOR_STD)) + 1e-5
+    assert np.abs(fused - expected).max() <= tolerance
+
+    # Datasets transpose the HWC view to CHW, which must be contiguous.
+    assert np.transpose(fused, (2, 0, 1)).flags.c_contiguous
+
+
+@pytest.mark.parametrize("normalize", [False, True])
+def test_resize_center_crop_writes_in_output_buffer(normalize):
+    image = _photo_like_image(480, 640)
+    transform = T.ResizeCenterCropNormalize(
+        256,
+        224,
+        mean=T.IMAGENET_COLOR_MEAN if normalize else None,
+        std=T.IMAGENET_COLOR_STD if normalize else None,
+    )
+    expected = transform.resize_crop_normalize(image)
+
+    # Write in a slice of a preallocated batch.
+    out = np.empty((2, 3, 224, 224), dtype=expected.dtype)
+    output = transform.resize_crop_normalize(image, out=out[1])
+    assert output.base is out
+    np.testing.assert_array_equal(out[1], expected)
+
+    # Buffers of wrong shape or dtype are rejected.
+    with pytest.raises(ValueError):
+        transform.resize_crop_normalize(image, out=out[:, :, :112])
+    with pytest.raises(ValueError):
+        transform.resize_crop_normalize(image, out=out[1].astype(np.float64))
+
+
+def test_resize_center_crop_rejects_large_crop():
+    image = _photo_like_image(100, 200)
+    with pytest.raises(ValueError):
+        T.ResizeCenterCropNormalize(64, 96)(image=image)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_color_jitter_matches_albumentations(seed):
+    # Lookup table of brightness and contrast follows albumentations 0.x.
+    assert alb.__version__.startswith("0."), "Check ColorJitter with this version."
+
+    image = _photo_like_image(240, 320, seed)
+    jitter = T.ColorJitter(brightness=0.4, contrast=0.4, saturation=0.4, hue=0.1)
+
+    random.seed(seed)
+    jittered = jitter.apply(image)
+
+    # Draw same jitter factors as `ColorJitter.apply`, in same order.
+    random.seed(seed)
+    brightness_factor = random.uniform(0.6, 1.4)
+    contrast_factor = random.uniform(0.6, 1.4)
+    saturation_factor = random.uniform(0.6, 1.4)
+    hue_factor = random.uniform(-0.1, 0.1)
+
+    expected = alb.augmentations.functional.brightness_contrast_adjust(
+        image, alpha=contrast_factor, beta=brightness_factor - 1
+    )
+    expected = alb.augmentations.functional.shift_hsv(
+        expected,
+        hue_shift=int(hue_factor * 255),
+        sat_shift=int(saturation_factor * 255),
+        val_shift=0,
+    )
+    np.testing.assert_array_equal(jittered, expected)
+
+
+def test_color_jitter_keeps_input_unchanged():
+    image = _photo_like_image(64, 64)
+    original = image.copy()
+
+    T.ColorJitter(brightness=0.4, contrast=0.4, saturation=0.4, hue=0.1).apply(image)
+    np.testing.assert_array_equal(image, original)
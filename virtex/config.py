@@ -80,17 +80,43 @@ class Config(object):
         # re-creating a new vocab mapping.
         _C.DATA.MASK_INDEX = 3
 
+        # Library to decode images read directly from image files (not LMDB),
+        # one of ``{"default", "opencv", "pillow", "turbojpeg"}``. Default is
+        # Pillow for ImageNet (same as torchvision) and OpenCV for others.
+        # Pixel values differ slightly across libraries. If the first transform
+        # is "smallest_resize", JPEGs are decoded at a reduced scale if they
+        # are much larger than the resized size.
+        _C.DATA.IMAGE_DECODER = "default"
+
         # Size of the image (square) to crop from original input image.
         _C.DATA.IMAGE_CROP_SIZE = 224
         # Maximum length of input caption (number of tokens).
         # Longer captions will be truncated up to this length.
         _C.DATA.MAX_CAPTION_LENGTH = 30
+        # Whether to pad captions of every batch to ``MAX_CAPTION_LENGTH`` (than
+        # to the longest caption in batch). This keeps all batch shapes same.
+        _C.DATA.PAD_TO_MAX_LENGTH = False
 
         # COCO Captions has five captions per image. If ``True``, training will
         # use one random caption per image (data efficiency ablations).
         _C.DATA.USE_SINGLE_CAPTION = False
         # Percentage of dataset to use for training (data efficiency ablations).
         _C.DATA.USE_PERCENTAGE = 100.0
+        # Whether to stream the training split sequentially from tar shards
+        # (``serialized_train-*-of-*.tar``) instead of reading it from LMDB.
+        # Percentage of dataset is not supported with streaming.
+        _C.DATA.STREAMING = False
+        # Whether to use captions pre-tokenized by
+        # ``scripts/preprocess/tokenize_captions.py`` (saved in ``DATA.ROOT`` as
+        # ``serialized_{split}_tokens.npz``) instead of tokenizing on the fly.
+        _C.DATA.PRETOKENIZED_CAPTIONS = False
+        # Number of upcoming sampled indices to prefetch from LMDB file(s) into
+        # page cache during training. Set to zero to disable prefetching.
+        _C.DATA.LMDB_PREFETCH = 0
+        # Number of global batches in a bucket, to batch together captions of
+        # similar lengths (and reduce padding) during training. Set to zero to
+        # disable bucketing. Not supported with streaming.
+        _C.DATA.LENGTH_BUCKET_SIZE = 0
 
         # List of image transforms (pre-processing and data augmentation) to be
         # applied sequentially (always or randomly) during training and
@@ -106,6 +132,22 @@ class Config(object):
             "center_crop",
             "normalize",
         ]
+        # Whether to replace "smallest_resize", "center_crop" (and "normalize")
+        # in above transforms with a single fused transform, which is faster but
+        # not bit-exact: a few pixels differ by up to three intensity levels.
+        # Keep ``False`` to evaluate checkpoints on exactly same pixels as before.
+        _C.DATA.FUSE_IMAGE_TRANSFORMS = False
+        # Whether to transfer images from dataloader workers as ``uint8`` and
+        # normalize them on device (GPU), instead of in dataloader workers.
+        # If ``True``, "normalize" is skipped from above transforms.
+        _C.DATA.NORMALIZE_ON_DEVICE = False
+        # Whether to apply training augmentations on batches on device (GPU)
+        # instead of in dataloader workers. Supported transforms: {"normalize",
+        # "random_resized_crop", "horizontal_flip", "color_jitter"}. Workers
+        # only decode images, resize their shorter edge and center crop them to
+        # ``DEVICE_AUGMENT_INPUT_SIZE`` (all images in a batch need same size).
+        _C.DATA.AUGMENT_ON_DEVICE = False
+        _C.DATA.DEVICE_AUGMENT_INPUT_SIZE = 256
 
         # ---------------------------------------------------------------------
         #   Model architecture: visual backbone and textual head.
@@ -142,6 +184,27 @@ class Config(object):
         # Dropout probability for embedding, hidden features in textual head.
         _C.MODEL.TEXTUAL.DROPOUT = 0.1
 
+        _C.MODEL.DECODER = CN()
+        # Decoder to predict captions with captioning models during inference.
+        # Possible choices: {"beam_search", "greedy", "top_k", "nucleus"}.
+        # Last two sample tokens from the most likely ones at every time-step.
+        _C.MODEL.DECODER.NAME = "beam_search"
+        # Width of beam for beam search.
+        _C.MODEL.DECODER.BEAM_SIZE = 5
+        # Exponent of caption lengths to divide log probs of beams by, before
+        # picking the best beam. Zero picks the most likely caption (favoring
+        # short captions), one picks highest average log prob per token.
+        _C.MODEL.DECODER.LENGTH_PENALTY = 0.0
+        # Number of most likely tokens to sample from, for "top_k" decoder.
+        _C.MODEL.DECODER.TOP_K = 10
+        # Sample from most likely tokens with at least this total probability,
+        # for "nucleus" decoder.
+        _C.MODEL.DECODER.TOP_P = 0.9
+        # Block n-grams of this size from repeating in captions predicted by
+        # captioning models (set 0 to disable). Tokens are never predicted
+        # twice in a row, irrespective of this value.
+        _C.MODEL.DECODER.NO_REPEAT_NGRAM_SIZE = 0
+
         # ---------------------------------------------------------------------
         #   Optimization hyper-parameters, default values are for pretraining
         #   our best model on bicaptioning task (COCO Captions).
@@ -1,4 +1,4 @@
-from .datasets.captioning import CaptioningDataset
+from .datasets.captioning import CaptioningDataset, StreamingCaptioningDataset
 from .datasets.multilabel import MultiLabelClassificationDataset
 from .datasets.downstream import (
     ImageNetDataset,
@@ -9,6 +9,7 @@ from .datasets.downstream import (
 
 __all__ = [
     "CaptioningDataset",
+    "StreamingCaptioningDataset",
     "MultiLabelClassificationDataset",
     "CocoCaptionsEvalDataset",
     "ImageNetDataset",
@@ -1,12 +1,19 @@
+import glob
 import os
 import random
-from typing import Callable, List
+from typing import Callable, Iterator, List, Optional
 
 import albumentations as alb
 import numpy as np
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset
 
-from virtex.data.readers import LmdbReader
+from virtex.data.readers import (
+    CaptionsReader,
+    LmdbReader,
+    ShardedLmdbReader,
+    TarShardReader,
+    TokenizedCaptionsReader,
+)
 from virtex.data.structures import ImageCaptionInstance, ImageCaptionBatch
 from virtex.data.tokenizers import SentencePieceBPETokenizer
 from virtex.data import transforms as T 
@@ -26,7 +33,9 @@ class CaptioningDataset(Dataset):
     ----------
     data_root: str, optional (default = "datasets/coco")
         Path to the dataset root directory. This must contain the serialized
-        LMDB files (for COCO ``train2017`` and ``val2017`` splits).
+        LMDB files (for COCO ``train2017`` and ``val2017`` splits). If a single
+        LMDB file ``serialized_{split}.lmdb`` does not exist, LMDB shards named
+        as ``serialized_{split}-*-of-*.lmdb`` will be read instead.
     split: str, optional (default = "train")
         Which split (from COCO 2017 version) to read. One of ``{"train", "val"}``.
     tokenizer: virtex.data.tokenizers.SentencePieceBPETokenizer
@@ -44,6 +53,23 @@ class CaptioningDataset(Dataset):
         one fixed caption per image is use fo training (used for an ablation).
     percentage: float, optional (default = 100.0)
         Randomly sample this much percentage of full dataset for training.
+    captions_only: bool, optional (default = False)
+        Read only captions from the captions side file (``serialized_{split}_captions.json``)
+        and skip reading and decoding images entirely. Instances will not have
+        the ``image`` member, and ``image_transform`` is not applied. This is
+        useful for text-only experiments.
+    pretokenized: bool, optional (default = False)
+        Use pre-tokenized captions from ``serialized_{split}_tokens.npz``
+        (saved by ``scripts/preprocess/tokenize_captions.py``) instead of
+        normalizing and tokenizing captions on the fly. These must be made
+        with the same tokenizer model.
+    pad_to_max_length: bool, optional (default = False)
+        Pad caption tokens of every batch to ``max_caption_length`` instead of
+        the longest caption in batch, so all batches have same shapes.
+    keep_uint8: bool, optional (default = False)
+        Keep images as ``uint8`` instead of casting them to float. Set this if
+        ``image_transform`` does not normalize images, and they are normalized
+        on device (see :class:`~virtex.data.device_transforms.ImageNormalize`).
     """
 
     def __init__(
@@ -55,10 +81,59 @@ class CaptioningDataset(Dataset):
         max_caption_length: int = 30,
         use_single_caption: bool = False,
         percentage: float = 100.0,
+        captions_only: bool = False,
+        pretokenized: bool = False,
+        pad_to_max_length: bool = False,
+        keep_uint8: bool = False,
     ):
         lmdb_path = os.path.join(data_root, f"serialized_{split}.lmdb")
-        self.reader = LmdbReader(lmdb_path, percentage=percentage)
+        shard_paths = sorted(
+            glob.glob(os.path.join(data_root, f"serialized_{split}-*-of-*.lmdb"))
+        )
+        self.captions_only = captions_only
+        self.captions_path = os.path.join(
+            data_root, f"serialized_{split}_captions.json"
+        )
+        if captions_only:
+            self.reader = CaptionsReader(self.captions_path, percentage=percentage)
+        elif not os.path.exists(lmdb_path) and len(shard_paths) > 0:
+            self.reader = ShardedLmdbReader(shard_paths, percentage=percentage)
+        else:
+            self.reader = LmdbReader(lmdb_path, percentage=percentage)
+
+        self._init_transforms(
+            tokenizer, image_transform, max_caption_length, use_single_caption
+        )
+        self.pad_to_max_length = pad_to_max_length
+        self.keep_uint8 = keep_uint8
+
+        self._init_tokenized_captions(data_root, split, tokenizer, pretokenized)
+
+    def _init_tokenized_captions(
+        self,
+        data_root: str,
+        split: str,
+        tokenizer: SentencePieceBPETokenizer,
+        pretokenized: bool,
+    ):
+        self.tokenized_captions: Optional[TokenizedCaptionsReader] = None
+        if pretokenized:
+            self.tokenized_captions = TokenizedCaptionsReader(
+                os.path.join(data_root, f"serialized_{split}_tokens.npz")
+            )
+            if self.tokenized_captions.tokenizer_hash != tokenizer.model_hash():
+                raise ValueError(
+                    f"Captions in serialized_{split}_tokens.npz are tokenized by "
+                    f"a different tokenizer than {tokenizer.model_path}."
+                )
 
+    def _init_transforms(
+        self,
+        tokenizer: SentencePieceBPETokenizer,
+        image_transform: Callable,
+        max_caption_length: int,
+        use_single_caption: bool,
+    ):
         self.image_transform = image_transform
         self.caption_transform = alb.Compose(
             [
@@ -67,15 +142,62 @@ class CaptioningDataset(Dataset):
                 T.TruncateCaptionTokens(max_caption_length),
             ]
         )
+        self.max_caption_length = max_caption_length
         self.use_single_caption = use_single_caption
         self.padding_idx = tokenizer.token_to_id("<unk>")
 
     def __len__(self):
         return len(self.reader)
 
+    def caption_lengths(self) -> np.ndarray:
+        r"""
+        Return number of caption tokens (after truncation) of every datapoint,
+        useful to batch together datapoints with captions of similar lengths
+        (see :class:`~virtex.data.samplers.BucketedDistributedBatchSampler`).
+
+        A random caption of a datapoint is used every time it is read, so this
+        is the average length of all its captions (or length of its first
+        caption if ``use_single_caption`` is ``True``). Lengths are read from
+        pre-tokenized captions if available, else all captions in the captions
+        side file are tokenized here (this takes a minute for COCO train).
+        """
+        captions_reader = CaptionsReader(self.captions_path)
+
+        keys = self.reader.get_keys()
+        lengths = np.zeros(len(keys), dtype=np.float32)
+
+        for idx, key in enumerate(keys):
+            image_id, captions = captions_reader[key]
+            if self.use_single_caption:
+                captions = captions[:1]
+
+            if self.tokenized_captions is not None:
+                caption_lengths = self.tokenized_captions.get_lengths(image_id)
+                caption_lengths = caption_lengths[: len(captions)]
+            else:
+                caption_lengths = [
+                    len(self.caption_transform(caption=caption)["caption"])
+                    for caption in captions
+                ]
+            lengths[idx] = np.minimum(caption_lengths, self.max_caption_length).mean()
+
+        return lengths
+
     def __getitem__(self, idx: int) -> ImageCaptionInstance:
 
+        if self.captions_only:
+            image_id, captions = self.reader[idx]
+            return self._make_instance(image_id, None, captions)
+
         image_id, image, captions = self.reader[idx]
+        return self._make_instance(image_id, image, captions)
+
+    def _make_instance(
+        self, image_id: int, image: Optional[np.ndarray], captions: List[str]
+    ) -> ImageCaptionInstance:
+        # Use pre-tokenized captions (with their flipped versions) if available.
+        if self.tokenized_captions is not None:
+            captions = self.tokenized_captions.get(image_id)
 
         # Pick a random caption or first caption and process (transform) it.
         if self.use_single_caption:
@@ -86,12 +208,113 @@ class CaptioningDataset(Dataset):
         # Transform image-caption pair and convert image from HWC to CHW format.
         # Pass in caption to image_transform due to paired horizontal flip.
         # Caption won't be tokenized/processed here.
-        image_caption = self.image_transform(image=image, caption=caption)
-        image, caption = image_caption["image"], image_caption["caption"]
-        image = np.transpose(image, (2, 0, 1))
+        if image is not None:
+            image_caption = self.image_transform(image=image, caption=caption)
+            image, caption = image_caption["image"], image_caption["caption"]
+            image = np.transpose(image, (2, 0, 1))
+
+        if self.tokenized_captions is not None:
+            # Keep tokens of unflipped (or flipped) caption, and truncate.
+            caption_tokens = caption[0][: self.max_caption_length]
+        else:
+            caption_tokens = self.caption_transform(caption=caption)["caption"]
 
-        caption_tokens = self.caption_transform(caption=caption)["caption"]
-        return ImageCaptionInstance(image_id, image, caption_tokens)
+        return ImageCaptionInstance(
+            image_id, image, caption_tokens, keep_uint8=self.keep_uint8
+        )
 
     def collate_fn(self, instances: List[ImageCaptionInstance]) -> ImageCaptionBatch:
-        return ImageCaptionBatch(instances, padding_value=self.padding_idx)
+        return ImageCaptionBatch(
+            instances,
+            padding_value=self.padding_idx,
+            pad_to_length=self.max_caption_length if self.pad_to_max_length else None,
+        )
+
+
+class StreamingCaptioningDataset(CaptioningDataset, IterableDataset):
+    r"""
+    A streaming version of :class:`CaptioningDataset`, which reads image-caption
+    pairs sequentially from tar shards (through
+    :class:`~virtex.data.readers.TarShardReader`) instead of random access from
+    LMDB files. Tar shards are written by ``scripts/preprocess/preprocess_coco.py``
+    with ``--output-format tar``.
+
+    This dataset shuffles and splits shards across processes and dataloader
+    workers by itself, so use it with a :class:`~torch.utils.data.DataLoader`
+    without any sampler. Call :meth:`set_epoch` at the start of every epoch for
+    a different order of datapoints.
+
+    Parameters
+    ----------
+    data_root: str, optional (default = "datasets/coco")
+        Path to the dataset root directory. This must contain tar shards named
+        as ``serialized_{split}-*-of-*.tar``.
+    split: str, optional (default = "train")
+        Which split (from COCO 2017 version) to read. One of ``{"train", "val"}``.
+    tokenizer: virtex.data.tokenizers.SentencePieceBPETokenizer
+        A tokenizer which has the mapping between word tokens and their
+        integer IDs.
+    image_tranform: Callable, optional (default = virtex.data.transforms.DEFAULT_IMAGE_TRANSFORM)
+        A list of transformations to be applied on the image.
+    max_caption_length: int, optional (default = 30)
+        Maximum number of tokens to keep in output caption tokens.
+    use_single_caption: bool, optional (default = False)
+        Use only one fixed caption per image for training.
+    shuffle_buffer_size: int, optional (default = 1000)
+        Number of datapoints in the local shuffle buffer of every worker.
+    pretokenized: bool, optional (default = False)
+        Use pre-tokenized captions from ``serialized_{split}_tokens.npz``.
+    pad_to_max_length: bool, optional (default = False)
+        Pad caption tokens of every batch to ``max_caption_length``.
+    keep_uint8: bool, optional (default = False)
+        Keep images as ``uint8`` instead of casting them to float.
+    """
+
+    def __init__(
+        self,
+        data_root: str,
+        split: str,
+        tokenizer: SentencePieceBPETokenizer,
+        image_transform: Callable = T.DEFAULT_IMAGE_TRANSFORM,
+        max_caption_length: int = 30,
+        use_single_caption: bool = False,
+        shuffle_buffer_size: int = 1000,
+        pretokenized: bool = False,
+        pad_to_max_length: bool = False,
+        keep_uint8: bool = False,
+    ):
+        tar_paths = sorted(
+            glob.glob(os.path.join(data_root, f"serialized_{split}-*-of-*.tar"))
+        )
+        if len(tar_paths) == 0:
+            raise FileNotFoundError(
+                f"No tar shards found at {data_root}/serialized_{split}-*-of-*.tar"
+            )
+
+        self.reader = TarShardReader(
+            tar_paths,
+            shuffle=split == "train",
+            shuffle_buffer_size=shuffle_buffer_size,
+        )
+        self._init_transforms(
+            tokenizer, image_transform, max_caption_length, use_single_caption
+        )
+        self.pad_to_max_length = pad_to_max_length
+        self.keep_uint8 = keep_uint8
+        self._init_tokenized_captions(data_root, split, tokenizer, pretokenized)
+
+    def set_epoch(self, epoch: int):
+        r"""Set epoch (used along with seed) for deterministic shuffling."""
+        self.reader.set_epoch(epoch)
+
+    def __len__(self):
+        raise TypeError(f"{self.__class__.__name__} streams data, it has no length.")
+
+    def caption_lengths(self) -> np.ndarray:
+        raise TypeError(
+            f"{self.__class__.__name__} streams data, it has no indices to batch."
+        )
+
+    def __iter__(self) -> Iterator[ImageCaptionInstance]:
+        for image_id, image, captions in self.reader:
+            yield self._make_instance(image_id, image, captions)
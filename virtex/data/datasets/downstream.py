@@ -2,9 +2,8 @@ from collections import defaultdict
 import glob
 import json
 import os
-from typing import Callable, Dict, List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
-import cv2
 import numpy as np
 import torch
 from torch.utils.data import Dataset
@@ -15,6 +14,7 @@ from virtex.data.structures import (
     LinearClassificationBatch,
 )
 from virtex.data import transforms as T
+from virtex.data.image_decoders import ImageDecoder, OpenCVDecoder, PillowDecoder
 from virtex.data.readers import LmdbReader
 
 
@@ -41,6 +41,10 @@ class ImageNetDataset(ImageNet):
         Percentage of dataset to keep. This dataset retains first K% of images
         per class to retain same class label distribution. This is 100% by
         default, and will be ignored if ``split`` is ``val``.
+    image_decoder: virtex.data.image_decoders.ImageDecoder, optional (default = None)
+        A decoder to read images from files. If ``None``, images are decoded
+        at full scale by :class:`~virtex.data.image_decoders.PillowDecoder`
+        without EXIF transpose -- same as torchvision's default loader.
     """
 
     def __init__(
@@ -49,8 +53,10 @@ class ImageNetDataset(ImageNet):
         split: str = "train",
         image_transform: Callable = T.DEFAULT_IMAGE_TRANSFORM,
         percentage: float = 100,
+        image_decoder: Optional[ImageDecoder] = None,
     ):
-        super().__init__(data_root, split)
+        image_decoder = image_decoder or PillowDecoder(exif_transpose=False)
+        super().__init__(data_root, split, loader=image_decoder.read)
         assert percentage > 0, "Cannot load dataset with 0 percent original size."
 
         self.image_transform = image_transform
@@ -108,6 +114,9 @@ class INaturalist2018Dataset(Dataset):
         A list of transformations, from either `albumentations
         <https://albumentations.readthedocs.io/en/latest/>`_ or :mod:`virtex.data.transforms`
         to be applied on the image.
+    image_decoder: virtex.data.image_decoders.ImageDecoder, optional (default = None)
+        A decoder to read images from files. If ``None``, images are decoded
+        at full scale by :class:`~virtex.data.image_decoders.OpenCVDecoder`.
     """
 
     def __init__(
@@ -115,9 +124,11 @@ class INaturalist2018Dataset(Dataset):
         data_root: str = "datasets/inaturalist",
         split: str = "train",
         image_transform: Callable = T.DEFAULT_IMAGE_TRANSFORM,
+        image_decoder: Optional[ImageDecoder] = None,
     ):
         self.split = split
         self.image_transform = image_transform
+        self.image_decoder = image_decoder or OpenCVDecoder()
 
         annotations = json.load(
             open(os.path.join(data_root, "annotations", f"{split}2018.json"))
@@ -141,8 +152,7 @@ class INaturalist2018Dataset(Dataset):
         image_path = self.image_id_to_file_path[image_id]
 
         # Open image from path and apply transformation, convert to CHW format.
-        image = cv2.imread(image_path)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        image = self.image_decoder.read(image_path)
         image = self.image_transform(image=image)["image"]
         image = np.transpose(image, (2, 0, 1))
 
@@ -169,6 +179,9 @@ class VOC07ClassificationDataset(Dataset):
         A list of transformations, from either `albumentations
         <https://albumentations.readthedocs.io/en/latest/>`_ or :mod:`virtex.data.transforms`
         to be applied on the image.
+    image_decoder: virtex.data.image_decoders.ImageDecoder, optional (default = None)
+        A decoder to read images from files. If ``None``, images are decoded
+        at full scale by :class:`~virtex.data.image_decoders.OpenCVDecoder`.
     """
 
     def __init__(
@@ -176,9 +189,11 @@ class VOC07ClassificationDataset(Dataset):
         data_root: str = "datasets/VOC2007",
         split: str = "trainval",
         image_transform: Callable = T.DEFAULT_IMAGE_TRANSFORM,
+        image_decoder: Optional[ImageDecoder] = None,
     ):
         self.split = split
         self.image_transform = image_transform
+        self.image_decoder = image_decoder or OpenCVDecoder()
 
         ann_paths = sorted(
             glob.glob(os.path.join(data_root, "ImageSets", "Main", f"*_{split}.txt"))
@@ -224,8 +239,7 @@ class VOC07ClassificationDataset(Dataset):
         image_path, label = self.instances[idx]
 
         # Open image from path and apply transformation, convert to CHW format.
-        image = cv2.imread(image_path)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        image = self.image_decoder.read(image_path)
         image = self.image_transform(image=image)["image"]
         image = np.transpose(image, (2, 0, 1))
 
@@ -2,12 +2,12 @@ from collections import defaultdict
 import glob
 import json
 import os
-from typing import Callable, List, Tuple
+from typing import Callable, List, Optional, Tuple
 
-import cv2
 import numpy as np
 from torch.utils.data import Dataset
 
+from virtex.data.image_decoders import ImageDecoder, OpenCVDecoder
 from virtex.data.structures import ImageCaptionInstance, ImageCaptionBatch
 from virtex.data import transforms as T
 
@@ -28,6 +28,13 @@ class MultiLabelClassificationDataset(Dataset):
         A list of transformations, from either `albumentations
         <https://albumentations.readthedocs.io/en/latest/>`_ or :mod:`virtex.data.transforms`
         to be applied on the image.
+    image_decoder: virtex.data.image_decoders.ImageDecoder, optional (default = None)
+        A decoder to read images from files. If ``None``, images are decoded
+        at full scale by :class:`~virtex.data.image_decoders.OpenCVDecoder`.
+    keep_uint8: bool, optional (default = False)
+        Keep images as ``uint8`` instead of casting them to float. Set this if
+        ``image_transform`` does not normalize images, and they are normalized
+        on device (see :class:`~virtex.data.device_transforms.ImageNormalize`).
     """
 
     def __init__(
@@ -35,8 +42,12 @@ class MultiLabelClassificationDataset(Dataset):
         data_root: str,
         split: str,
         image_transform: Callable = T.DEFAULT_IMAGE_TRANSFORM,
+        image_decoder: Optional[ImageDecoder] = None,
+        keep_uint8: bool = False,
     ):
         self.image_transform = image_transform
+        self.image_decoder = image_decoder or OpenCVDecoder()
+        self.keep_uint8 = keep_uint8
 
         # Make a tuple of image id and its filename, get image_id from its
         # filename (assuming directory has images with names in COCO 2017 format).
@@ -89,8 +100,7 @@ class MultiLabelClassificationDataset(Dataset):
         image_id, filename = self.id_filename[idx]
 
         # Open image from path and apply transformation, convert to CHW format.
-        image = cv2.imread(filename)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        image = self.image_decoder.read(filename)
         image = self.image_transform(image=image)["image"]
         image = np.transpose(image, (2, 0, 1))
 
@@ -99,7 +109,9 @@ class MultiLabelClassificationDataset(Dataset):
 
         # Treat list of instances as "caption tokens" for reusability.
         # TODO (kd): it is hacky and written in deadline rush, make it better.
-        return ImageCaptionInstance(image_id, image, caption_tokens=instances)
+        return ImageCaptionInstance(
+            image_id, image, caption_tokens=instances, keep_uint8=self.keep_uint8
+        )
 
     def collate_fn(self, instances: List[ImageCaptionInstance]) -> ImageCaptionBatch:
         return ImageCaptionBatch(instances, padding_value=self.padding_idx)
@@ -0,0 +1,404 @@
+r"""
+Device transforms are applied on whole batches after they are transferred to
+the device (GPU), instead of per instance in dataloader workers. Images are
+transferred as ``uint8`` tensors (4x fewer bytes than ``float32``) and these
+transforms are applied before the visual backbone.
+
+Besides normalization, training augmentations can be applied on device too
+(with ``DATA.AUGMENT_ON_DEVICE``). These are batched variants of transforms in
+:mod:`virtex.data.transforms`, with random parameters sampled independently
+per image, so dataloader workers only decode images (and resize them to a
+fixed size to collate them in batches).
+"""
+import math
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from torch import nn
+from torch.nn import functional as F
+
+from virtex.data import transforms as T
+from virtex.data.tokenizers import SentencePieceBPETokenizer
+
+
+class ImageNormalize(nn.Module):
+    r"""
+    Convert a batch of ``uint8`` images to ``float32`` and normalize them with
+    mean and std of color channels. This is exactly same as
+    :class:`albumentations.Normalize` (with ``max_pixel_value = 255``) applied
+    per image in dataloader workers.
+
+    Images which are already floats (for example, normalized in dataloader
+    workers) are returned unchanged.
+
+    Parameters
+    ----------
+    mean: Tuple[float, float, float], optional (default = IMAGENET_COLOR_MEAN)
+        Mean of color channels (RGB) in range ``[0, 1]``.
+    std: Tuple[float, float, float], optional (default = IMAGENET_COLOR_STD)
+        Standard deviation of color channels (RGB) in range ``[0, 1]``.
+    """
+
+    def __init__(
+        self,
+        mean: Tuple[float, float, float] = T.IMAGENET_COLOR_MEAN,
+        std: Tuple[float, float, float] = T.IMAGENET_COLOR_STD,
+    ):
+        super().__init__()
+        # Scale to pixel range and add axes for broadcasting: (1, 3, 1, 1).
+        self.register_buffer("mean", torch.tensor(mean).view(1, -1, 1, 1) * 255)
+        self.register_buffer("std", torch.tensor(std).view(1, -1, 1, 1) * 255)
+
+    def forward(self, image: torch.Tensor) -> torch.Tensor:
+        r"""
+        Parameters
+        ----------
+        image: torch.Tensor
+            A batch of images, tensor of shape ``(batch_size, 3, height, width)``.
+
+        Returns
+        -------
+        torch.Tensor
+            Normalized images as a ``float32`` tensor of the same shape.
+        """
+        if image.dtype != torch.uint8:
+            return image
+
+        return image.float().sub_(self.mean).div_(self.std)
+
+
+class RandomResizedSquareCrop(nn.Module):
+    r"""
+    Crop a random part of every image in a batch of ``uint8`` images and resize
+    it to a square of a given size. This is a batched variant of
+    :class:`~virtex.data.transforms.RandomResizedSquareCrop`: area and aspect
+    ratio of crops are sampled in the same way, independently per image.
+
+    Crops of all images are resized (bilinear) together by a single call of
+    :func:`torch.nn.functional.grid_sample`. All images in a batch must have
+    the same size, so dataloader workers need to resize them to a fixed size.
+
+    Parameters
+    ----------
+    size: int
+        Dimension of the width and height of the cropped images.
+    scale: Tuple[float, float], optional (default = (0.08, 1.0))
+        Range of area of crops, as a fraction of area of images.
+    ratio: Tuple[float, float], optional (default = (0.75, 1.333))
+        Range of aspect ratio (width / height) of crops.
+    num_attempts: int, optional (default = 10)
+        Number of crops to sample per image, the first one which fits in the
+        image is used. Whole image is used if none of these fit.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        scale: Tuple[float, float] = (0.08, 1.0),
+        ratio: Tuple[float, float] = (0.75, 1.333),
+        num_attempts: int = 10,
+    ):
+        super().__init__()
+        self.size = size
+        self.scale = scale
+        self.ratio = ratio
+        self.num_attempts = num_attempts
+
+    def forward(self, image: torch.Tensor) -> torch.Tensor:
+        r"""
+        Parameters
+        ----------
+        image: torch.Tensor
+            A batch of ``uint8`` images, tensor of shape
+            ``(batch_size, 3, height, width)``.
+
+        Returns
+        -------
+        torch.Tensor
+            Cropped ``uint8`` images, tensor of shape
+            ``(batch_size, 3, size, size)``.
+        """
+        batch_size, channels, height, width = image.size()
+        left, top, crop_width, crop_height = self._sample_crops(
+            batch_size, height, width, image.device
+        )
+
+        # Affine transform which maps output images to crop boxes. Coordinates
+        # are normalized to [-1, 1], aligned to outer corners of border pixels.
+        theta = torch.zeros(batch_size, 2, 3, device=image.device)
+        theta[:, 0, 0] = crop_width / width
+        theta[:, 0, 2] = (2 * left + crop_width) / width - 1
+        theta[:, 1, 1] = crop_height / height
+        theta[:, 1, 2] = (2 * top + crop_height) / height - 1
+
+        output_size = [batch_size, channels, self.size, self.size]
+        grid = F.affine_grid(theta, output_size, align_corners=False)
+        image = F.grid_sample(
+            image.float(), grid, padding_mode="border", align_corners=False
+        )
+        return image.round_().clamp_(0, 255).to(torch.uint8)
+
+    def _sample_crops(
+        self, batch_size: int, height: int, width: int, device: torch.device
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        r"""
+        Sample a crop box per image. Return left, top, width and height of all
+        boxes (in pixels), each a tensor of shape ``(batch_size, )``.
+        """
+        # Sample all attempts of all images together.
+        # shape: (batch_size, num_attempts)
+        shape = (batch_size, self.num_attempts)
+        area = torch.empty(shape, device=device).uniform_(*self.scale)
+        area *= height * width
+
+        log_ratio = torch.empty(shape, device=device).uniform_(
+            math.log(self.ratio[0]), math.log(self.ratio[1])
+        )
+        aspect_ratio = torch.exp(log_ratio)
+
+        crop_width = torch.sqrt(area * aspect_ratio).round_()
+        crop_height = torch.sqrt(area / aspect_ratio).round_()
+
+        # Keep the first attempt which fits in the image, else the whole image.
+        fits = (crop_width <= width) & (crop_height <= height)
+        first_fit = (fits & (fits.long().cumsum(dim=1) == 1)).float()
+        any_fit = fits.any(dim=1)
+
+        crop_width = torch.where(
+            any_fit,
+            (crop_width * first_fit).sum(dim=1),
+            torch.full((batch_size,), width, device=device),
+        )
+        crop_height = torch.where(
+            any_fit,
+            (crop_height * first_fit).sum(dim=1),
+            torch.full((batch_size,), height, device=device),
+        )
+
+        # Sample top left corners uniformly such that crops fit in images.
+        left = torch.rand(batch_size, device=device) * (width - crop_width + 1)
+        top = torch.rand(batch_size, device=device) * (height - crop_height + 1)
+        return left.floor_(), top.floor_(), crop_width, crop_height
+
+
+class ColorJitter(nn.Module):
+    r"""
+    Randomly change brightness, contrast, hue and saturation of every image in
+    a batch of ``uint8`` images. This is a batched variant of
+    :class:`~virtex.data.transforms.ColorJitter`, jitter factors are sampled
+    in the same ranges and applied in the same way, independently per image.
+    Hue and saturation are changed in HSV colorspace computed in ``float32``,
+    so outputs may differ by a few intensity levels from OpenCV.
+
+    Parameters
+    ----------
+    brightness: float, optional (default = 0)
+        How much to jitter brightness.
+    contrast: float, optional (default = 0)
+        How much to jitter contrast.
+    saturation: float, optional (default = 0)
+        How much to jitter saturation.
+    hue: float, optional (default = 0)
+        How much to jitter hue.
+    p: float, optional (default = 0.5)
+        Probability of jittering an image.
+    """
+
+    def __init__(
+        self,
+        brightness: float = 0.0,
+        contrast: float = 0.0,
+        saturation: float = 0.0,
+        hue: float = 0.0,
+        p: float = 0.5,
+    ):
+        super().__init__()
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+        self.hue = hue
+        self.p = p
+
+    def forward(self, image: torch.Tensor) -> torch.Tensor:
+        r"""
+        Parameters
+        ----------
+        image: torch.Tensor
+            A batch of ``uint8`` images, tensor of shape
+            ``(batch_size, 3, height, width)``.
+
+        Returns
+        -------
+        torch.Tensor
+            Jittered ``uint8`` images, tensor of the same shape.
+        """
+        # Sample jitter factors per image, shape: (batch_size, 1, 1, 1)
+        def _uniform(low: float, high: float) -> torch.Tensor:
+            return torch.empty(
+                image.size(0), 1, 1, 1, device=image.device
+            ).uniform_(low, high)
+
+        apply = _uniform(0, 1) < self.p
+        brightness_factor = _uniform(1 - self.brightness, 1 + self.brightness)
+        contrast_factor = _uniform(1 - self.contrast, 1 + self.contrast)
+        saturation_factor = _uniform(1 - self.saturation, 1 + self.saturation)
+        hue_factor = _uniform(-self.hue, self.hue)
+
+        # "gain" = contrast and "bias" = (brightness_factor - 1) times mean
+        # intensity of image. Truncate to integers like lookup tables.
+        jittered = image.float()
+        mean = jittered.mean(dim=(1, 2, 3), keepdim=True)
+        jittered = jittered * contrast_factor + (brightness_factor - 1) * mean
+        jittered = jittered.clamp_(0, 255).floor_()
+
+        # Shift hue and saturation by integers, same as albumentations. Hue is
+        # shifted in OpenCV units (180 for a full circle).
+        hue, saturation, value = _rgb_to_hsv(jittered)
+        hue = (hue + torch.trunc(hue_factor * 255).squeeze(1) / 180) % 1.0
+        saturation = saturation + torch.trunc(saturation_factor * 255).squeeze(1) / 255
+        jittered = _hsv_to_rgb(hue, saturation.clamp_(0, 1), value)
+
+        jittered = jittered.round_().clamp_(0, 255).to(torch.uint8)
+        return torch.where(apply, jittered, image)
+
+
+def _rgb_to_hsv(
+    image: torch.Tensor,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    r"""
+    Convert a batch of RGB images (``float``, values in ``[0, 255]``) to HSV.
+    Return hue (in ``[0, 1)``), saturation (in ``[0, 1]``) and value (in
+    ``[0, 255]``), each a tensor of shape ``(batch_size, height, width)``.
+    """
+    red, green, blue = image.unbind(dim=1)
+    value = image.max(dim=1)[0]
+    delta = value - image.min(dim=1)[0]
+
+    # Avoid division by zero for gray (and black) pixels, they get zero hue
+    # and saturation.
+    ones = torch.ones_like(delta)
+    saturation = delta / torch.where(value > 0, value, ones)
+    safe_delta = torch.where(delta > 0, delta, ones)
+
+    hue = torch.where(
+        value == red,
+        (green - blue) / safe_delta,
+        torch.where(
+            value == green,
+            2 + (blue - red) / safe_delta,
+            4 + (red - green) / safe_delta,
+        ),
+    )
+    hue = torch.where(delta > 0, hue, torch.zeros_like(hue))
+    return (hue / 6) % 1.0, saturation, value
+
+
+def _hsv_to_rgb(
+    hue: torch.Tensor, saturation: torch.Tensor, value: torch.Tensor
+) -> torch.Tensor:
+    r"""
+    Inverse of :func:`_rgb_to_hsv`, return a batch of RGB images of shape
+    ``(batch_size, 3, height, width)``.
+    """
+    # Every channel (R, G, B) is a piecewise linear function of hue, with the
+    # same shape and different offsets (5, 3, 1) along the hue circle.
+    offsets = torch.tensor([5.0, 3.0, 1.0], device=hue.device).view(1, 3, 1, 1)
+    k = (offsets + hue.unsqueeze(1) * 6) % 6
+    weight = torch.min(k, 4 - k).clamp_(0, 1)
+    return value.unsqueeze(1) * (1 - saturation.unsqueeze(1) * weight)
+
+
+class HorizontalFlip(nn.Module):
+    r"""
+    Flip every image in a batch horizontally randomly (equally likely), and
+    swap token IDs of "left" and "right" in their captions. This is a batched
+    variant of :class:`~virtex.data.transforms.HorizontalFlip` which works on
+    tokens instead of caption strings.
+
+    .. note::
+
+        Only tokens which are exactly the words "left" or "right" (with or
+        without the leading SentencePiece space) are swapped, so words which
+        are tokenized into several tokens (like "leftover") are not changed.
+
+    Parameters
+    ----------
+    tokenizer: virtex.data.tokenizers.SentencePieceBPETokenizer, optional
+        A tokenizer to get token IDs of "left" and "right". If ``None``, only
+        images are flipped (for example, for datasets without captions).
+    p: float, optional (default = 0.5)
+        Probability of flipping an image.
+    """
+
+    def __init__(
+        self, tokenizer: Optional[SentencePieceBPETokenizer] = None, p: float = 0.5
+    ):
+        super().__init__()
+        self.p = p
+
+        # Mapping from every token ID to itself, except "left" and "right".
+        vocab_size = tokenizer.get_vocab_size() if tokenizer is not None else 0
+        token_map = torch.arange(vocab_size)
+        if tokenizer is not None:
+            unk_id = tokenizer.token_to_id("<unk>")
+            space = tokenizer.SP_SPACE
+            for left, right in [(f"{space}left", f"{space}right"), ("left", "right")]:
+                left_id = tokenizer.token_to_id(left)
+                right_id = tokenizer.token_to_id(right)
+                if left_id != unk_id and right_id != unk_id:
+                    token_map[left_id], token_map[right_id] = right_id, left_id
+
+        self.register_buffer("token_map", token_map)
+
+    def forward(self, batch: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        r"""
+        Parameters
+        ----------
+        batch: Dict[str, torch.Tensor]
+            A batch with key ``"image"`` (shape ``(batch_size, 3, height,
+            width)``) and optionally ``"caption_tokens"`` and ``"noitpac_tokens"``
+            (shape ``(batch_size, max_caption_length)``).
+
+        Returns
+        -------
+        Dict[str, torch.Tensor]
+            Same batch with images (and their caption tokens) flipped in place.
+        """
+        image = batch["image"]
+        flip = torch.rand(image.size(0), device=image.device) < self.p
+
+        batch["image"] = torch.where(flip.view(-1, 1, 1, 1), image.flip(3), image)
+
+        for key in ["caption_tokens", "noitpac_tokens"]:
+            if key in batch and self.token_map.numel() > 0:
+                tokens = batch[key]
+                batch[key] = torch.where(
+                    flip.unsqueeze(1), self.token_map[tokens], tokens
+                )
+        return batch
+
+
+class Compose(nn.Module):
+    r"""
+    Apply a sequence of device transforms on a batch, like
+    :class:`albumentations.Compose`. Image-only transforms are applied on
+    ``batch["image"]``, and :class:`HorizontalFlip` is applied on the whole
+    batch (to change caption tokens too).
+
+    Parameters
+    ----------
+    transforms: List[torch.nn.Module]
+        List of device transforms from this module, applied in order.
+    """
+
+    def __init__(self, transforms: List[nn.Module]):
+        super().__init__()
+        self.transforms = nn.ModuleList(transforms)
+
+    def forward(self, batch: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        for transform in self.transforms:
+            if isinstance(transform, HorizontalFlip):
+                batch = transform(batch)
+            else:
+                batch["image"] = transform(batch["image"])
+        return batch
@@ -0,0 +1,260 @@
+r"""
+An *image decoder* reads an image file (or its bytes) and decodes it to a
+``uint8`` image array in HWC format (RGB). Datasets which read images directly
+from image files use these decoders, so the decoding library can be changed
+from config without changing the datasets.
+
+All decoders can optionally decode JPEGs at a reduced scale (``1/2``, ``1/4``
+or ``1/8``), when images will be resized to a much smaller size after decoding
+anyway (for example, by ``SmallestMaxSize`` transform). JPEGs are made of DCT
+blocks, so libjpeg can decode them at these scales by skipping most of the
+work (``IMREAD_REDUCED_*`` flags in OpenCV, "draft" mode in Pillow). Decoders
+pick the smallest scale which keeps the shorter edge of image at least as
+long as ``min_size``, and leave the exact resizing to transforms.
+
+All decoders rotate (or flip) images as per their EXIF orientation tag by
+default, like ``cv2.imread``. This can be turned off (``exif_transpose=False``)
+to keep images as stored, like torchvision's Pillow-based loader. Decoders
+still differ slightly in pixel values, depending on their JPEG library.
+"""
+import io
+import struct
+from typing import Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+
+# EXIF tag of image orientation, and transforms (of HWC arrays) to undo every
+# orientation. These are same as transposes used by `PIL.ImageOps.exif_transpose`.
+_EXIF_ORIENTATION_TAG = 0x0112
+_EXIF_TRANSPOSES = {
+    2: lambda image: image[:, ::-1],
+    3: lambda image: image[::-1, ::-1],
+    4: lambda image: image[::-1],
+    5: lambda image: image.transpose(1, 0, 2),
+    6: lambda image: np.rot90(image, -1),
+    7: lambda image: image.transpose(1, 0, 2)[::-1, ::-1],
+    8: lambda image: np.rot90(image),
+}
+
+
+# Start of frame markers of JPEG files (all except DHT, JPG and DAC), which hold
+# image height and width.
+_JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def _jpeg_size(image_bytes: bytes) -> Optional[Tuple[int, int]]:
+    r"""
+    Read ``(width, height)`` of a JPEG from its header, without decoding it.
+    Return ``None`` if these bytes are not of a JPEG file.
+    """
+    image_bytes = memoryview(image_bytes)
+    if bytes(image_bytes[:2]) != b"\xff\xd8":
+        return None
+
+    # Walk over segments: every segment starts with a marker (0xFF, type),
+    # followed by its length (including the length bytes).
+    position = 2
+    while position + 9 <= len(image_bytes):
+        if image_bytes[position] != 0xFF:
+            return None
+
+        marker = image_bytes[position + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker.
+            position += 1
+        elif marker in _JPEG_SOF_MARKERS:
+            height, width = struct.unpack_from(">HH", image_bytes, position + 5)
+            return width, height
+        else:
+            (length,) = struct.unpack_from(">H", image_bytes, position + 2)
+            position += 2 + length
+
+    return None
+
+
+def _exif_orientation(image_bytes: Union[bytes, memoryview]) -> int:
+    r"""
+    Read EXIF orientation of an image from its header, without decoding it.
+    Return 1 (no transpose needed) if image has no EXIF orientation tag.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        return image.getexif().get(_EXIF_ORIENTATION_TAG, 1)
+
+
+class ImageDecoder(object):
+    r"""
+    Base class for image decoders. Subclasses implement :meth:`decode`.
+
+    Parameters
+    ----------
+    min_size: int, optional (default = None)
+        Decode JPEGs at the smallest reduced scale which keeps their shorter
+        edge at least this long. If ``None``, images are decoded at full scale.
+    exif_transpose: bool, optional (default = True)
+        Whether to rotate (or flip) images as per their EXIF orientation.
+    """
+
+    def __init__(self, min_size: Optional[int] = None, exif_transpose: bool = True):
+        self.min_size = min_size
+        self.exif_transpose = exif_transpose
+
+    def read(self, path: str) -> np.ndarray:
+        r"""Read and decode an image file from path."""
+        with open(path, "rb") as image_file:
+            return self.decode(image_file.read())
+
+    def decode(self, image_bytes: Union[bytes, memoryview]) -> np.ndarray:
+        r"""
+        Decode bytes (or a buffer) of an image file to a ``uint8`` image array
+        in HWC format (RGB).
+        """
+        raise NotImplementedError
+
+    def _reduction(self, width: int, height: int) -> int:
+        r"""
+        Return largest factor (one of ``{1, 2, 4, 8}``) to reduce image size by
+        while decoding, keeping shorter edge at least :attr:`min_size` long.
+        Decoded sizes are rounded up, like libjpeg.
+        """
+        if self.min_size is None:
+            return 1
+
+        shorter_edge = min(width, height)
+        for factor in [8, 4, 2]:
+            if -(-shorter_edge // factor) >= self.min_size:
+                return factor
+        return 1
+
+
+class OpenCVDecoder(ImageDecoder):
+    r"""
+    Decode images with OpenCV (``cv2.imdecode``). Images are decoded directly
+    to RGB with OpenCV 4.10 and above, else decoded to BGR and converted.
+
+    Parameters
+    ----------
+    min_size: int, optional (default = None)
+        Decode JPEGs at reduced scale, see :class:`ImageDecoder`.
+    exif_transpose: bool, optional (default = True)
+        Whether to rotate (or flip) images as per their EXIF orientation.
+    """
+
+    # Flags to decode at reduced scale. These are same as `IMREAD_REDUCED_COLOR_*`
+    # flags without the bit of `IMREAD_COLOR`, to combine with `IMREAD_COLOR_RGB`.
+    _REDUCED_FLAGS = {
+        1: 0,
+        2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+        4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+        8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+    }
+
+    def __init__(self, min_size: Optional[int] = None, exif_transpose: bool = True):
+        super().__init__(min_size, exif_transpose)
+        self._rgb_flag = getattr(cv2, "IMREAD_COLOR_RGB", None)
+
+        # OpenCV applies EXIF orientation by default.
+        self._orientation_flag = 0 if exif_transpose else cv2.IMREAD_IGNORE_ORIENTATION
+
+    def decode(self, image_bytes: Union[bytes, memoryview]) -> np.ndarray:
+        size = _jpeg_size(image_bytes) if self.min_size is not None else None
+        reduced_flag = self._REDUCED_FLAGS[self._reduction(*size) if size else 1]
+        reduced_flag |= self._orientation_flag
+
+        image_array = np.frombuffer(image_bytes, dtype=np.uint8)
+        if self._rgb_flag is not None:
+            return cv2.imdecode(image_array, reduced_flag | self._rgb_flag)
+
+        image = cv2.imdecode(image_array, reduced_flag | cv2.IMREAD_COLOR)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+class PillowDecoder(ImageDecoder):
+    r"""
+    Decode images with Pillow (or a drop-in replacement like
+    `Pillow-SIMD <https://github.com/uploadcare/pillow-simd>`_). JPEGs are
+    decoded directly to RGB in "draft" mode, at a reduced scale if possible.
+
+    Parameters
+    ----------
+    min_size: int, optional (default = None)
+        Decode JPEGs at reduced scale, see :class:`ImageDecoder`.
+    exif_transpose: bool, optional (default = True)
+        Whether to rotate (or flip) images as per their EXIF orientation. If
+        ``False``, images are same as decoded by torchvision's default loader.
+    """
+
+    def decode(self, image_bytes: Union[bytes, memoryview]) -> np.ndarray:
+        from PIL import Image, ImageOps
+
+        image = Image.open(io.BytesIO(image_bytes))
+
+        if image.format == "JPEG":
+            # Draft mode picks the largest scale which divides image size by
+            # at most this factor (scale of 1/8, 1/4, 1/2 or full).
+            factor = self._reduction(*image.size)
+            width, height = image.size
+            image.draft("RGB", (max(width // factor, 1), max(height // factor, 1)))
+
+        # Transpose only if needed, it makes a copy of the image.
+        orientation = image.getexif().get(_EXIF_ORIENTATION_TAG, 1)
+        if self.exif_transpose and orientation != 1:
+            image = ImageOps.exif_transpose(image)
+
+        return np.asarray(image.convert("RGB"))
+
+
+class TurboJpegDecoder(ImageDecoder):
+    r"""
+    Decode JPEGs with libjpeg-turbo directly, through
+    `PyTurboJPEG <https://github.com/lilohuang/PyTurboJPEG>`_ (an optional
+    dependency). JPEGs are decoded directly to RGB, at a reduced scale if
+    possible. Other images are decoded by :class:`OpenCVDecoder`.
+
+    Parameters
+    ----------
+    min_size: int, optional (default = None)
+        Decode JPEGs at reduced scale, see :class:`ImageDecoder`.
+    exif_transpose: bool, optional (default = True)
+        Whether to rotate (or flip) images as per their EXIF orientation. This
+        is read from image header by Pillow, libjpeg-turbo does not apply it.
+    """
+
+    def __init__(self, min_size: Optional[int] = None, exif_transpose: bool = True):
+        super().__init__(min_size, exif_transpose)
+        self._fallback = OpenCVDecoder(min_size, exif_transpose)
+
+        # Raise early (not while reading) if PyTurboJPEG is not installed.
+        import turbojpeg  # noqa: F401
+
+        # Handle to libjpeg-turbo, loaded lazily once per process (it cannot
+        # be pickled to dataloader workers).
+        self._turbojpeg = None
+
+    def decode(self, image_bytes: Union[bytes, memoryview]) -> np.ndarray:
+        from turbojpeg import TJPF_RGB, TurboJPEG
+
+        size = _jpeg_size(image_bytes)
+        if size is None:
+            return self._fallback.decode(image_bytes)
+
+        if self._turbojpeg is None:
+            self._turbojpeg = TurboJPEG()
+
+        image = self._turbojpeg.decode(
+            bytes(image_bytes),
+            pixel_format=TJPF_RGB,
+            scaling_factor=(1, self._reduction(*size)),
+        )
+        orientation = _exif_orientation(image_bytes) if self.exif_transpose else 1
+        if orientation in _EXIF_TRANSPOSES:
+            image = np.ascontiguousarray(_EXIF_TRANSPOSES[orientation](image))
+        return image
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_turbojpeg"] = None
+        return state
@@ -3,24 +3,91 @@ A *Reader* is a PyTorch :class:`~torch.utils.data.Dataset` which simply reads
 data from disk and returns it almost as is. Readers defined here are used by
 datasets in :mod:`virtex.data.datasets`.
 """
+import bisect
 from collections import defaultdict
+import ctypes
 import glob
 import json
+import mmap
 import os
-import pickle
 import random
-from typing import Dict, List, Tuple
+import tarfile
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
-import cv2
 import lmdb
+import numpy as np
 from loguru import logger
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
+
+import virtex.utils.distributed as dist
+
+from virtex.data import serialization
+from virtex.data.image_decoders import ImageDecoder, OpenCVDecoder
 
 
 # Some simplified type renaming for better readability
 ImageID = int
 Captions = List[str]
 
+# `madvise` from C library to prefetch pages of LMDB memory map, Python's `mmap`
+# module only supports it for maps created by itself (and not LMDB's own map).
+try:
+    _madvise = ctypes.CDLL(None, use_errno=True).madvise
+    _madvise.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int]
+    _madvise.restype = ctypes.c_int
+except (AttributeError, OSError):
+    _madvise = None
+
+_MADV_WILLNEED = getattr(mmap, "MADV_WILLNEED", 3)
+
+
+# LMDB environments opened by current process, keyed by process ID and path,
+# along with the options they were opened with. An LMDB file can be opened only
+# once per process, so readers of the same file share it. Environments
+# inherited by forked processes are never used by them.
+_LMDB_ENVIRONMENTS: Dict[Tuple[int, str], Tuple[lmdb.Environment, bool, int]] = {}
+
+
+def _open_lmdb(lmdb_path: str, readahead: bool, max_readers: int) -> lmdb.Environment:
+    r"""
+    Open a read-only LMDB environment, once per process for every path. Raises
+    ``ValueError`` if this path is already opened with different options.
+    """
+    key = (os.getpid(), os.path.abspath(lmdb_path))
+    if key not in _LMDB_ENVIRONMENTS:
+        # Close environments inherited from parent process (if forked), else
+        # LMDB does not allow opening the same file again. This does not
+        # affect the parent process.
+        for inherited_key in list(_LMDB_ENVIRONMENTS):
+            if inherited_key[0] != key[0]:
+                _LMDB_ENVIRONMENTS.pop(inherited_key)[0].close()
+
+        # fmt: off
+        # Map size of a read-only environment is the size of LMDB file, no
+        # need to reserve a large address space in every process.
+        env = lmdb.open(
+            lmdb_path, subdir=False, readonly=True, lock=False,
+            readahead=readahead, max_readers=max_readers,
+        )
+        # fmt: on
+        _LMDB_ENVIRONMENTS[key] = (env, readahead, max_readers)
+
+    env, opened_readahead, opened_max_readers = _LMDB_ENVIRONMENTS[key]
+    if (opened_readahead, opened_max_readers) != (readahead, max_readers):
+        raise ValueError(
+            f"{lmdb_path} is already opened in this process with readahead="
+            f"{opened_readahead}, max_readers={opened_max_readers}; cannot "
+            f"open it again with readahead={readahead}, max_readers={max_readers}."
+        )
+    return env
+
+
+def _madvise_willneed(buffer: memoryview):
+    r"""Advise the OS that pages underlying this buffer will be needed soon."""
+    address = np.frombuffer(buffer, dtype=np.uint8).ctypes.data
+    start = address - address % mmap.PAGESIZE
+    _madvise(start, address + len(buffer) - start, _MADV_WILLNEED)
+
 
 class SimpleCocoCaptionsReader(Dataset):
     r"""
@@ -35,8 +102,17 @@ class SimpleCocoCaptionsReader(Dataset):
         Path to the COCO dataset root directory.
     split: str, optional (default = "train")
         Which split (from COCO 2017 version) to read. One of ``{"train", "val"}``.
+    image_decoder: virtex.data.image_decoders.ImageDecoder, optional (default = None)
+        A decoder to read images from files. If ``None``, images are decoded
+        at full scale by :class:`~virtex.data.image_decoders.OpenCVDecoder`.
     """
-    def __init__(self, root: str = "datasets/coco", split: str = "train"):
+    def __init__(
+        self,
+        root: str = "datasets/coco",
+        split: str = "train",
+        image_decoder: Optional[ImageDecoder] = None,
+    ):
+        self.image_decoder = image_decoder or OpenCVDecoder()
 
         image_dir = os.path.join(root, f"{split}2017")
 
@@ -63,8 +139,7 @@ class SimpleCocoCaptionsReader(Dataset):
         image_id, filename = self.id_filename[idx]
 
         # shape: (height, width, channels), dtype: uint8
-        image = cv2.imread(filename)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        image = self.image_decoder.read(filename)
         captions = self._id_to_captions[image_id]
 
         return {"image_id": image_id, "image": image, "captions": captions}
@@ -76,6 +151,11 @@ class LmdbReader(Dataset):
     ``(image_id, image, caption)`` tuples. Optionally, one may specify a
     partial percentage of datapoints to use.
 
+    Records may be serialized in any format from :mod:`virtex.data.serialization`,
+    as recorded in metadata of the LMDB file. Images are always returned as
+    decoded ``uint8`` arrays, irrespective of the format. For ``raw`` format,
+    these are read-only arrays directly over the memory map of LMDB file.
+
     .. note::
 
         When training in distributed setting, make sure each worker has SAME
@@ -86,95 +166,539 @@ class LmdbReader(Dataset):
 
     .. note::
 
-        Similar to :class:`~torch.utils.data.distributed.DistributedSampler`,
-        this reader can shuffle the dataset deterministically at the start of
-        epoch. Use :meth:`set_shuffle_seed` manually from outside to change the
-        seed at every epoch.
+        This reader does not shuffle datapoints by itself. Use a sampler like
+        :class:`~virtex.data.samplers.ResumableDistributedSampler` to shuffle
+        them deterministically every epoch. Argument ``shuffle`` and method
+        :meth:`set_shuffle_seed` are kept for compatibility, and have no effect.
+
+    .. note::
+
+        LMDB environment is opened lazily, once per process (on first read in
+        that process). Dataloader workers never use an environment inherited
+        from the main process, whether they are forked or receive a pickled
+        copy of this reader. All readers of the same file in a process share
+        its environment, so they must use same ``readahead`` and
+        ``max_readers``, else reading raises ``ValueError``.
 
     Parameters
     ----------
     lmdb_path: str
         Path to LMDB file with datapoints.
     shuffle: bool, optional (default = True)
-        Whether to shuffle or not. If this is on, there will be one deterministic
-        shuffle based on epoch before sharding the dataset (to workers).
+        Unused, shuffling is done by samplers.
     percentage: float, optional (default = 100.0)
         Percentage of datapoints to use. If less than 100.0, keys will be
         shuffled and first K% will be retained and use throughout training.
         Make sure to set this only for training, not validation.
+    readahead: bool, optional (default = False)
+        Whether OS should read ahead pages of LMDB file beyond the pages read
+        by each record. This helps sequential reads (and files on spinning
+        disks), but wastes page cache for random reads of large files.
+    max_readers: int, optional (default = 126)
+        Maximum number of simultaneous read transactions on LMDB environment.
     """
 
-    def __init__(self, lmdb_path: str, shuffle: bool = True, percentage: float = 100):
+    def __init__(
+        self,
+        lmdb_path: str,
+        shuffle: bool = True,
+        percentage: float = 100,
+        readahead: bool = False,
+        max_readers: int = 126,
+    ):
         self.lmdb_path = lmdb_path
         self.shuffle = shuffle
+        self.readahead = readahead
+        self.max_readers = max_readers
 
         assert percentage > 0, "Cannot load dataset with 0 percent original size."
         self.percentage = percentage
 
-        # fmt: off
-        # Create an LMDB transaction right here. It will be aborted when this
-        # class goes out of scope.
-        env = lmdb.open(
-            self.lmdb_path, subdir=False, readonly=True, lock=False,
-            readahead=False, map_size=1099511627776 * 2,
+        # LMDB environment and transaction of the process which opened them.
+        # These are (re-)opened on first use in any other process. Readers of
+        # the same file in a process share the environment opened first.
+        self._env: Optional[lmdb.Environment] = None
+        self._txn: Optional[lmdb.Transaction] = None
+        self._pid: Optional[int] = None
+
+        # Read format of records from metadata. LMDB files without metadata
+        # only contain pickled records.
+        metadata = serialization.load_metadata(
+            self.db_txn.get(serialization.METADATA_KEY)
         )
-        self.db_txn = env.begin()
+        self.image_format: str = metadata["image_format"]
+        length = metadata["length"] or self._env.stat()["entries"]
+        self.num_records: int = length
 
-        # Form a list of LMDB keys numbered from 0 (as binary strings).
-        self._keys = [
-            f"{i}".encode("ascii") for i in range(env.stat()["entries"])
-        ]
-        # fmt: on
+        # LMDB keys are integers numbered from 0 (cast as binary strings). Keep
+        # them as a compact integer array and encode each key while reading --
+        # a list of millions of `bytes` objects is slow to pickle to workers.
+        self._keys = np.arange(length, dtype=np.int64)
 
         # If data percentage < 100%, randomly retain K% keys. This will be
         # deterministic based on random seed.
         if percentage < 100.0:
             retain_k: int = int(len(self._keys) * percentage / 100.0)
             random.shuffle(self._keys)
-            self._keys = self._keys[:retain_k]
+            self._keys = self._keys[:retain_k].copy()
             logger.info(f"Retained {retain_k} datapoints for training!")
 
-        # A seed to deterministically shuffle at the start of epoch. This is
-        # set externally through `set_shuffle_seed`.
+        # Unused, kept for compatibility (samplers shuffle datapoints).
         self.shuffle_seed = 0
 
+    @property
+    def db_txn(self) -> lmdb.Transaction:
+        r"""
+        A read transaction on LMDB environment, opened once in each process.
+        Records are read as buffers over the memory map of LMDB file, without
+        copying them to ``bytes``.
+        """
+        if self._pid != os.getpid():
+            self._env = _open_lmdb(self.lmdb_path, self.readahead, self.max_readers)
+            self._txn = self._env.begin(buffers=True)
+            self._pid = os.getpid()
+
+        return self._txn
+
     def set_shuffle_seed(self, seed: int):
-        r"""Set random seed for shuffling data."""
+        r"""Set random seed for shuffling data (unused, see samplers)."""
         self.shuffle_seed = seed
 
-    def get_keys(self) -> List[bytes]:
-        r"""Return list of keys, useful while saving checkpoint."""
+    def get_keys(self) -> np.ndarray:
+        r"""
+        Return keys (as an array of integers), useful while saving checkpoint.
+        """
         return self._keys
 
-    def set_keys(self, keys: List[bytes]):
-        r"""Set list of keys, useful while loading from checkpoint."""
-        self._keys = keys
+    def set_keys(self, keys: Union[np.ndarray, List[int], List[bytes]]):
+        r"""
+        Set keys, useful while loading from checkpoint. Keys may be integers,
+        or binary strings (as saved in older checkpoints).
+        """
+        if len(keys) > 0 and isinstance(keys[0], bytes):
+            keys = [int(key) for key in keys]
+        self._keys = np.asarray(keys, dtype=np.int64)
+
+    def prefetch(self, indices: Iterable[int]):
+        r"""
+        Advise the OS to read pages of records at these indices into page cache
+        in background (``madvise`` with ``MADV_WILLNEED``), without waiting for
+        them. Page cache is shared by all processes, so records prefetched in
+        main process (for example, by :class:`~virtex.data.samplers.PrefetchingSampler`)
+        are read faster by dataloader workers. This is a no-op if ``madvise``
+        is unavailable on the platform.
+        """
+        if _madvise is None:
+            return
+
+        for idx in indices:
+            record = self.db_txn.get(f"{self._keys[idx]}".encode("ascii"))
+            if record is not None:
+                _madvise_willneed(record)
 
     def __getstate__(self):
         r"""
         This magic method allows an object of this class to be pickable, useful
-        for dataloading with multiple CPU workers. :attr:`db_txn` is not
-        pickable, so we remove it from state, and re-instantiate it in
-        :meth:`__setstate__`.
+        for dataloading with multiple CPU workers. LMDB environment and
+        transaction are not pickable, so we remove them from (a copy of) state,
+        and they are re-opened lazily after unpickling.
         """
-        state = self.__dict__
-        state["db_txn"] = None
+        state = self.__dict__.copy()
+        state.update(_env=None, _txn=None, _pid=None)
         return state
 
-    def __setstate__(self, state):
-        self.__dict__ = state
+    def __len__(self):
+        return len(self._keys)
+
+    def __getitem__(self, idx: int):
+        key = f"{self._keys[idx]}"
+        datapoint_serialized = self.db_txn.get(key.encode("ascii"))
+        try:
+            image_id, image, captions = serialization.deserialize_instance(
+                datapoint_serialized, self.image_format
+            )
+        except ValueError as error:
+            raise ValueError(
+                f"Could not read record with key {key} of {self.lmdb_path}: {error}"
+            ) from error
 
-        env = lmdb.open(
-            self.lmdb_path, subdir=False, readonly=True, lock=False,
-            readahead=False, map_size=1099511627776 * 2,
-        )
-        self.db_txn = env.begin()
+        return image_id, image, captions
+
+
+class CaptionsReader(Dataset):
+    r"""
+    A reader interface to read only ``(image_id, captions)`` pairs of a
+    serialized dataset from its captions side file, without touching any
+    images. This file is written by ``scripts/preprocess/preprocess_coco.py``
+    along with LMDB file(s), as ``[output]_captions.json`` -- for example,
+    ``serialized_train_captions.json`` for ``serialized_train.lmdb``.
+
+    Datapoints are indexed exactly like the LMDB file (or all its shards in
+    order), and all captions are held in memory. This is useful for text-only
+    experiments such as computing vocabulary statistics.
+
+    .. note::
+
+        With percentage less than 100, retained datapoints are same as those
+        of :class:`~virtex.data.readers.LmdbReader` with same random seed, but
+        not same as those of :class:`~virtex.data.readers.ShardedLmdbReader`
+        (which selects datapoints per shard).
+
+    Parameters
+    ----------
+    captions_path: str
+        Path to the captions side file (JSON).
+    percentage: float, optional (default = 100.0)
+        Percentage of datapoints to use. If less than 100.0, datapoints will
+        be shuffled and first K% will be retained.
+    """
+
+    def __init__(self, captions_path: str, percentage: float = 100):
+        assert percentage > 0, "Cannot load dataset with 0 percent original size."
+
+        with open(captions_path) as captions_file:
+            side_file = json.load(captions_file)
+
+        self._image_ids: List[ImageID] = side_file["image_ids"]
+        self._captions: List[Captions] = side_file["captions"]
+
+        # Select K% datapoints exactly as `LmdbReader` selects its keys.
+        self._keys = np.arange(len(self._image_ids), dtype=np.int64)
+        if percentage < 100.0:
+            retain_k: int = int(len(self._keys) * percentage / 100.0)
+            random.shuffle(self._keys)
+            self._keys = self._keys[:retain_k].copy()
+            logger.info(f"Retained {retain_k} datapoints for training!")
+
+    def get_keys(self) -> np.ndarray:
+        r"""
+        Return keys (as an array of integers) -- indices of retained datapoints
+        in the captions side file.
+        """
+        return self._keys
 
     def __len__(self):
         return len(self._keys)
 
+    def __getitem__(self, idx: int) -> Tuple[ImageID, Captions]:
+        key = self._keys[idx]
+        return self._image_ids[key], self._captions[key]
+
+
+class TokenizedCaptionsReader(object):
+    r"""
+    A reader interface to look up pre-tokenized captions of an image by its
+    image ID. These are saved by ``scripts/preprocess/tokenize_captions.py``
+    as a numpy ``.npz`` file, with tokens of all captions in a flat integer
+    array. Every caption is saved along with its horizontally flipped version
+    (with "left" and "right" swapped before tokenization).
+
+    Captions are normalized and tokenized (with boundary tokens), but not
+    truncated to any maximum length.
+
+    Parameters
+    ----------
+    tokens_path: str
+        Path to the ``.npz`` file with tokenized captions.
+    """
+
+    def __init__(self, tokens_path: str):
+        with np.load(tokens_path) as tokens_file:
+            # Sorted image IDs, and index of first caption of every image.
+            self._image_ids: np.ndarray = tokens_file["image_ids"]
+            self._caption_starts: np.ndarray = tokens_file["caption_starts"]
+
+            # Flat arrays of tokens of all captions, and offsets of captions.
+            self._tokens: np.ndarray = tokens_file["tokens"]
+            self._offsets: np.ndarray = tokens_file["offsets"]
+            self._flipped_tokens: np.ndarray = tokens_file["flipped_tokens"]
+            self._flipped_offsets: np.ndarray = tokens_file["flipped_offsets"]
+
+            self.tokenizer_hash: str = str(tokens_file["tokenizer_hash"])
+
+    def __len__(self):
+        return len(self._image_ids)
+
+    def get(self, image_id: ImageID) -> List[Tuple[np.ndarray, np.ndarray]]:
+        r"""
+        Get tokens of all captions of an image, as a list of tuples of tokens
+        and flipped tokens (each a view of the flat array, without copy).
+        """
+        idx = np.searchsorted(self._image_ids, image_id)
+        if idx == len(self._image_ids) or self._image_ids[idx] != image_id:
+            raise KeyError(f"No tokenized captions for image ID {image_id}.")
+
+        return [
+            (
+                self._tokens[self._offsets[i] : self._offsets[i + 1]],
+                self._flipped_tokens[
+                    self._flipped_offsets[i] : self._flipped_offsets[i + 1]
+                ],
+            )
+            for i in range(self._caption_starts[idx], self._caption_starts[idx + 1])
+        ]
+
+    def get_lengths(self, image_id: ImageID) -> np.ndarray:
+        r"""Get number of tokens in every (unflipped) caption of an image."""
+        idx = np.searchsorted(self._image_ids, image_id)
+        if idx == len(self._image_ids) or self._image_ids[idx] != image_id:
+            raise KeyError(f"No tokenized captions for image ID {image_id}.")
+
+        start, end = self._caption_starts[idx], self._caption_starts[idx + 1]
+        return np.diff(self._offsets[start : end + 1])
+
+
+class ShardedLmdbReader(Dataset):
+    r"""
+    A reader interface to read datapoints from multiple LMDB files (shards),
+    each serialized exactly like the file read by
+    :class:`~virtex.data.readers.LmdbReader`. Datapoints of all shards are
+    indexed in order of shards, as if they were a single LMDB file.
+
+    Use this with :class:`~virtex.data.samplers.ShardedDistributedSampler` to
+    assign shards to processes during distributed training, so each process
+    reads mostly from its own LMDB files (better page cache locality).
+
+    Parameters
+    ----------
+    lmdb_paths: List[str]
+        Paths to LMDB files (shards) with datapoints.
+    percentage: float, optional (default = 100.0)
+        Percentage of datapoints to use, this is applied to each shard.
+    readahead: bool, optional (default = False)
+        Whether OS should read ahead pages of LMDB files, see :class:`LmdbReader`.
+    max_readers: int, optional (default = 126)
+        Maximum number of simultaneous read transactions on each LMDB file.
+    """
+
+    def __init__(
+        self,
+        lmdb_paths: List[str],
+        percentage: float = 100,
+        readahead: bool = False,
+        max_readers: int = 126,
+    ):
+        self.lmdb_paths = lmdb_paths
+        self.readers = [
+            LmdbReader(
+                path,
+                percentage=percentage,
+                readahead=readahead,
+                max_readers=max_readers,
+            )
+            for path in lmdb_paths
+        ]
+
+        self._update_shard_lengths()
+
+    def _update_shard_lengths(self):
+        # Number of datapoints in each shard, and index of first datapoint of
+        # each shard (for mapping a global index to shard).
+        self.shard_lengths: List[int] = [len(reader) for reader in self.readers]
+        self._shard_offsets: List[int] = [0]
+        for length in self.shard_lengths:
+            self._shard_offsets.append(self._shard_offsets[-1] + length)
+
+    def __len__(self):
+        return self._shard_offsets[-1]
+
+    def get_keys(self) -> np.ndarray:
+        r"""
+        Return keys of all shards (as an array of integers), offset by number
+        of records in preceding shards. These are indices of datapoints in the
+        captions side file (which has datapoints of all shards in order).
+        """
+        record_offsets = np.cumsum([0] + [r.num_records for r in self.readers])
+        return np.concatenate(
+            [
+                reader.get_keys() + offset
+                for reader, offset in zip(self.readers, record_offsets)
+            ]
+        )
+
+    def set_keys(self, keys: Union[np.ndarray, List[int], List[bytes]]):
+        r"""
+        Set keys of all shards, as returned by :meth:`get_keys` (useful while
+        loading from checkpoint). Keys are split into shards by their offsets,
+        and datapoints are indexed in order of shards again. Keys may be
+        integers, or binary strings (as saved in older checkpoints).
+        """
+        if len(keys) > 0 and isinstance(keys[0], bytes):
+            keys = [int(key) for key in keys]
+        keys = np.asarray(keys, dtype=np.int64)
+
+        record_offsets = np.cumsum([0] + [r.num_records for r in self.readers])
+        shards = np.searchsorted(record_offsets, keys, side="right") - 1
+        if len(keys) > 0 and (keys.min() < 0 or keys.max() >= record_offsets[-1]):
+            raise ValueError(
+                f"Keys must be in [0, {record_offsets[-1]}) for these shards."
+            )
+
+        for shard, (reader, offset) in enumerate(zip(self.readers, record_offsets)):
+            reader.set_keys(keys[shards == shard] - offset)
+        self._update_shard_lengths()
+
+    def prefetch(self, indices: Iterable[int]):
+        r"""Prefetch records at these indices, see :meth:`LmdbReader.prefetch`."""
+        for idx in indices:
+            shard = bisect.bisect_right(self._shard_offsets, idx) - 1
+            self.readers[shard].prefetch([idx - self._shard_offsets[shard]])
+
     def __getitem__(self, idx: int):
-        datapoint_pickled = self.db_txn.get(self._keys[idx])
-        image_id, image, captions = pickle.loads(datapoint_pickled)
+        shard = bisect.bisect_right(self._shard_offsets, idx) - 1
+        return self.readers[shard][idx - self._shard_offsets[shard]]
 
+
+class TarShardReader(IterableDataset):
+    r"""
+    A reader interface to stream datapoints from tar shards written by
+    ``scripts/preprocess/preprocess_coco.py`` with ``--output-format tar``
+    (similar to `WebDataset <https://github.com/webdataset/webdataset>`_).
+    Every datapoint is stored as two consecutive files with a common key: a
+    compressed image (``[key].jpg``, ``[key].png`` or ``[key].webp``) and its
+    image ID and captions (``[key].json``).
+
+    Shards are read sequentially from start to end -- this avoids random reads
+    entirely, and works well with network or object storage where seeks are
+    expensive. Randomness comes from shuffling the order of shards every epoch
+    and a local shuffle buffer of datapoints.
+
+    Shards are split across processes (in distributed training) and across
+    dataloader workers within each process, so every shard is read by exactly
+    one worker per epoch. Order of shards is shuffled identically on all of
+    them (based on seed and epoch) before splitting.
+
+    .. note::
+
+        With shuffling, number of shards must be a multiple of ``world_size *
+        num_workers``, so that every worker reads same number of shards. Else
+        processes finish their epochs at very different iterations, and their
+        shards of next epoch would overlap.
+
+        Shards written by ``preprocess_coco.py`` differ in length by at most
+        one datapoint, so processes may still finish their epochs a batch or
+        two apart. :meth:`set_epoch` must hence be called with same epoch on
+        all processes for their ``k``-th epoch (and not with iteration).
+
+    Parameters
+    ----------
+    tar_paths: List[str]
+        Paths to tar shards with datapoints.
+    shuffle: bool, optional (default = True)
+        Whether to shuffle order of shards and datapoints every epoch.
+    shuffle_buffer_size: int, optional (default = 1000)
+        Number of datapoints to hold in the local shuffle buffer. Larger buffer
+        gives more random order at the cost of more memory.
+    seed: int, optional (default = 0)
+        Random seed for shuffling, this is same across all processes.
+    """
+
+    def __init__(
+        self,
+        tar_paths: List[str],
+        shuffle: bool = True,
+        shuffle_buffer_size: int = 1000,
+        seed: int = 0,
+    ):
+        self.tar_paths = tar_paths
+        self.shuffle = shuffle
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = seed
+        self.epoch = 0
+
+        # Rank and world size are recorded here (in main process), before this
+        # object is copied to dataloader workers.
+        self.rank = dist.get_rank()
+        self.world_size = dist.get_world_size()
+
+    def set_epoch(self, epoch: int):
+        r"""Set epoch (used along with seed) for deterministic shuffling."""
+        self.epoch = epoch
+
+    def _worker_tar_paths(self) -> List[str]:
+        r"""Return shards to be read by current process and dataloader worker."""
+        tar_paths = list(self.tar_paths)
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(tar_paths)
+
+        worker_info = get_worker_info()
+        worker_id = worker_info.id if worker_info is not None else 0
+        num_workers = worker_info.num_workers if worker_info is not None else 1
+
+        # Every worker reads same number of shards. Without shuffling, order
+        # of shards is fixed and every shard is read once irrespective of it.
+        total_workers = self.world_size * num_workers
+        if self.shuffle and len(tar_paths) % total_workers != 0:
+            raise ValueError(
+                f"Number of tar shards ({len(tar_paths)}) must be a multiple of "
+                f"world size times dataloader workers ({total_workers})."
+            )
+
+        start = self.rank * num_workers + worker_id
+        return tar_paths[start :: self.world_size * num_workers]
+
+    def _iter_shard(self, tar_path: str) -> Iterator[Tuple[ImageID, bytes, Captions]]:
+        r"""
+        Stream a single tar shard and yield ``(image_id, image_bytes, captions)``
+        for every datapoint, with images not yet decoded.
+        """
+        current_key, image_bytes, annotations = None, None, None
+
+        # Open tar file in streaming mode, files are read strictly in order.
+        with tarfile.open(tar_path, "r|") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+
+                key, extension = member.name.rsplit(".", 1)
+                if key != current_key:
+                    current_key, image_bytes, annotations = key, None, None
+
+                data = tar.extractfile(member).read()
+                if extension == "json":
+                    annotations = json.loads(data)
+                else:
+                    image_bytes = data
+
+                if image_bytes is not None and annotations is not None:
+                    yield annotations["image_id"], image_bytes, annotations["captions"]
+                    current_key, image_bytes, annotations = None, None, None
+
+    def __iter__(self) -> Iterator[Tuple[ImageID, np.ndarray, Captions]]:
+        # Use a different random state in every worker for shuffle buffer, it
+        # is still deterministic based on seed, epoch, rank and worker ID.
+        worker_info = get_worker_info()
+        worker_id = worker_info.id if worker_info is not None else 0
+        rng = random.Random(
+            (self.seed + self.epoch) * 1000003 + self.rank * 1009 + worker_id
+        )
+        buffer_size = self.shuffle_buffer_size if self.shuffle else 1
+
+        buffer: List[Tuple[ImageID, bytes, Captions]] = []
+        for tar_path in self._worker_tar_paths():
+            for datapoint in self._iter_shard(tar_path):
+                if len(buffer) < buffer_size:
+                    buffer.append(datapoint)
+                    continue
+
+                # Replace a random datapoint of the buffer and yield it.
+                idx = rng.randrange(len(buffer))
+                datapoint, buffer[idx] = buffer[idx], datapoint
+                yield self._decode(datapoint)
+
+        rng.shuffle(buffer)
+        for datapoint in buffer:
+            yield self._decode(datapoint)
+
+    @staticmethod
+    def _decode(
+        datapoint: Tuple[ImageID, bytes, Captions]
+    ) -> Tuple[ImageID, np.ndarray, Captions]:
+        # Images are kept compressed in shuffle buffer and decoded only before
+        # yielding, this keeps memory of the buffer small.
+        image_id, image_bytes, captions = datapoint
+        try:
+            image = serialization.decode_image(image_bytes)
+        except ValueError as error:
+            raise ValueError(f"Image ID {image_id} in tar shard: {error}") from error
         return image_id, image, captions
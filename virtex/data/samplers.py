@@ -0,0 +1,383 @@
+r"""
+A *Sampler* decides the order of datapoints (indices) to read from a dataset
+every epoch. Samplers defined here are alternatives to
+:class:`~torch.utils.data.distributed.DistributedSampler` which work better
+with certain readers in :mod:`virtex.data.readers`.
+
+All samplers here shuffle deterministically based on seed and epoch, and can
+skip datapoints already consumed in an epoch (``set_start_index``) to resume
+training from the middle of an epoch.
+"""
+from collections import deque
+import itertools
+import random
+from typing import Iterator, List, Optional, Union
+
+import numpy as np
+from torch.utils.data import Sampler
+
+import virtex.utils.distributed as dist
+
+
+class ResumableDistributedSampler(Sampler):
+    r"""
+    A sampler which splits (and optionally shuffles) datapoints across all
+    processes, exactly like :class:`~torch.utils.data.distributed.DistributedSampler`,
+    and can resume from the middle of an epoch. Order of datapoints depends
+    only on seed and epoch, so after :meth:`set_start_index` the sampler skips
+    datapoints already consumed in this epoch (before a checkpoint was saved)
+    instead of replaying the whole epoch.
+
+    Parameters
+    ----------
+    dataset: torch.utils.data.Dataset
+        Dataset to sample from, only its length is used.
+    num_replicas: int, optional (default = None)
+        Number of processes in distributed training. Default is world size.
+    rank: int, optional (default = None)
+        Rank of current process. Default is rank from distributed process group.
+    shuffle: bool, optional (default = True)
+        Whether to shuffle datapoints every epoch.
+    seed: int, optional (default = 0)
+        Random seed for shuffling, this is same across all processes.
+    drop_last: bool, optional (default = False)
+        Whether to drop datapoints to make them evenly divisible by number of
+        processes. If ``False``, first few datapoints are repeated instead.
+    """
+
+    def __init__(
+        self,
+        dataset,
+        num_replicas: Optional[int] = None,
+        rank: Optional[int] = None,
+        shuffle: bool = True,
+        seed: int = 0,
+        drop_last: bool = False,
+    ):
+        self.dataset_length = len(dataset)
+        self.num_replicas = num_replicas or dist.get_world_size()
+        self.rank = rank if rank is not None else dist.get_rank()
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.start_index = 0
+
+        if drop_last:
+            self._num_samples = self.dataset_length // self.num_replicas
+        else:
+            self._num_samples = -(-self.dataset_length // self.num_replicas)
+
+    def set_epoch(self, epoch: int):
+        r"""Set epoch (used along with seed) for deterministic shuffling."""
+        self.epoch = epoch
+
+    def set_start_index(self, start_index: int):
+        r"""
+        Skip these many datapoints (of current process) in the next epoch only,
+        because they were consumed before resuming training.
+        """
+        self.start_index = start_index
+
+    def __iter__(self) -> Iterator[int]:
+        if self.shuffle:
+            rng = np.random.RandomState(self.seed + self.epoch)
+            indices = rng.permutation(self.dataset_length)
+        else:
+            indices = np.arange(self.dataset_length)
+
+        # Drop or repeat indices to split them evenly, and keep indices of this
+        # process after skipping consumed ones.
+        indices = np.resize(indices, self._num_samples * self.num_replicas)
+        indices = indices[self.rank :: self.num_replicas][self.start_index :]
+        self.start_index = 0
+
+        yield from indices.tolist()
+
+    def __len__(self):
+        return self._num_samples
+
+
+class ShardedDistributedSampler(Sampler):
+    r"""
+    A sampler for datasets read from multiple LMDB shards through
+    :class:`~virtex.data.readers.ShardedLmdbReader`. Shards are assigned to
+    processes in a round-robin manner, and each process only samples indices
+    of datapoints from its own shards. Hence every process reads from a small
+    subset of files, instead of random pages across the whole dataset.
+
+    Every epoch, order of shards and order of datapoints within each shard
+    are shuffled (deterministically based on seed and epoch), and datapoints
+    are read shard by shard.
+
+    Shards of different processes may have different total lengths, but all
+    processes must have epochs of same length -- else they start new epochs
+    at different iterations, and position in epoch saved in a checkpoint (by
+    master process) is wrong for others. Hence, first few datapoints of every
+    process are repeated to match the longest process (or last datapoints are
+    dropped to match the shortest process, if ``drop_last`` is ``True``), like
+    :class:`~torch.utils.data.distributed.DistributedSampler`.
+
+    Parameters
+    ----------
+    shard_lengths: List[int]
+        Number of datapoints in each shard (in order of the shards in reader).
+    num_replicas: int, optional (default = None)
+        Number of processes in distributed training. Default is world size.
+    rank: int, optional (default = None)
+        Rank of current process. Default is rank from distributed process group.
+    shuffle: bool, optional (default = True)
+        Whether to shuffle shards and datapoints within shards every epoch.
+    seed: int, optional (default = 0)
+        Random seed for shuffling, this is same across all processes.
+    drop_last: bool, optional (default = False)
+        Whether to drop datapoints to make number of datapoints same for all
+        processes. If ``False``, first few datapoints are repeated instead.
+    """
+
+    def __init__(
+        self,
+        shard_lengths: List[int],
+        num_replicas: Optional[int] = None,
+        rank: Optional[int] = None,
+        shuffle: bool = True,
+        seed: int = 0,
+        drop_last: bool = False,
+    ):
+        self.num_replicas = num_replicas or dist.get_world_size()
+        self.rank = rank if rank is not None else dist.get_rank()
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.start_index = 0
+
+        if len(shard_lengths) < self.num_replicas:
+            raise ValueError(
+                f"Need at least as many shards as processes, found "
+                f"{len(shard_lengths)} shards for {self.num_replicas} processes."
+            )
+
+        # Global index ranges of shards assigned to this process.
+        shard_offsets = [0]
+        for length in shard_lengths:
+            shard_offsets.append(shard_offsets[-1] + length)
+
+        self._shard_ranges = [
+            range(shard_offsets[shard], shard_offsets[shard + 1])
+            for shard in range(self.rank, len(shard_lengths), self.num_replicas)
+        ]
+
+        # Number of datapoints of every process (per epoch), same for all.
+        replica_lengths = [
+            sum(shard_lengths[replica :: self.num_replicas])
+            for replica in range(self.num_replicas)
+        ]
+        self._num_samples = (
+            min(replica_lengths) if drop_last else max(replica_lengths)
+        )
+
+    def set_epoch(self, epoch: int):
+        r"""Set epoch (used along with seed) for deterministic shuffling."""
+        self.epoch = epoch
+
+    def set_start_index(self, start_index: int):
+        r"""
+        Skip these many datapoints (of current process) in the next epoch only,
+        because they were consumed before resuming training.
+        """
+        self.start_index = start_index
+
+    def __iter__(self) -> Iterator[int]:
+        start_index, self.start_index = self.start_index, 0
+
+        # Drop or repeat indices to match length of all processes, and skip
+        # consumed ones.
+        indices = itertools.islice(itertools.cycle(self._indices()), self._num_samples)
+        yield from itertools.islice(indices, start_index, None)
+
+    def _indices(self) -> Iterator[int]:
+        shard_ranges = list(self._shard_ranges)
+
+        if not self.shuffle:
+            for shard_range in shard_ranges:
+                yield from shard_range
+            return
+
+        rng = random.Random(self.seed + self.epoch)
+        rng.shuffle(shard_ranges)
+        for shard_range in shard_ranges:
+            indices = list(shard_range)
+            rng.shuffle(indices)
+            yield from indices
+
+    def __len__(self):
+        return self._num_samples
+
+
+class PrefetchingSampler(Sampler):
+    r"""
+    A wrapper over any sampler, which asks the reader to prefetch records of
+    the next few sampled indices into page cache, before they are read by
+    dataloader workers. Use this with readers which have a ``prefetch`` method,
+    like :class:`~virtex.data.readers.LmdbReader`. Order of indices is exactly
+    same as the wrapped sampler.
+
+    This helps when the dataset is much larger than page cache: random reads
+    from disk are issued early in background, instead of one at a time by a
+    worker which waits for each of them.
+
+    Parameters
+    ----------
+    sampler: torch.utils.data.Sampler
+        A sampler to wrap, indices from this sampler are yielded as is. This
+        may also be a batch sampler (which yields lists of indices).
+    reader: Any
+        A reader with a ``prefetch(indices)`` method. Indices of dataset must be
+        same as indices of the reader.
+    lookahead: int, optional (default = 256)
+        Number of indices (or batches) to prefetch ahead of the one being yielded.
+    """
+
+    def __init__(self, sampler: Sampler, reader, lookahead: int = 256):
+        self.sampler = sampler
+        self.reader = reader
+        self.lookahead = lookahead
+
+    def set_epoch(self, epoch: int):
+        r"""Set epoch of the wrapped sampler (if it supports shuffling by epoch)."""
+        if hasattr(self.sampler, "set_epoch"):
+            self.sampler.set_epoch(epoch)
+
+    def set_start_index(self, start_index: int):
+        r"""Skip consumed indices (or batches) of the wrapped sampler."""
+        self.sampler.set_start_index(start_index)
+
+    def __iter__(self) -> Iterator[Union[int, List[int]]]:
+        iterator = iter(self.sampler)
+
+        # Indices (or batches) which are prefetched but not yet yielded.
+        window = deque(itertools.islice(iterator, self.lookahead))
+        for item in window:
+            self.reader.prefetch(_as_indices(item))
+
+        for item in iterator:
+            self.reader.prefetch(_as_indices(item))
+            window.append(item)
+            yield window.popleft()
+
+        yield from window
+
+    def __len__(self):
+        return len(self.sampler)
+
+
+class BucketedDistributedBatchSampler(Sampler):
+    r"""
+    A batch sampler which groups datapoints with similar caption lengths into
+    same batches, so less compute is wasted on padding tokens. Use this with
+    :class:`~virtex.data.datasets.captioning.CaptioningDataset`, lengths of
+    datapoints are given by its :meth:`~virtex.data.datasets.captioning.CaptioningDataset.caption_lengths`.
+
+    Every epoch, datapoints are shuffled and split into buckets of
+    ``bucket_size`` global batches (batches of all processes together). Each
+    bucket is sorted by length and split into global batches, and order of
+    all global batches is shuffled again. Each process yields its own part of
+    every global batch -- hence all processes get captions of similar lengths
+    in every iteration, and no process waits for others with longer captions.
+    Shuffling is deterministic based on seed and epoch, same as
+    :class:`~torch.utils.data.distributed.DistributedSampler`.
+
+    Parameters
+    ----------
+    lengths: np.ndarray
+        Caption length of every datapoint in dataset.
+    batch_size: int
+        Number of datapoints in a batch of each process.
+    num_replicas: int, optional (default = None)
+        Number of processes in distributed training. Default is world size.
+    rank: int, optional (default = None)
+        Rank of current process. Default is rank from distributed process group.
+    shuffle: bool, optional (default = True)
+        Whether to shuffle datapoints and batches every epoch.
+    seed: int, optional (default = 0)
+        Random seed for shuffling, this is same across all processes.
+    drop_last: bool, optional (default = False)
+        Whether to drop the last incomplete global batch. If ``False``, first
+        few datapoints are repeated to complete it.
+    bucket_size: int, optional (default = 100)
+        Number of global batches in a bucket. Larger buckets have less padding
+        but batches are less random (similar lengths are batched together).
+    """
+
+    def __init__(
+        self,
+        lengths: np.ndarray,
+        batch_size: int,
+        num_replicas: Optional[int] = None,
+        rank: Optional[int] = None,
+        shuffle: bool = True,
+        seed: int = 0,
+        drop_last: bool = False,
+        bucket_size: int = 100,
+    ):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.num_replicas = num_replicas or dist.get_world_size()
+        self.rank = rank if rank is not None else dist.get_rank()
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.bucket_size = bucket_size
+        self.epoch = 0
+        self.start_index = 0
+
+        global_batch_size = self.batch_size * self.num_replicas
+        if self.drop_last:
+            self._num_batches = len(self.lengths) // global_batch_size
+        else:
+            self._num_batches = -(-len(self.lengths) // global_batch_size)
+
+    def set_epoch(self, epoch: int):
+        r"""Set epoch (used along with seed) for deterministic shuffling."""
+        self.epoch = epoch
+
+    def set_start_index(self, start_index: int):
+        r"""
+        Skip these many batches (of current process) in the next epoch only,
+        because they were consumed before resuming training.
+        """
+        self.start_index = start_index
+
+    def __iter__(self) -> Iterator[List[int]]:
+        rng = np.random.RandomState(self.seed + self.epoch)
+        if self.shuffle:
+            indices = rng.permutation(len(self.lengths))
+        else:
+            indices = np.arange(len(self.lengths))
+
+        # Drop or repeat indices to get a whole number of global batches.
+        global_batch_size = self.batch_size * self.num_replicas
+        indices = np.resize(indices, self._num_batches * global_batch_size)
+
+        # Sort each bucket by length. Sorting is stable, so datapoints with
+        # same length remain shuffled.
+        bucket_length = global_batch_size * self.bucket_size
+        for start in range(0, len(indices), bucket_length):
+            bucket = indices[start : start + bucket_length]
+            bucket[:] = bucket[np.argsort(self.lengths[bucket], kind="mergesort")]
+
+        # Shape: (num_batches, num_replicas, batch_size)
+        batches = indices.reshape(-1, self.num_replicas, self.batch_size)
+        if self.shuffle:
+            batches = batches[rng.permutation(len(batches))]
+
+        start_index, self.start_index = self.start_index, 0
+        for batch in batches[start_index:, self.rank]:
+            yield batch.tolist()
+
+    def __len__(self):
+        return self._num_batches
+
+
+def _as_indices(item: Union[int, List[int]]) -> List[int]:
+    r"""Return a batch of indices as is, or a single index as a list."""
+    return item if isinstance(item, list) else [item]
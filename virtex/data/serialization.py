@@ -0,0 +1,232 @@
+r"""
+This module defines the formats of records in serialized LMDB files. These
+are written by ``scripts/preprocess/preprocess_coco.py`` and read by
+:class:`~virtex.data.readers.LmdbReader`. Every record holds an
+``(image_id, image, captions)`` instance, serialized in one of these formats:
+
+1. ``pickle``: A pickled tuple with image as a decoded ``uint8`` array (HWC).
+   This is the default, and the only format in LMDB files without metadata.
+2. ``raw``: A fixed binary header with image ID, image shape, dtype, and
+   offsets of captions (JSON) and image bytes in the record. Image is read as
+   a (read-only) array directly over the record buffer, without any copy --
+   use LMDB transactions with ``buffers=True`` for this.
+3. ``jpg``, ``png``, ``webp``: A small binary header with image ID and length
+   of captions, followed by captions (JSON) and compressed image bytes. Images
+   are decoded on read -- these files are several times smaller than pickled
+   arrays, so more of them fit in page cache.
+
+Every LMDB file also holds a record of metadata (at :data:`METADATA_KEY`)
+with the format of records and version of this layout.
+"""
+import json
+import pickle
+import struct
+from typing import Any, Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+
+METADATA_KEY = b"__metadata__"
+r"""LMDB key of the record containing metadata (a pickled dict)."""
+
+FORMAT_VERSION = 1
+r"""Version of the record layouts defined in this module."""
+
+IMAGE_FORMATS = ("pickle", "raw", "jpg", "png", "webp")
+r"""Supported formats of records in serialized LMDB files."""
+
+# Header of records with encoded images: image ID (int64) and number of bytes
+# of captions JSON (uint32), little endian.
+_ENCODED_HEADER = struct.Struct("<qI")
+
+# Header of records with raw images: image ID (int64), image height, width and
+# channels (uint32), dtype character code (with three bytes of padding), byte
+# offset and length of image (uint32), byte offset and length of captions JSON
+# (uint32), little endian.
+_RAW_HEADER = struct.Struct("<qIIIc3xIIII")
+
+# Image bytes in raw records start at a multiple of this many bytes, so arrays
+# of any dtype can be read directly over the record buffer.
+_RAW_ALIGNMENT = 64
+
+
+def make_metadata(image_format: str, length: int) -> bytes:
+    r"""
+    Make a metadata record for an LMDB file of ``length`` records, serialized
+    in ``image_format``.
+    """
+    return pickle.dumps(
+        {"version": FORMAT_VERSION, "image_format": image_format, "length": length},
+        protocol=-1,
+    )
+
+
+def load_metadata(metadata: bytes) -> Dict[str, Any]:
+    r"""
+    Load a metadata record (as written by :func:`make_metadata`), and check its
+    format version. ``None`` (absent metadata) means a pickle format LMDB file.
+    """
+    if metadata is None:
+        return {"version": 0, "image_format": "pickle", "length": None}
+
+    metadata = pickle.loads(bytes(metadata))
+    if metadata["version"] > FORMAT_VERSION:
+        raise ValueError(
+            f"LMDB file has record format version {metadata['version']}, but "
+            f"this codebase can read up to version {FORMAT_VERSION}."
+        )
+    return metadata
+
+
+def encode_image(image: np.ndarray, image_format: str, quality: int = 90) -> bytes:
+    r"""
+    Compress a ``uint8`` image array in HWC format (RGB) to bytes of an image
+    file format, one of ``{"jpg", "png", "webp"}``.
+    """
+    # OpenCV expects images in BGR format for encoding.
+    params = {
+        "jpg": [cv2.IMWRITE_JPEG_QUALITY, quality],
+        "webp": [cv2.IMWRITE_WEBP_QUALITY, quality],
+        "png": [],
+    }[image_format]
+    success, image_bytes = cv2.imencode(
+        f".{image_format}", cv2.cvtColor(image, cv2.COLOR_RGB2BGR), params
+    )
+    if not success:
+        raise ValueError(f"Could not encode image to {image_format}.")
+
+    return image_bytes.tobytes()
+
+
+def decode_image(image_bytes: bytes) -> np.ndarray:
+    r"""
+    Decode bytes (or a buffer) of an image file to a ``uint8`` image array in
+    HWC format (RGB). Raise ``ValueError`` if bytes are not a valid image.
+    """
+    image = cv2.imdecode(
+        np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR
+    )
+    if image is None:
+        raise ValueError("Could not decode image, its bytes may be corrupt.")
+
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def serialize_instance(
+    image_id: int,
+    image: np.ndarray,
+    captions: List[str],
+    image_format: str = "pickle",
+    quality: int = 90,
+) -> bytes:
+    r"""
+    Serialize an instance to bytes in one of :data:`IMAGE_FORMATS`.
+
+    Parameters
+    ----------
+    image_id: int
+        A unique integer ID for image (COCO image ID).
+    image: np.ndarray
+        A ``uint8`` image array in HWC format (RGB).
+    captions: List[str]
+        List of captions associated with this image.
+    image_format: str, optional (default = "pickle")
+        Format of the serialized record, one of :data:`IMAGE_FORMATS`.
+    quality: int, optional (default = 90)
+        Quality of compressed images in ``jpg`` and ``webp`` formats.
+    """
+    if image_format == "pickle":
+        return pickle.dumps((image_id, image, captions), protocol=-1)
+
+    if image_format == "raw":
+        return _serialize_raw_instance(image_id, image, captions)
+
+    image_bytes = encode_image(image, image_format, quality)
+    return serialize_encoded_instance(image_id, image_bytes, captions)
+
+
+def serialize_encoded_instance(
+    image_id: int, image_bytes: bytes, captions: List[str]
+) -> bytes:
+    r"""
+    Serialize an instance with already encoded image bytes (for example, an
+    original JPEG file from disk) without re-encoding the image.
+    """
+    captions_bytes = json.dumps(captions).encode("utf-8")
+    return (
+        _ENCODED_HEADER.pack(image_id, len(captions_bytes))
+        + captions_bytes
+        + image_bytes
+    )
+
+
+def _serialize_raw_instance(
+    image_id: int, image: np.ndarray, captions: List[str]
+) -> bytes:
+    image = np.ascontiguousarray(image)
+    height, width, channels = image.shape
+    captions_bytes = json.dumps(captions).encode("utf-8")
+
+    # Layout: [header][captions][padding][image]
+    captions_offset = _RAW_HEADER.size
+    image_offset = captions_offset + len(captions_bytes)
+    padding = -image_offset % _RAW_ALIGNMENT
+    image_offset += padding
+
+    # fmt: off
+    header = _RAW_HEADER.pack(
+        image_id, height, width, channels, image.dtype.char.encode("ascii"),
+        image_offset, image.nbytes, captions_offset, len(captions_bytes),
+    )
+    # fmt: on
+    return header + captions_bytes + bytes(padding) + image.tobytes()
+
+
+def deserialize_instance(
+    record: bytes, image_format: str = "pickle"
+) -> Tuple[int, np.ndarray, List[str]]:
+    r"""
+    Deserialize an instance from bytes (or a buffer) serialized by
+    :func:`serialize_instance`, decoding the image if necessary. For ``raw``
+    format, image array shares memory with ``record`` and is read-only.
+
+    Returns
+    -------
+    Tuple[int, np.ndarray, List[str]]
+        Image ID, a ``uint8`` image array in HWC format (RGB) and captions.
+    """
+    if image_format == "pickle":
+        return pickle.loads(record)
+
+    if image_format == "raw":
+        return _deserialize_raw_instance(record)
+
+    image_id, captions_length = _ENCODED_HEADER.unpack_from(record, 0)
+    offset = _ENCODED_HEADER.size
+
+    captions = json.loads(bytes(record[offset : offset + captions_length]))
+    offset += captions_length
+
+    image = decode_image(np.frombuffer(record, dtype=np.uint8, offset=offset))
+    return image_id, image, captions
+
+
+def _deserialize_raw_instance(record: bytes) -> Tuple[int, np.ndarray, List[str]]:
+    # fmt: off
+    (
+        image_id, height, width, channels, dtype_char,
+        image_offset, image_length, captions_offset, captions_length,
+    ) = _RAW_HEADER.unpack_from(record, 0)
+    # fmt: on
+
+    captions = json.loads(
+        bytes(record[captions_offset : captions_offset + captions_length])
+    )
+    image = np.frombuffer(
+        record,
+        dtype=np.dtype(dtype_char.decode("ascii")),
+        count=height * width * channels,
+        offset=image_offset,
+    ).reshape(height, width, channels)
+    return image_id, image, captions
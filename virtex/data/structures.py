@@ -12,9 +12,90 @@ These classes are thin wrappers over native python dicts for two main purposes:
 
 """
 import copy
-from typing import Iterable, List, Optional, Union
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
+import numpy as np
 import torch
+from torch.utils.data import get_worker_info
+
+
+def _image_tensor(image: Iterable[float], keep_uint8: bool = False) -> torch.Tensor:
+    r"""
+    Make an image tensor from a numpy array (or tensor, or nested lists). For
+    numpy arrays, tensor shares memory with the array (with same strides, for
+    example, a transposed view) instead of copying it. Images are cast to
+    ``float32``, except ``uint8`` images if ``keep_uint8`` is ``True``.
+    """
+    if isinstance(image, np.ndarray):
+        # Torch does not support read-only arrays and negative strides.
+        if not image.flags.writeable or any(stride < 0 for stride in image.strides):
+            image = image.copy()
+        image = torch.from_numpy(image)
+    else:
+        image = torch.as_tensor(image)
+
+    # This is a no-op for `float32` tensors.
+    if keep_uint8 and image.dtype == torch.uint8:
+        return image
+    return image.float()
+
+
+def _empty_batch(
+    reference: torch.Tensor, shape: Tuple[int, ...]
+) -> torch.Tensor:
+    r"""
+    Allocate an uninitialized batch tensor of given shape, with same dtype as
+    ``reference``. It is allocated in shared memory if called in a dataloader
+    worker process, else PyTorch would copy it to shared memory while sending
+    it to main process (same as :func:`torch.utils.data.default_collate`).
+    """
+    if get_worker_info() is None:
+        return reference.new_empty(shape)
+
+    storage = reference.storage()._new_shared(int(np.prod(shape)))
+    return reference.new(storage).view(shape)
+
+
+def _stack(tensors: List[torch.Tensor]) -> torch.Tensor:
+    r"""Stack tensors of same shape at dim 0, directly into a batch tensor."""
+    batch = _empty_batch(tensors[0], (len(tensors), *tensors[0].shape))
+    return torch.stack(tensors, dim=0, out=batch)
+
+
+def _to(structure: Dict[str, torch.Tensor], *args, **kwargs):
+    r"""
+    Move all tensors of an instance (or batch) to a device and/or cast floating
+    point tensors to another floating point dtype. Returns a shallow copy: new
+    dict with new tensors, tensors on host are not copied before moving them.
+    """
+    device, dtype, non_blocking = torch._C._nn._parse_to(*args, **kwargs)[:3]
+
+    # Casting to non-float dtype is not allowed. Common cast dtype is
+    # `torch.half`, which would be done internally by NVIDIA Apex for mixed
+    # precision training.
+    if dtype is not None and not dtype.is_floating_point:
+        raise TypeError(
+            f"Can cast {structure.__class__.__name__} to a floating point "
+            f"dtype, but got desired dtype={dtype}"
+        )
+
+    new_structure = copy.copy(structure)
+    for key, value in structure.items():
+        # Cast all members which are of floating point dtype, and transfer all
+        # of them to device (in a single call each).
+        value_dtype = dtype if value.dtype.is_floating_point else None
+        new_structure[key] = value.to(
+            device=device, dtype=value_dtype, non_blocking=non_blocking
+        )
+
+    return new_structure
+
+
+def _pin_memory(structure: Dict[str, torch.Tensor]):
+    r"""Pin all tensors of an instance (or batch) in place and return it."""
+    for key in structure.keys():
+        structure[key] = structure[key].pin_memory()
+    return structure
 
 
 class Instance(dict):
@@ -29,7 +110,8 @@ class Instance(dict):
         r"""
         Defines the logic to move the whole instance across different
         :class:`torch.dtype`s and :class:`torch.device`s. Default implementation
-        shifts all tensor-like objects to device.
+        shifts all tensor-like objects to device. Use ``non_blocking=True`` for
+        asynchronous transfer of pinned tensors to GPU.
 
         .. note::
 
@@ -38,35 +120,14 @@ class Instance(dict):
             casts floats to half; while keeping integers, booleans and other
             data types unchanged.
         """
-        new_instance = self.clone()
-        device, dtype, non_blocking = torch._C._nn._parse_to(*args, **kwargs)
-
-        # Casting to non-float dtype is not allowed. Common cast dtype is
-        # `torch.half`, which would be done internally by NVIDIA Apex for mixed
-        # precision training.
-        if dtype is not None:
-            if not dtype.is_floating_point:
-                raise TypeError(
-                    f"Can cast {self.__class__.__name__} to a floating point "
-                    f"dtype, but got desired dtype={dtype}"
-                )
-            else:
-                # Cast all members which are of floating point dtype.
-                for key in new_instance.keys():
-                    if new_instance[key].dtype.is_floating_point:
-                        new_instance[key] = new_instance[key].to(dtype)
-
-        # Transfer all tensors to a specific device.
-        if device is not None:
-            for key in new_instance.keys():
-                new_instance[key] = new_instance[key].to(device)
-
-        return new_instance
-
-    def pin_memory(self):
-        r"""Pin GPU memory; only used internally by PyTorch dataloaders."""
-        for key in self.keys():
-            self[key].pin_memory()
+        return _to(self, *args, **kwargs)
+
+    def pin_memory(self) -> "Instance":
+        r"""
+        Pin memory of all tensors (for faster transfer to GPU) and return the
+        instance; used internally by PyTorch dataloaders.
+        """
+        return _pin_memory(self)
 
     def clone(self) -> "Instance":
         return copy.deepcopy(self)
@@ -81,28 +142,10 @@ class Batch(dict):
     """
 
     def to(self, *args, **kwargs) -> "Batch":
-        new_batch = self.clone()
-        device, dtype, non_blocking = torch._C._nn._parse_to(*args, **kwargs)
-
-        if dtype is not None:
-            if not dtype.is_floating_point:
-                raise TypeError(
-                    f"Can cast {self.__class__.__name__} to a floating point "
-                    f"dtype, but got desired dtype={dtype}"
-                )
-            else:
-                for key in new_batch.keys():
-                    if new_batch[key].dtype.is_floating_point:
-                        new_batch[key] = new_batch[key].to(dtype)
-
-        if device is not None:
-            for key in new_batch.keys():
-                new_batch[key] = new_batch[key].to(device)
-        return new_batch
-
-    def pin_memory(self):
-        for key in self.keys():
-            self[key].pin_memory()
+        return _to(self, *args, **kwargs)
+
+    def pin_memory(self) -> "Batch":
+        return _pin_memory(self)
 
     def clone(self) -> "Batch":
         return copy.deepcopy(self)
@@ -111,10 +154,10 @@ class Batch(dict):
 class ImageCaptionInstance(Instance):
     r"""
     An instance representing an image-caption pair. It contains caption tokens
-    in both, forward and backward direction.
+    only in forward direction, tokens in backward direction are made while
+    collating a batch (:class:`~virtex.data.structures.ImageCaptionBatch`).
 
-    Member names: ``{"image_id", "image", "caption_tokens", "noitpac_tokens",
-    "caption_lengths"}``
+    Member names: ``{"image_id", "image", "caption_tokens", "caption_lengths"}``
 
     Parameters
     ----------
@@ -122,35 +165,46 @@ class ImageCaptionInstance(Instance):
         A unique integer ID for current image (or instance). This is commonly
         the COCO image ID.
     image: Iterable[float]
-        Image tensor (or numpy array) in CHW format.
+        Image tensor (or numpy array) in CHW format. Numpy arrays are not copied
+        (image tensor is a view of the array) unless they are cast to float.
+        This may be ``None`` for caption-only instances, which do not have the
+        ``image`` member.
     caption_tokens: List[int]
         Tokenized caption sequences.
+    keep_uint8: bool, optional (default = False)
+        Keep ``uint8`` images as ``uint8`` (to be normalized on device) instead
+        of casting them to float.
     """
 
-    __slots__ = [
-        "image_id",
-        "image",
-        "caption_tokens",
-        "noitpac_tokens",
-        "caption_lengths",
-    ]
+    __slots__ = ["image_id", "image", "caption_tokens", "caption_lengths"]
 
     def __init__(
-        self, image_id: int, image: Iterable[float], caption_tokens: List[int]
+        self,
+        image_id: int,
+        image: Optional[Iterable[float]],
+        caption_tokens: List[int],
+        keep_uint8: bool = False,
     ):
         super().__init__(
             image_id=torch.tensor(image_id, dtype=torch.long),
-            image=torch.tensor(image, dtype=torch.float),
-            caption_tokens=torch.tensor(caption_tokens, dtype=torch.long),
-            noitpac_tokens=torch.tensor(caption_tokens, dtype=torch.long).flip(0),
+            caption_tokens=torch.as_tensor(caption_tokens, dtype=torch.long),
             caption_lengths=torch.tensor(len(caption_tokens), dtype=torch.long),
         )
+        if image is not None:
+            self["image"] = _image_tensor(image, keep_uint8)
 
 
 class ImageCaptionBatch(Batch):
     r"""
     Batch of :class:`~virtex.data.structures.ImageCaptionInstance`. Contains
-    same keys as instances.
+    same keys as instances, and caption tokens in backward direction.
+
+    Member names: ``{"image_id", "image", "caption_tokens", "noitpac_tokens",
+    "caption_lengths"}``
+
+    Images and caption tokens are written directly into preallocated batch
+    tensors. These are allocated in shared memory when collating in dataloader
+    workers, so they are not copied again while sending to main process.
 
     Parameters
     ----------
@@ -159,6 +213,9 @@ class ImageCaptionBatch(Batch):
         collated into a batch.
     padding_value: int, optional (default = 0)
         Padding value to fill while batching captions of different lengths.
+    pad_to_length: int, optional (default = None)
+        Pad caption tokens to this fixed length instead of the length of the
+        longest caption in batch. This keeps shapes of all batches same.
     """
 
     __slots__ = [
@@ -170,41 +227,54 @@ class ImageCaptionBatch(Batch):
     ]
 
     def __init__(
-        self, instances: List[ImageCaptionInstance], padding_value: int = 0
+        self,
+        instances: List[ImageCaptionInstance],
+        padding_value: int = 0,
+        pad_to_length: Optional[int] = None,
     ):
-
         # Stack `image_id` and `image` from instances to create batch at dim 0.
-        image_id = torch.stack([ins["image_id"] for ins in instances], dim=0)
-        image = torch.stack([ins["image"] for ins in instances], dim=0)
+        # Caption-only instances do not have images.
+        image_id = _stack([ins["image_id"] for ins in instances])
+        image_kwargs = {}
+        if "image" in instances[0]:
+            image_kwargs["image"] = _stack([ins["image"] for ins in instances])
 
         if "caption_tokens" in instances[0]:
-            # Find maximum caption length in this batch.
-            max_caption_length = max([ins["caption_lengths"] for ins in instances])
-
-            # Pad `caption_tokens` and `masked_labels` up to this length.
-            caption_tokens = torch.nn.utils.rnn.pad_sequence(
-                [ins["caption_tokens"] for ins in instances],
-                batch_first=True,
-                padding_value=padding_value,
-            )
-            noitpac_tokens = torch.nn.utils.rnn.pad_sequence(
-                [ins["noitpac_tokens"] for ins in instances],
-                batch_first=True,
-                padding_value=padding_value,
-            )
-            caption_lengths = torch.stack(
-                [ins["caption_lengths"] for ins in instances]
+            caption_lengths = _stack([ins["caption_lengths"] for ins in instances])
+            max_caption_length = pad_to_length or int(caption_lengths.max())
+
+            # Position of every token, and a mask of non-padding positions.
+            # shape: (batch_size, max_caption_length)
+            positions = torch.arange(max_caption_length).unsqueeze(0)
+            token_mask = positions < caption_lengths.unsqueeze(1)
+
+            # Fill tokens of all captions (concatenated) in non-padding positions,
+            # mask is row-major so tokens of every caption remain in order.
+            all_tokens = torch.cat([ins["caption_tokens"] for ins in instances])
+            caption_tokens = _empty_batch(
+                all_tokens, (len(instances), max_caption_length)
             )
+            caption_tokens.fill_(padding_value)
+            caption_tokens[token_mask] = all_tokens
+
+            # Flip tokens of every caption within its length (not the padding):
+            # token at position `j` in backward caption is at `length - 1 - j`.
+            flipped_positions = caption_lengths.unsqueeze(1) - 1 - positions
+            flipped_positions.clamp_(min=0)
+
+            noitpac_tokens = _empty_batch(caption_tokens, caption_tokens.shape)
+            torch.gather(caption_tokens, 1, flipped_positions, out=noitpac_tokens)
+            noitpac_tokens.masked_fill_(~token_mask, padding_value)
 
             super().__init__(
                 image_id=image_id,
-                image=image,
                 caption_tokens=caption_tokens,
                 noitpac_tokens=noitpac_tokens,
                 caption_lengths=caption_lengths,
+                **image_kwargs,
             )
         else:
-            super().__init__(image_id=image_id, image=image)
+            super().__init__(image_id=image_id, **image_kwargs)
 
 
 class LinearClassificationInstance(Instance):
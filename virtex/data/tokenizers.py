@@ -1,4 +1,5 @@
 import csv
+import hashlib
 from typing import Any, Dict, List
 
 import sentencepiece as sp
@@ -53,6 +54,14 @@ class SentencePieceBPETokenizer(object):
         self.model = sp.SentencePieceProcessor()
         self.model.Load(self.model_path)
 
+    def model_hash(self) -> str:
+        r"""
+        Return SHA-256 hash of the ``.model`` file, useful to check whether
+        cached tokens were produced by this tokenizer.
+        """
+        with open(self.model_path, "rb") as model_file:
+            return hashlib.sha256(model_file.read()).hexdigest()
+
     def get_vocab_size(self) -> int:
         r"""Return number of tokens in vocabulary (including special tokens)."""
         return len(self.model)
@@ -1,13 +1,20 @@
 import random
-from typing import List
+from typing import List, Optional, Tuple
 import unicodedata
 
 import albumentations as alb
 import cv2
+import numpy as np
 
 from virtex.data.tokenizers import SentencePieceBPETokenizer
 
 
+# Brightness bias in albumentations 0.x (0.4.3 in requirements) is relative to
+# mean intensity of input image. Later versions scale it by contrast too, so
+# `ColorJitter` uses its lookup tables only with albumentations 0.x.
+_ALBUMENTATIONS_MAJOR_VERSION = int(alb.__version__.split(".")[0])
+
+
 class CaptionOnlyTransform(alb.BasicTransform):
     r"""
     A base class for custom `albumentations <https://albumentations.readthedocs.io/en/latest/>`_
@@ -135,6 +142,10 @@ class HorizontalFlip(ImageCaptionTransform):
     word "left" with "right" in the caption. This transform can also work on
     images only (without the captions).
 
+    Caption may also be a tuple of pre-tokenized caption and its flipped
+    version (with "left" and "right" replaced before tokenization), like
+    ``(tokens, flipped_tokens)``. These are swapped on flipping.
+
     Examples
     --------
     >>> flip = ImageCaptionHorizontalFlip(p=0.5)
@@ -145,6 +156,9 @@ class HorizontalFlip(ImageCaptionTransform):
         return cv2.flip(img, 1)
 
     def apply_to_caption(self, caption, **params):
+        if isinstance(caption, tuple):
+            return caption[::-1]
+
         caption = (
             caption.replace("left", "[TMP]")
             .replace("right", "left")
@@ -160,6 +174,12 @@ class ColorJitter(alb.ImageOnlyTransform):
     is slightly faster (uses OpenCV) and compatible with rest of the transforms
     used here (albumentations-style). This class works only on ``uint8`` images.
 
+    Brightness and contrast are adjusted with one lookup table of 256 entries,
+    and hue and saturation are shifted with one pass in HSV colorspace (with a
+    three-channel lookup table), without any intermediate float images. Output
+    is identical to functional transforms of albumentations 0.x, other versions
+    (and non-``uint8`` images) use those functional transforms instead.
+
     .. note::
 
         Unlike torchvision variant, this class follows "garbage-in, garbage-out"
@@ -198,8 +218,6 @@ class ColorJitter(alb.ImageOnlyTransform):
         self.hue = hue
 
     def apply(self, img, **params):
-        original_dtype = img.dtype
-
         brightness_factor = random.uniform(1 - self.brightness, 1 + self.brightness)
         contrast_factor = random.uniform(1 - self.contrast, 1 + self.contrast)
         saturation_factor = random.uniform(1 - self.saturation, 1 + self.saturation)
@@ -207,17 +225,47 @@ class ColorJitter(alb.ImageOnlyTransform):
 
         # Convert arguments as required by albumentations functional interface.
         # "gain" = contrast and "bias" = (brightness_factor - 1)
-        img = alb.augmentations.functional.brightness_contrast_adjust(
-            img, alpha=contrast_factor, beta=brightness_factor - 1
-        )
+        alpha, beta = contrast_factor, brightness_factor - 1
+
         # Hue and saturation limits are required to be integers.
-        img = alb.augmentations.functional.shift_hsv(
-            img,
-            hue_shift=int(hue_factor * 255),
-            sat_shift=int(saturation_factor * 255),
-            val_shift=0,
-        )
-        img = img.astype(original_dtype)
+        hue_shift = int(hue_factor * 255)
+        sat_shift = int(saturation_factor * 255)
+
+        if (
+            img.dtype != np.uint8
+            or img.ndim != 3
+            or img.shape[2] != 3
+            or _ALBUMENTATIONS_MAJOR_VERSION != 0
+        ):
+            original_dtype = img.dtype
+            img = alb.augmentations.functional.brightness_contrast_adjust(
+                img, alpha=alpha, beta=beta
+            )
+            img = alb.augmentations.functional.shift_hsv(
+                img, hue_shift=hue_shift, sat_shift=sat_shift, val_shift=0
+            )
+            return img.astype(original_dtype)
+
+        # Brightness and contrast through a lookup table, same as albumentations:
+        # bias is relative to mean intensity of the image.
+        lut = np.arange(256, dtype=np.float32)
+        lut *= alpha
+        lut += beta * np.mean(cv2.mean(img)[:3])
+        img = cv2.LUT(img, np.clip(lut, 0, 255).astype(np.uint8))
+
+        if hue_shift != 0 or sat_shift != 0:
+            # Shift hue (cyclic, OpenCV keeps hue in [0, 180)) and saturation of
+            # all channels with a single three-channel lookup table, in place.
+            values = np.arange(256, dtype=np.int16)
+            hsv_lut = np.empty((256, 1, 3), dtype=np.uint8)
+            hsv_lut[:, 0, 0] = np.mod(values + hue_shift, 180)
+            hsv_lut[:, 0, 1] = np.clip(values + sat_shift, 0, 255)
+            hsv_lut[:, 0, 2] = values
+
+            cv2.cvtColor(img, cv2.COLOR_RGB2HSV, dst=img)
+            cv2.LUT(img, hsv_lut, dst=img)
+            cv2.cvtColor(img, cv2.COLOR_HSV2RGB, dst=img)
+
         return img
 
     def get_transform_init_args_names(self):
@@ -269,6 +317,137 @@ class SquareResize(alb.Resize):
         super().__init__(height=size, width=size, *args, **kwargs)
 
 
+class ResizeCenterCropNormalize(alb.ImageOnlyTransform):
+    r"""
+    A fused equivalent of :class:`albumentations.augmentations.transforms.SmallestMaxSize`,
+    :class:`~virtex.data.transforms.CenterSquareCrop` and (optionally)
+    :class:`albumentations.augmentations.transforms.Normalize` applied in
+    sequence, without making full size intermediate images.
+
+    Crop region is computed first, and only this region of the input image is
+    resized (bilinear, same sampling grid as ``cv2.resize``) by a single
+    ``cv2.warpAffine`` call. Then it is normalized directly to CHW format.
+
+    .. note::
+
+        ``cv2.warpAffine`` quantizes sampling positions to 1/32 of a pixel, so
+        output is not bit-exact with the unfused transforms: a few pixels may
+        differ by up to three intensity levels (before normalization), most
+        pixels differ by at most one level.
+
+    Output of this transform is an HWC *view* of the CHW image, so that it
+    composes with other transforms. Datasets transpose images to CHW format,
+    which gives back the contiguous CHW image without a copy.
+
+    Parameters
+    ----------
+    resize_size: int
+        Size of the shorter edge after resizing (keeping aspect ratio same).
+    crop_size: int
+        Dimension of the width and height of the cropped image.
+    mean: Tuple[float, float, float], optional (default = None)
+        Color normalization mean in RGB format (values in 0-1). If ``None``
+        (along with ``std``), image is not normalized and stays ``uint8``.
+    std: Tuple[float, float, float], optional (default = None)
+        Color normalization std in RGB format (values in 0-1).
+    """
+
+    def __init__(
+        self,
+        resize_size: int,
+        crop_size: int,
+        mean: Optional[Tuple[float, float, float]] = None,
+        std: Optional[Tuple[float, float, float]] = None,
+        always_apply: bool = False,
+        p: float = 1.0,
+    ):
+        super().__init__(always_apply=always_apply, p=p)
+        self.resize_size = resize_size
+        self.crop_size = crop_size
+        self.mean = mean
+        self.std = std
+
+        # Normalize as `alb.Normalize`: subtract mean and multiply by inverse
+        # of std (both scaled to 0-255). Shape: (channels, 1, 1)
+        if mean is not None:
+            self._mean = np.array(mean, dtype=np.float32).reshape(-1, 1, 1) * 255
+            self._inv_std = np.reciprocal(
+                np.array(std, dtype=np.float32).reshape(-1, 1, 1) * 255
+            )
+
+    def resize_crop_normalize(
+        self, image: np.ndarray, out: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        r"""
+        Transform an HWC ``uint8`` image and return it in CHW format. Output
+        is ``float32`` if normalized, else ``uint8``. If ``out`` is provided,
+        output is written in it (for example, in a preallocated batch) instead
+        of a new array, it must have shape ``(3, crop_size, crop_size)`` and
+        same dtype as output.
+        """
+        dtype = np.uint8 if self.mean is None else np.float32
+        shape = (3, self.crop_size, self.crop_size)
+        if out is not None and (out.shape != shape or out.dtype != dtype):
+            raise ValueError(
+                f"Output buffer must have shape {shape} and dtype "
+                f"{np.dtype(dtype)}, found {out.shape} and {out.dtype}."
+            )
+
+        height, width = image.shape[:2]
+
+        # Size of resized image, rounded like `alb.SmallestMaxSize`.
+        scale = self.resize_size / min(height, width)
+        resized_height, resized_width = round(height * scale), round(width * scale)
+        if resized_height < self.crop_size or resized_width < self.crop_size:
+            raise ValueError(
+                f"Requested crop size {self.crop_size} is larger than resized "
+                f"image size ({resized_height}, {resized_width})."
+            )
+
+        # Top left corner of crop in resized image, like `alb.CenterCrop`.
+        crop_top = (resized_height - self.crop_size) // 2
+        crop_left = (resized_width - self.crop_size) // 2
+
+        # Map every output pixel to the input image like `cv2.resize` (aligned
+        # at pixel centers), offset by crop corner.
+        scale_x, scale_y = width / resized_width, height / resized_height
+        # fmt: off
+        matrix = np.array([
+            [scale_x, 0, (crop_left + 0.5) * scale_x - 0.5],
+            [0, scale_y, (crop_top + 0.5) * scale_y - 0.5],
+        ])
+        # fmt: on
+        crop = cv2.warpAffine(
+            image,
+            matrix,
+            (self.crop_size, self.crop_size),
+            flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+            borderMode=cv2.BORDER_REPLICATE,
+        )
+        # Shape: (channels, crop_size, crop_size)
+        crop = np.transpose(crop, (2, 0, 1))
+
+        if self.mean is None:
+            if out is None:
+                return np.ascontiguousarray(crop)
+
+            np.copyto(out, crop)
+            return out
+
+        if out is None:
+            out = np.empty(crop.shape, dtype=np.float32)
+
+        np.subtract(crop, self._mean, out=out)
+        np.multiply(out, self._inv_std, out=out)
+        return out
+
+    def apply(self, img, **params):
+        return np.transpose(self.resize_crop_normalize(img), (1, 2, 0))
+
+    def get_transform_init_args_names(self):
+        return ("resize_size", "crop_size", "mean", "std")
+
+
 # =============================================================================
 #   SOME COMMON CONSTANTS AND IMAGE TRANSFORMS:
 #   These serve as references here, and are used as default params in many
@@ -27,11 +27,12 @@ from torch import nn, optim
 
 from virtex.config import Config
 import virtex.data as vdata
-from virtex.data import transforms as T
+from virtex.data import device_transforms as DT, image_decoders, transforms as T
 from virtex.data.tokenizers import SentencePieceBPETokenizer
 import virtex.models as vmodels
 from virtex.modules import visual_backbones, textual_heads
 from virtex.optim import Lookahead, lr_scheduler
+from virtex.utils import beam_search, decoding
 
 
 class Factory(object):
@@ -119,7 +120,9 @@ class ImageTransformsFactory(Factory):
     by :class:`PretrainingDatasetFactory` and :class:`DownstreamDatasetFactory`.
 
     Possible choices: ``{"center_crop", "horizontal_flip", "random_resized_crop",
-    "normalize", "global_resize", "color_jitter", "smallest_resize"}``.
+    "normalize", "global_resize", "color_jitter", "smallest_resize",
+    "resize_center_crop", "resize_center_crop_normalize"}``. Last two are fused
+    transforms, which replace a sequence of first few (see :meth:`fuse`).
     """
 
     # fmt: off
@@ -144,15 +147,149 @@ class ImageTransformsFactory(Factory):
         "normalize": partial(
             alb.Normalize, mean=T.IMAGENET_COLOR_MEAN, std=T.IMAGENET_COLOR_STD, p=1.0
         ),
+
+        # Fused transforms: whenever selected, these are always applied. These
+        # require two positional arguments: resize and crop dimensions.
+        "resize_center_crop": partial(T.ResizeCenterCropNormalize, p=1.0),
+        "resize_center_crop_normalize": partial(
+            T.ResizeCenterCropNormalize,
+            mean=T.IMAGENET_COLOR_MEAN, std=T.IMAGENET_COLOR_STD, p=1.0,
+        ),
     }
     # fmt: on
 
+    @classmethod
+    def fuse(cls, names: List[str]) -> List[str]:
+        r"""
+        Replace every sequence of ``"smallest_resize"``, ``"center_crop"`` (and
+        optionally ``"normalize"``) in a list of transform names with a single
+        fused transform, which does not make intermediate full size images.
+        Images are not bit-exact with the unfused transforms, a few pixels may
+        differ by up to three intensity levels. Dataset factories only fuse
+        transforms if ``DATA.FUSE_IMAGE_TRANSFORMS`` is ``True``.
+        """
+        fused_names: List[str] = []
+        while len(names) > 0:
+            if names[:3] == ["smallest_resize", "center_crop", "normalize"]:
+                fused_names.append("resize_center_crop_normalize")
+                names = names[3:]
+            elif names[:2] == ["smallest_resize", "center_crop"]:
+                fused_names.append("resize_center_crop")
+                names = names[2:]
+            else:
+                fused_names.append(names[0])
+                names = names[1:]
+
+        return fused_names
+
     @classmethod
     def from_config(cls, config: Config):
         r"""Augmentations cannot be created from config, only :meth:`create`."""
         raise NotImplementedError
 
 
+class ImageDecoderFactory(Factory):
+    r"""
+    Factory to create :mod:`~virtex.data.image_decoders`, which read images
+    from image files for datasets that do not use serialized LMDB files.
+
+    Possible choices: ``{"opencv", "pillow", "turbojpeg"}``.
+    """
+
+    PRODUCTS: Dict[str, Callable] = {
+        "opencv": image_decoders.OpenCVDecoder,
+        "pillow": image_decoders.PillowDecoder,
+        "turbojpeg": image_decoders.TurboJpegDecoder,
+    }
+
+    @classmethod
+    def from_config(
+        cls,
+        config: Config,
+        min_size: Optional[int] = None,
+        default: str = "opencv",
+        exif_transpose: bool = True,
+    ) -> image_decoders.ImageDecoder:
+        r"""
+        Create an image decoder directly from config.
+
+        Parameters
+        ----------
+        config: virtex.config.Config
+            Config object with all the parameters.
+        min_size: int, optional (default = None)
+            Decode JPEGs at a reduced scale keeping their shorter edge at least
+            this long. Datasets factories set this if images are resized first.
+        default: str, optional (default = "opencv")
+            Name of decoder to create if ``DATA.IMAGE_DECODER`` is "default".
+        exif_transpose: bool, optional (default = True)
+            Whether to rotate (or flip) images as per their EXIF orientation.
+        """
+
+        _C = config
+        name = default if _C.DATA.IMAGE_DECODER == "default" else _C.DATA.IMAGE_DECODER
+        return cls.create(name, min_size=min_size, exif_transpose=exif_transpose)
+
+
+class DeviceTransformsFactory(Factory):
+    r"""
+    Factory to create :mod:`~virtex.data.device_transforms`, which augment
+    batches of ``uint8`` images on device (GPU) instead of dataloader workers.
+    Names and arguments of transforms are same as :class:`ImageTransformsFactory`.
+
+    Possible choices: ``{"random_resized_crop", "horizontal_flip", "color_jitter",
+    "normalize"}``.
+    """
+
+    # fmt: off
+    PRODUCTS: Dict[str, Callable] = {
+        # This transform requires one positional argument: image dimension.
+        "random_resized_crop": partial(
+            DT.RandomResizedSquareCrop, scale=(0.2, 1.0), ratio=(0.75, 1.333)
+        ),
+        "color_jitter": partial(
+            DT.ColorJitter, brightness=0.4, contrast=0.4, saturation=0.4, hue=0.1, p=0.8
+        ),
+        # This transform optionally accepts a tokenizer to flip caption tokens.
+        "horizontal_flip": partial(DT.HorizontalFlip, p=0.5),
+        "normalize": DT.ImageNormalize,
+    }
+    # fmt: on
+
+    @classmethod
+    def from_config(cls, config: Config) -> DT.Compose:
+        r"""
+        Create device transforms for training split (``DATA.IMAGE_TRANSFORM_TRAIN``)
+        directly from config. These are applied in same order as listed.
+
+        Parameters
+        ----------
+        config: virtex.config.Config
+            Config object with all the parameters.
+        """
+
+        _C = config
+
+        # Tokenizer is needed to flip captions, other datasets have no captions.
+        tokenizer = None
+        if _C.MODEL.NAME != "multilabel_classification":
+            tokenizer = TokenizerFactory.from_config(_C)
+
+        transforms: List[nn.Module] = []
+        for name in _C.DATA.IMAGE_TRANSFORM_TRAIN:
+            if name not in cls.PRODUCTS:
+                raise ValueError(f"Transform {name} cannot be applied on device.")
+
+            if name == "random_resized_crop":
+                transforms.append(cls.create(name, _C.DATA.IMAGE_CROP_SIZE))
+            elif name == "horizontal_flip":
+                transforms.append(cls.create(name, tokenizer=tokenizer))
+            else:
+                transforms.append(cls.create(name))
+
+        return DT.Compose(transforms)
+
+
 class PretrainingDatasetFactory(Factory):
     r"""
     Factory to create :class:`~torch.utils.data.Dataset` s for pretraining
@@ -194,14 +331,43 @@ class PretrainingDatasetFactory(Factory):
         kwargs = {"data_root": _C.DATA.ROOT, "split": split}
 
         # Create a list of image transformations based on transform names.
+        image_transform_names: List[str] = list(
+            getattr(_C.DATA, f"IMAGE_TRANSFORM_{split.upper()}")
+        )
         image_transform_list: List[Callable] = []
+        image_size = _C.DATA.IMAGE_CROP_SIZE
+
+        # Training augmentations are applied on device, only resize images to a
+        # fixed size here to collate them (see `DeviceTransformsFactory`).
+        if _C.DATA.AUGMENT_ON_DEVICE and split == "train":
+            image_transform_names = ["smallest_resize", "center_crop"]
+            image_size = _C.DATA.DEVICE_AUGMENT_INPUT_SIZE
+
+        # Images are normalized on device, keep them as `uint8` here.
+        if _C.DATA.NORMALIZE_ON_DEVICE:
+            image_transform_names = [
+                name for name in image_transform_names if name != "normalize"
+            ]
+
+        # Keep images as `uint8` if they are normalized (or augmented) on device,
+        # else datasets cast them to float.
+        kwargs["keep_uint8"] = _C.DATA.NORMALIZE_ON_DEVICE or (
+            _C.DATA.AUGMENT_ON_DEVICE and split == "train"
+        )
+
+        if _C.DATA.FUSE_IMAGE_TRANSFORMS:
+            image_transform_names = ImageTransformsFactory.fuse(image_transform_names)
 
-        for name in getattr(_C.DATA, f"IMAGE_TRANSFORM_{split.upper()}"):
+        for name in image_transform_names:
             # Pass dimensions if cropping / resizing, else rely on the defaults
             # as per `ImageTransformsFactory`.
-            if "resize" in name or "crop" in name:
+            if name.startswith("resize_center_crop"):
+                image_transform_list.append(
+                    ImageTransformsFactory.create(name, image_size, image_size)
+                )
+            elif "resize" in name or "crop" in name:
                 image_transform_list.append(
-                    ImageTransformsFactory.create(name, _C.DATA.IMAGE_CROP_SIZE)
+                    ImageTransformsFactory.create(name, image_size)
                 )
             else:
                 image_transform_list.append(ImageTransformsFactory.create(name))
@@ -209,15 +375,33 @@ class PretrainingDatasetFactory(Factory):
         kwargs["image_transform"] = alb.Compose(image_transform_list)
 
         # Add dataset specific kwargs.
-        if _C.MODEL.NAME != "multilabel_classification":
+        if _C.MODEL.NAME == "multilabel_classification":
+            # Images are read from image files. If they are resized first, they
+            # can be decoded at a reduced scale.
+            resize_first = image_transform_names[:1] == ["smallest_resize"]
+            kwargs["image_decoder"] = ImageDecoderFactory.from_config(
+                _C, min_size=image_size if resize_first else None
+            )
+        else:
             tokenizer = TokenizerFactory.from_config(_C)
             kwargs.update(
                 tokenizer=tokenizer,
                 max_caption_length=_C.DATA.MAX_CAPTION_LENGTH,
                 use_single_caption=_C.DATA.USE_SINGLE_CAPTION,
                 percentage=_C.DATA.USE_PERCENTAGE if split == "train" else 100.0,
+                pretokenized=_C.DATA.PRETOKENIZED_CAPTIONS,
+                pad_to_max_length=_C.DATA.PAD_TO_MAX_LENGTH,
             )
 
+        # Stream training split from tar shards (only for captioning datasets).
+        if _C.DATA.STREAMING and split == "train":
+            if cls.PRODUCTS[_C.MODEL.NAME] is not vdata.CaptioningDataset:
+                raise ValueError(f"{_C.MODEL.NAME} does not support streaming.")
+            if kwargs.pop("percentage") < 100.0:
+                raise ValueError("DATA.USE_PERCENTAGE is not supported with streaming.")
+
+            return vdata.StreamingCaptioningDataset(**kwargs)
+
         # Dataset names match with model names (and ofcourse pretext names).
         return cls.create(_C.MODEL.NAME, **kwargs)
 
@@ -266,9 +450,14 @@ class DownstreamDatasetFactory(Factory):
         # Create a list of image transformations based on names.
         image_transform_list: List[Callable] = []
 
+        if _C.DATA.FUSE_IMAGE_TRANSFORMS:
+            image_transform_names = ImageTransformsFactory.fuse(image_transform_names)
+
         for name in image_transform_names:
             # Pass dimensions for resize/crop, else rely on the defaults.
-            if name in {"random_resized_crop", "center_crop", "global_resize"}:
+            if name.startswith("resize_center_crop"):
+                transform = ImageTransformsFactory.create(name, 256, 224)
+            elif name in {"random_resized_crop", "center_crop", "global_resize"}:
                 transform = ImageTransformsFactory.create(name, 224)
             elif name in {"smallest_resize"}:
                 transform = ImageTransformsFactory.create(name, 256)
@@ -279,6 +468,17 @@ class DownstreamDatasetFactory(Factory):
 
         kwargs["image_transform"] = alb.Compose(image_transform_list)
 
+        # Images are read from image files. If they are resized first, they
+        # can be decoded at a reduced scale. ImageNet images are decoded like
+        # torchvision by default: with Pillow, ignoring EXIF orientation.
+        resize_first = image_transform_names[:1] == ["smallest_resize"]
+        is_imagenet = cls.PRODUCTS[_C.DATA.ROOT] is vdata.ImageNetDataset
+        kwargs["image_decoder"] = ImageDecoderFactory.from_config(
+            _C,
+            min_size=256 if resize_first else None,
+            default="pillow" if is_imagenet else "opencv",
+            exif_transpose=not is_imagenet,
+        )
         return cls.create(_C.DATA.ROOT, **kwargs)
 
 
@@ -384,6 +584,51 @@ class TextualHeadFactory(Factory):
         return cls.create(name, **kwargs)
 
 
+class DecoderFactory(Factory):
+    r"""
+    Factory to create decoders, which predict captions with captioning models
+    during inference: :class:`~virtex.utils.beam_search.AutoRegressiveBeamSearch`,
+    or cheaper ones from :mod:`~virtex.utils.decoding` (greedy search, top-k
+    and nucleus sampling).
+
+    Possible choices: ``{"beam_search", "greedy", "top_k", "nucleus"}``.
+    """
+
+    PRODUCTS: Dict[str, Callable] = {
+        "beam_search": beam_search.AutoRegressiveBeamSearch,
+        "greedy": decoding.AutoRegressiveGreedySearch,
+        "top_k": decoding.AutoRegressiveSampling,
+        "nucleus": decoding.AutoRegressiveSampling,
+    }
+
+    @classmethod
+    def from_config(cls, config: Config) -> decoding.DecoderType:
+        r"""
+        Create a decoder directly from config.
+
+        Parameters
+        ----------
+        config: virtex.config.Config
+            Config object with all the parameters.
+        """
+
+        _C = config
+        name = _C.MODEL.DECODER.NAME
+
+        kwargs = {"max_steps": _C.DATA.MAX_CAPTION_LENGTH}
+        if name == "beam_search":
+            kwargs.update(
+                beam_size=_C.MODEL.DECODER.BEAM_SIZE,
+                length_penalty=_C.MODEL.DECODER.LENGTH_PENALTY,
+            )
+        elif name == "top_k":
+            kwargs.update(top_k=_C.MODEL.DECODER.TOP_K)
+        elif name == "nucleus":
+            kwargs.update(top_p=_C.MODEL.DECODER.TOP_P)
+
+        return cls.create(name, _C.DATA.EOS_INDEX, **kwargs)
+
+
 class PretrainingModelFactory(Factory):
     r"""
     Factory to create :mod:`~virtex.models` for different pretraining tasks.
@@ -421,9 +666,10 @@ class PretrainingModelFactory(Factory):
         kwargs = {}
         if "captioning" in _C.MODEL.NAME:
             kwargs.update(
-                max_decoding_steps=_C.DATA.MAX_CAPTION_LENGTH,
                 sos_index=_C.DATA.SOS_INDEX,
                 eos_index=_C.DATA.EOS_INDEX,
+                no_repeat_ngram_size=_C.MODEL.DECODER.NO_REPEAT_NGRAM_SIZE,
+                decoder=DecoderFactory.from_config(_C),
             )
 
         elif _C.MODEL.NAME == "token_classification":
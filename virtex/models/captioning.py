@@ -1,6 +1,6 @@
 import copy
-import functools
-from typing import Any, Dict
+from typing import Any, Dict, Optional, Tuple
+import warnings
 
 import torch
 from torch import nn
@@ -8,9 +8,10 @@ from torch.nn import functional as F
 
 from virtex.data.structures import ImageCaptionBatch
 from virtex.data.tokenizers import SentencePieceBPETokenizer
-from virtex.modules.textual_heads import TextualHead
+from virtex.modules.textual_heads import DecodingContext, TextualHead
 from virtex.modules.visual_backbones import VisualBackbone
 from virtex.utils.beam_search import AutoRegressiveBeamSearch
+from virtex.utils.decoding import DecoderType, RepetitionPenalty
 
 
 class CaptioningModel(nn.Module):
@@ -22,7 +23,7 @@ class CaptioningModel(nn.Module):
 
     During training, it maximizes the likelihood of ground truth caption
     conditioned on image features. During inference, it predicts a caption for
-    an input image through beam search decoding.
+    an input image through beam search decoding (or another decoder).
 
     Parameters
     ----------
@@ -45,6 +46,20 @@ class CaptioningModel(nn.Module):
         ``False`` -- only forward captioning is performed. When ``True``, a
         clone of textual head is created, which does not share weights with
         "forward" model except input and output embeddings.
+    no_repeat_ngram_size: int, optional (default = 0)
+        Block n-grams of this size from repeating in predicted captions during
+        decoding, see :class:`~virtex.utils.decoding.RepetitionPenalty`.
+        Tokens are never repeated twice in a row, irrespective of this value.
+    length_penalty: float, optional (default = 0.0)
+        Exponent of caption lengths to normalize log probs of beams by, before
+        picking the best beam. See
+        :class:`~virtex.utils.beam_search.AutoRegressiveBeamSearch`.
+    decoder: DecoderType, optional (default = None)
+        A decoder to predict captions during inference, such as
+        :class:`~virtex.utils.beam_search.AutoRegressiveBeamSearch` or
+        :class:`~virtex.utils.decoding.AutoRegressiveGreedySearch`. If ``None``,
+        beam search is used with ``beam_size``, ``max_decoding_steps`` and
+        ``length_penalty`` (these are ignored otherwise).
     """
 
     def __init__(
@@ -56,6 +71,9 @@ class CaptioningModel(nn.Module):
         sos_index: int = 1,
         eos_index: int = 2,
         caption_backward: bool = False,
+        no_repeat_ngram_size: int = 0,
+        length_penalty: float = 0.0,
+        decoder: Optional[DecoderType] = None,
     ):
         super().__init__()
         self.visual = visual
@@ -75,12 +93,35 @@ class CaptioningModel(nn.Module):
             self.backward_textual.embedding = self.textual.embedding
             self.backward_textual.output = self.textual.output
 
-        # These boundary indices are needed for beam search.
+        # These boundary indices are needed for decoding.
         self.sos_index = sos_index
         self.eos_index = eos_index
-        self.beam_search = AutoRegressiveBeamSearch(
-            self.eos_index, beam_size=5, max_steps=max_decoding_steps
+        self.decoder = decoder
+        if self.decoder is None:
+            self.decoder = AutoRegressiveBeamSearch(
+                self.eos_index,
+                beam_size=beam_size,
+                max_steps=max_decoding_steps,
+                length_penalty=length_penalty,
+            )
+        self.repetition_penalty = RepetitionPenalty(
+            no_repeat_ngram_size=no_repeat_ngram_size
+        )
+
+    @property
+    def beam_search(self) -> DecoderType:
+        r"""Deprecated alias of :attr:`decoder`, kept for compatibility."""
+        warnings.warn(
+            "`beam_search` is deprecated, use `decoder` instead.", DeprecationWarning
+        )
+        return self.decoder
+
+    @beam_search.setter
+    def beam_search(self, decoder: DecoderType):
+        warnings.warn(
+            "`beam_search` is deprecated, use `decoder` instead.", DeprecationWarning
         )
+        self.decoder = decoder
 
     def forward(self, batch: ImageCaptionBatch) -> Dict[str, Any]:
         r"""
@@ -165,90 +206,108 @@ class CaptioningModel(nn.Module):
                 captioning_backward=backward_loss.clone().detach()
             )
 
-            # During evaluation, get beam search predictions for forward model.
+            # During evaluation, get decoded predictions for forward model.
             # Predictions from forward transformer will be shifted right by one
             # time-step.
             if not self.training:
                 start_predictions = projected_visual_features.new_full(
                     (batch_size,), self.sos_index
                 ).long()
-                # Add image features as a default argument to match callable
-                # signature accepted by beam search class (partial captions only).
-                beam_search_step = functools.partial(
-                    self.beam_search_step, projected_visual_features
+                # Project image features for all layers once, these are shared
+                # by all beams and reused at every time-step. Decoder passes
+                # them to step function, for images which are not finished.
+                decoding_context = self.textual.make_decoding_context(
+                    projected_visual_features
                 )
-                all_top_k_predictions, _ = self.beam_search.search(
-                    start_predictions, beam_search_step
+                all_top_k_predictions, _ = self.decoder.search(
+                    start_predictions,
+                    self.decoding_step,
+                    start_state={},
+                    context=decoding_context,
                 )
                 best_beam = all_top_k_predictions[:, 0, :]
                 output_dict["predictions"] = best_beam
 
         return output_dict
 
-    def beam_search_step(
-        self, projected_visual_features: torch.Tensor, partial_captions: torch.Tensor
-    ) -> torch.Tensor:
+    def decoding_step(
+        self,
+        decoding_context: DecodingContext,
+        last_predictions: torch.Tensor,
+        state: Dict[str, torch.Tensor],
+    ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
         r"""
-        Given visual features and a batch of (assumed) partial captions, predict
-        the distribution over vocabulary tokens for next time-step. This method
-        is used by :class:`~virtex.utils.beam_search.AutoRegressiveBeamSearch`.
+        Given visual features and last predicted tokens of a batch of (assumed)
+        partial captions, predict the distribution over vocabulary tokens for
+        next time-step. This method is used by decoders (like
+        :class:`~virtex.utils.beam_search.AutoRegressiveBeamSearch`) as an
+        incremental step function: previous tokens are not processed again,
+        their keys and values are cached by the textual head in ``state``.
 
         Parameters
         ----------
-        projected_visual_features: torch.Tensor
-            A tensor of shape ``(batch_size, ..., textual_feature_size)``
-            with visual features already projected to ``textual_feature_size``.
-        partial_captions: torch.Tensor
-            A tensor of shape ``(batch_size * beam_size, timesteps)``
-            containing tokens predicted so far -- one for each beam. We need all
-            prior predictions because our model is auto-regressive.
+        decoding_context: virtex.modules.textual_heads.DecodingContext
+            Visual features projected for decoder attention of textual head,
+            from :meth:`~virtex.modules.textual_heads.TransformerTextualHead.make_decoding_context`.
+            Decoders drop images from it once their captions are finished.
+        last_predictions: torch.Tensor
+            A tensor of shape ``(batch_size * beam_size, )`` containing tokens
+            predicted at the last time-step -- one for each beam.
+        state: Dict[str, torch.Tensor]
+            Cache of the textual head from the last time-step (empty for the
+            first time-step), with beams reordered by beam search. It also
+            holds tokens of partial captions, to penalize repetitions.
 
         Returns
         -------
-        torch.Tensor
+        Tuple[torch.Tensor, Dict[str, torch.Tensor]]
             A tensor of shape ``(batch_size * beam_size, vocab_size)`` -- output
-            distribution over tokens for next time-step.
+            distribution over tokens for next time-step, and updated state.
         """
 
-        batch_size, num_features, textual_feature_size = (
-            projected_visual_features.size()
+        is_first_timestep = len(state) == 0
+
+        # Tokens of partial captions with the last predicted token, for
+        # penalizing repetitions (only the start token at first time-step).
+        # shape: (batch_size * beam_size, timesteps)
+        partial_captions = torch.cat(
+            [
+                state.get(
+                    "partial_captions",
+                    last_predictions.new_empty((last_predictions.size(0), 0)),
+                ),
+                last_predictions.unsqueeze(1),
+            ],
+            dim=1,
         )
-        # Expand and repeat image features while doing beam search.
-        beam_size = int(partial_captions.size(0) / batch_size)
-        if beam_size > 1:
-            projected_visual_features = projected_visual_features.unsqueeze(1).repeat(
-                1, beam_size, 1, 1
-            )
-            projected_visual_features = projected_visual_features.view(
-                batch_size * beam_size, num_features, textual_feature_size
-            )
-
-        # Provide caption lengths as current length (irrespective of predicted
-        # EOS/padding tokens). shape: (batch_size, )
-        caption_lengths = torch.ones_like(partial_captions)
-        if len(caption_lengths.size()) == 2:
-            caption_lengths = caption_lengths.sum(1)
-        else:
-            # Add a time-step. shape: (batch_size, 1)
-            partial_captions = partial_captions.unsqueeze(1)
-
-        # shape: (batch_size * beam_size, partial_caption_length, vocab_size)
-        output_logits = self.textual(
-            partial_captions, caption_lengths, projected_visual_features
+        # shape: (batch_size * beam_size, vocab_size)
+        output_logits, state = self.textual.forward_step(
+            last_predictions, decoding_context, state
         )
-        # Keep features for last time-step only, we only care about those.
-        output_logits = output_logits[:, -1, :]
+        state["partial_captions"] = partial_captions
+
+        # Start token is only used to predict the first token, partial captions
+        # in beam search do not include it. Keep empty cache of keys and values.
+        if is_first_timestep:
+            state = {key: value[:, :0] for key, value in state.items()}
 
         # Return logprobs as required by `AutoRegressiveBeamSearch`.
         # shape: (batch_size * beam_size, vocab_size)
         next_logprobs = F.log_softmax(output_logits, dim=1)
 
-        # Set logprobs of last predicted tokens as high negative value to avoid
-        # repetition in caption.
-        for index in range(batch_size * beam_size):
-            next_logprobs[index, partial_captions[index, -1]] = -1000000
+        # Set logprobs of last predicted tokens (and tokens completing repeated
+        # n-grams) as high negative value to avoid repetition in caption.
+        next_logprobs = self.repetition_penalty(next_logprobs, partial_captions)
+
+        return next_logprobs, state
 
-        return next_logprobs
+    def beam_search_step(self, *args, **kwargs):
+        r"""Deprecated alias of :meth:`decoding_step`, kept for compatibility."""
+        warnings.warn(
+            "`beam_search_step` is deprecated, use `decoding_step` instead.",
+            DeprecationWarning,
+        )
+        return self.decoding_step(*args, **kwargs)
 
     def log_predictions(
         self, batch: ImageCaptionBatch, tokenizer: SentencePieceBPETokenizer
@@ -283,6 +342,9 @@ class ForwardCaptioningModel(CaptioningModel):
         max_decoding_steps: int = 30,
         sos_index: int = 1,
         eos_index: int = 2,
+        no_repeat_ngram_size: int = 0,
+        length_penalty: float = 0.0,
+        decoder: Optional[DecoderType] = None,
     ):
         super().__init__(
             visual,
@@ -292,6 +354,9 @@ class ForwardCaptioningModel(CaptioningModel):
             sos_index=sos_index,
             eos_index=eos_index,
             caption_backward=False,
+            no_repeat_ngram_size=no_repeat_ngram_size,
+            length_penalty=length_penalty,
+            decoder=decoder,
         )
 
 
@@ -309,6 +374,9 @@ class BidirectionalCaptioningModel(CaptioningModel):
         max_decoding_steps: int = 30,
         sos_index: int = 1,
         eos_index: int = 2,
+        no_repeat_ngram_size: int = 0,
+        length_penalty: float = 0.0,
+        decoder: Optional[DecoderType] = None,
     ):
         super().__init__(
             visual,
@@ -318,4 +386,7 @@ class BidirectionalCaptioningModel(CaptioningModel):
             sos_index=sos_index,
             eos_index=eos_index,
             caption_backward=True,
+            no_repeat_ngram_size=no_repeat_ngram_size,
+            length_penalty=length_penalty,
+            decoder=decoder,
         )
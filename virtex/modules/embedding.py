@@ -49,7 +49,7 @@ class WordAndPositionalEmbedding(nn.Module):
         )
         self.dropout = nn.Dropout(p=dropout)
 
-    def forward(self, tokens: torch.Tensor) -> torch.Tensor:
+    def forward(self, tokens: torch.Tensor, start_position: int = 0) -> torch.Tensor:
         r"""
         Get combined word and positional embeddings for input tokens.
 
@@ -58,6 +58,9 @@ class WordAndPositionalEmbedding(nn.Module):
         tokens: torch.Tensor
             A tensor of shape ``(batch_size, max_caption_length)`` containing
             a batch of caption tokens, with values in ``[0, vocab_size)``.
+        start_position: int, optional (default = 0)
+            Position of the first token. Useful while decoding one token at a
+            time, when tokens are the continuation of a partial caption.
 
         Returns
         -------
@@ -66,6 +69,8 @@ class WordAndPositionalEmbedding(nn.Module):
             containing corresponding token embeddings.
         """
         position_indices = self._create_position_indices(tokens)
+        if start_position > 0:
+            position_indices = position_indices + start_position
 
         # shape: (batch_size, max_caption_length, hidden_size)
         word_embeddings = self.words(tokens)
@@ -1,8 +1,13 @@
+from typing import Dict, List, Tuple
+
 import torch
 from torch import nn
 
 from virtex.modules.embedding import WordAndPositionalEmbedding
-from virtex.modules.transformer import PreNormTransformerDecoderLayer
+from virtex.modules.transformer import (
+    PostNormTransformerDecoderLayer,
+    PreNormTransformerDecoderLayer,
+)
 
 
 class TextualHead(nn.Module):
@@ -55,6 +60,49 @@ class LinearTextualHead(TextualHead):
         return output_logits
 
 
+class DecodingContext(object):
+    r"""
+    Keys and values of decoder attention over visual features, for all layers
+    of a :class:`TransformerTextualHead`. These are computed once per image by
+    :meth:`TransformerTextualHead.make_decoding_context`, and reused at every
+    time-step of decoding. All partial captions of an image (like beams in beam
+    search) attend to the same keys and values, these are never repeated for
+    every partial caption.
+
+    Parameters
+    ----------
+    memory_keys: List[torch.Tensor]
+        Keys of every layer, tensors of shape ``(batch_size, num_features,
+        textual_feature_size)``.
+    memory_values: List[torch.Tensor]
+        Values of every layer, same shapes as keys.
+    """
+
+    def __init__(
+        self, memory_keys: List[torch.Tensor], memory_values: List[torch.Tensor]
+    ):
+        self.memory_keys = memory_keys
+        self.memory_values = memory_values
+
+    @property
+    def batch_size(self) -> int:
+        r"""Number of images in this context."""
+        return self.memory_keys[0].size(0)
+
+    def index_select(self, indices: torch.Tensor) -> "DecodingContext":
+        r"""
+        Select images of this context (for example, to stop decoding images
+        whose captions are complete), as per a tensor of indices.
+        """
+        return DecodingContext(
+            [memory_key.index_select(0, indices) for memory_key in self.memory_keys],
+            [
+                memory_value.index_select(0, indices)
+                for memory_value in self.memory_values
+            ],
+        )
+
+
 class TransformerTextualHead(TextualHead):
     def __init__(
         self,
@@ -83,7 +131,7 @@ class TransformerTextualHead(TextualHead):
         )
         # Make encoder layer depending on whether it's a Pre-Norm or Post-Norm.
         LayerClass = (
-            nn.TransformerDecoderLayer
+            PostNormTransformerDecoderLayer
             if norm_type == "post"
             else PreNormTransformerDecoderLayer
         )
@@ -159,6 +207,81 @@ class TransformerTextualHead(TextualHead):
         output_logits = self.output(textual_features)
         return output_logits
 
+    def make_decoding_context(self, visual_features: torch.Tensor) -> DecodingContext:
+        r"""
+        Project visual features to keys and values of decoder attention of all
+        layers, for decoding one token at a time with :meth:`forward_step`.
+
+        Parameters
+        ----------
+        visual_features: torch.Tensor
+            A tensor of shape ``(batch_size, ..., textual_feature_size)``.
+        """
+        memory_keys: List[torch.Tensor] = []
+        memory_values: List[torch.Tensor] = []
+        for layer in self.encoder.layers:
+            memory_key, memory_value = layer.project_memory(visual_features)
+            memory_keys.append(memory_key)
+            memory_values.append(memory_value)
+
+        return DecodingContext(memory_keys, memory_values)
+
+    def forward_step(
+        self,
+        caption_tokens: torch.Tensor,
+        context: DecodingContext,
+        cache: Dict[str, torch.Tensor],
+    ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
+        r"""
+        Decode one token at a time (for example, during beam search) by caching
+        keys and values of self-attention over previous tokens of every layer.
+        Output logits are same as that of :meth:`forward` at the last position
+        of the whole partial caption, without processing previous tokens again.
+
+        Parameters
+        ----------
+        caption_tokens: torch.Tensor
+            A tensor of shape ``(batch_size * group_size, )`` containing the
+            last token of every partial caption. Every image may have a group
+            of partial captions (like beams), grouped by image.
+        context: DecodingContext
+            Projected visual features from :meth:`make_decoding_context`, same
+            for all time-steps.
+        cache: Dict[str, torch.Tensor]
+            Cache returned after the previous token, or an empty dict for the
+            first token. All tensors in cache have partial captions at dim 0,
+            so they can be reordered (or expanded) together with them. Keys of
+            cache are ``"keys_{i}"`` and ``"values_{i}"`` for every layer ``i``.
+
+        Returns
+        -------
+        Tuple[torch.Tensor, Dict[str, torch.Tensor]]
+            Logits over vocabulary for the next token (a tensor of shape
+            ``(batch_size * group_size, vocab_size)``), and updated cache.
+        """
+        # Number of previous tokens, these many keys (and values) are cached.
+        timestep = cache["keys_0"].size(1) if "keys_0" in cache else 0
+        cache = dict(cache)
+
+        # shape: (batch_size * group_size, 1, textual_feature_size)
+        textual_features = self.embedding(
+            caption_tokens.unsqueeze(1), start_position=timestep
+        )
+        for index, layer in enumerate(self.encoder.layers):
+            textual_features, key, value = layer.forward_step(
+                textual_features,
+                context.memory_keys[index],
+                context.memory_values[index],
+                past_key=cache.get(f"keys_{index}"),
+                past_value=cache.get(f"values_{index}"),
+            )
+            cache[f"keys_{index}"] = key
+            cache[f"values_{index}"] = value
+
+        # shape: (batch_size * group_size, vocab_size)
+        output_logits = self.output(textual_features.squeeze(1))
+        return output_logits, cache
+
     def _generate_future_mask(
         self, size: int, dtype: torch.dtype, device: torch.device
     ) -> torch.Tensor:
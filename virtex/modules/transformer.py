@@ -1,7 +1,140 @@
+from typing import Optional, Tuple
+
+import torch
 from torch import nn
+from torch.nn import functional as F
+
+
+class _IncrementalDecodingMixin(object):
+    r"""
+    Helpers for decoding one token at a time with transformer decoder layers
+    (subclasses of :class:`torch.nn.TransformerDecoderLayer`). Keys and values
+    of self-attention over previous tokens are cached and extended by one token
+    per step. Keys and values of attention over the (fixed) visual memory are
+    projected once, through :meth:`project_memory`.
+
+    All tensors in these methods have batch at dim 0, unlike ``forward``. Every
+    image in memory may have a group of tokens (like beams in beam search), so
+    tokens have ``batch_size * group_size`` rows, grouped by image.
+    """
+
+    def project_memory(
+        self, memory: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        r"""
+        Project memory to keys and values of decoder attention (same for all
+        decoding steps).
+
+        Parameters
+        ----------
+        memory: torch.Tensor
+            A tensor of shape ``(batch_size, num_features, hidden_size)``.
+
+        Returns
+        -------
+        Tuple[torch.Tensor, torch.Tensor]
+            Keys and values, both tensors of same shape as ``memory``.
+        """
+        return (
+            _in_projection(self.multihead_attn, memory, 1),
+            _in_projection(self.multihead_attn, memory, 2),
+        )
+
+    def _self_attention_step(
+        self,
+        tgt: torch.Tensor,
+        past_key: Optional[torch.Tensor],
+        past_value: Optional[torch.Tensor],
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        r"""
+        Attend from the current token to itself and all previous tokens.
+        Return attention output, and keys and values including current token.
+        """
+        key = _in_projection(self.self_attn, tgt, 1)
+        value = _in_projection(self.self_attn, tgt, 2)
+        if past_key is not None:
+            key = torch.cat([past_key, key], dim=1)
+            value = torch.cat([past_value, value], dim=1)
+
+        query = _in_projection(self.self_attn, tgt, 0)
+        return _attention(self.self_attn, query, key, value), key, value
+
+    def _decoder_attention_step(
+        self, tgt: torch.Tensor, memory_key: torch.Tensor, memory_value: torch.Tensor
+    ) -> torch.Tensor:
+        r"""
+        Attend from the current token to projected memory. Tokens of a group
+        attend together as queries of their image, instead of repeating memory
+        for every token in group.
+        """
+        query = _in_projection(self.multihead_attn, tgt, 0)
+
+        # shape: (batch_size, group_size, hidden_size)
+        query = query.reshape(memory_key.size(0), -1, query.size(-1))
+        output = _attention(self.multihead_attn, query, memory_key, memory_value)
+        return output.reshape(tgt.size())
+
+
+class PostNormTransformerDecoderLayer(
+    _IncrementalDecodingMixin, nn.TransformerDecoderLayer
+):
+    r"""
+    Same as :class:`torch.nn.TransformerDecoderLayer` (layer normalization is
+    performed after residual connections), with an extra method to decode one
+    token at a time (:meth:`forward_step`).
+    """
+
+    def forward_step(
+        self,
+        tgt: torch.Tensor,
+        memory_key: torch.Tensor,
+        memory_value: torch.Tensor,
+        past_key: Optional[torch.Tensor] = None,
+        past_value: Optional[torch.Tensor] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        r"""
+        Transform features of the current token, attending to all previous
+        tokens and memory. This gives same output as ``forward`` with a future
+        mask, at the last position of the whole sequence.
+
+        Parameters
+        ----------
+        tgt: torch.Tensor
+            Features of current token, tensor of shape ``(batch_size *
+            group_size, 1, hidden_size)``.
+        memory_key: torch.Tensor
+            Memory projected to keys, from :meth:`project_memory`. A tensor of
+            shape ``(batch_size, num_features, hidden_size)``.
+        memory_value: torch.Tensor
+            Memory projected to values, from :meth:`project_memory`.
+        past_key: torch.Tensor, optional (default = None)
+            Self-attention keys of previous tokens, tensor of shape
+            ``(batch_size * group_size, num_past_tokens, hidden_size)``.
+            ``None`` for the first token.
+        past_value: torch.Tensor, optional (default = None)
+            Self-attention values of previous tokens, same shape as keys.
+
+        Returns
+        -------
+        Tuple[torch.Tensor, torch.Tensor, torch.Tensor]
+            Output features of current token (same shape as ``tgt``), and
+            self-attention keys and values including current token (to pass as
+            ``past_key`` and ``past_value`` for the next token).
+        """
+        tgt2, key, value = self._self_attention_step(tgt, past_key, past_value)
+        tgt = self.norm1(tgt + self.dropout1(tgt2))
+
+        tgt2 = self._decoder_attention_step(tgt, memory_key, memory_value)
+        tgt = self.norm2(tgt + self.dropout2(tgt2))
 
+        tgt2 = self.linear2(self.dropout(self.activation(self.linear1(tgt))))
+        tgt = self.norm3(tgt + self.dropout3(tgt2))
+        return tgt, key, value
 
-class PreNormTransformerDecoderLayer(nn.TransformerDecoderLayer):
+
+class PreNormTransformerDecoderLayer(
+    _IncrementalDecodingMixin, nn.TransformerDecoderLayer
+):
     r"""
     A variant of :class:`torch.nn.TransformerDecoderLayer` where layer
     normalization is included inside the residual branch, and performed before
@@ -36,3 +169,77 @@ class PreNormTransformerDecoderLayer(nn.TransformerDecoderLayer):
         tgt2 = self.linear2(self.dropout(self.activation(self.linear1(tgt2))))
         tgt = tgt + self.dropout3(tgt2)
         return tgt
+
+    def forward_step(
+        self,
+        tgt: torch.Tensor,
+        memory_key: torch.Tensor,
+        memory_value: torch.Tensor,
+        past_key: Optional[torch.Tensor] = None,
+        past_value: Optional[torch.Tensor] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        r"""
+        Transform features of the current token, attending to all previous
+        tokens and memory. Refer :meth:`PostNormTransformerDecoderLayer.forward_step`
+        for details on arguments and return values.
+        """
+        tgt2, key, value = self._self_attention_step(
+            self.norm1(tgt), past_key, past_value
+        )
+        tgt = tgt + self.dropout1(tgt2)
+
+        tgt2 = self._decoder_attention_step(self.norm2(tgt), memory_key, memory_value)
+        tgt = tgt + self.dropout2(tgt2)
+
+        tgt2 = self.norm3(tgt)
+        tgt2 = self.linear2(self.dropout(self.activation(self.linear1(tgt2))))
+        tgt = tgt + self.dropout3(tgt2)
+        return tgt, key, value
+
+
+def _in_projection(
+    attention: nn.MultiheadAttention, inputs: torch.Tensor, index: int
+) -> torch.Tensor:
+    r"""
+    Project inputs to queries (``index = 0``), keys (``1``) or values (``2``)
+    with input projection weights of a :class:`~torch.nn.MultiheadAttention`.
+    """
+    embed_dim = attention.embed_dim
+    weight = attention.in_proj_weight[index * embed_dim : (index + 1) * embed_dim]
+    bias = attention.in_proj_bias
+    if bias is not None:
+        bias = bias[index * embed_dim : (index + 1) * embed_dim]
+    return F.linear(inputs, weight, bias)
+
+
+def _attention(
+    attention: nn.MultiheadAttention,
+    query: torch.Tensor,
+    key: torch.Tensor,
+    value: torch.Tensor,
+) -> torch.Tensor:
+    r"""
+    Scaled dot-product attention with already projected queries, keys and
+    values (batch at dim 0), followed by output projection of a
+    :class:`~torch.nn.MultiheadAttention`. Same as its ``forward`` without any
+    masks.
+    """
+    batch_size, num_queries, embed_dim = query.size()
+    num_heads = attention.num_heads
+    head_dim = embed_dim // num_heads
+
+    # shape: (batch_size, num_heads, length, head_dim)
+    def _split_heads(tensor: torch.Tensor) -> torch.Tensor:
+        return tensor.view(batch_size, -1, num_heads, head_dim).transpose(1, 2)
+
+    query = _split_heads(query) * float(head_dim) ** -0.5
+    key, value = _split_heads(key), _split_heads(value)
+
+    # shape: (batch_size, num_heads, num_queries, num_keys)
+    weights = F.softmax(torch.matmul(query, key.transpose(2, 3)), dim=-1)
+    weights = F.dropout(weights, p=attention.dropout, training=attention.training)
+
+    # shape: (batch_size, num_queries, embed_dim)
+    output = torch.matmul(weights, value).transpose(1, 2)
+    output = output.reshape(batch_size, num_queries, embed_dim)
+    return attention.out_proj(output)
@@ -4,7 +4,7 @@ This Beam Search implementation is adapted with minor modifications from
 
 Thanks to the developers of AllenNLP!
 """
-from typing import Callable, Dict, List, Tuple
+from typing import Any, Callable, Dict, Optional, Tuple
 import warnings
 
 import torch
@@ -35,6 +35,11 @@ class AutoRegressiveBeamSearch(object):
         may give better results, as it can introduce more diversity into the
         search. See `Beam Search Strategies for Neural Machine Translation.
         Freitag and Al-Onaizan, 2017 <https://arxiv.org/abs/1702.01806>`_.
+    length_penalty: float, optional (default = 0.0)
+        Exponent of caption lengths (including the end token), to normalize
+        log probs of final beams before ranking them. Default value ranks beams
+        by their total log probs (favoring short captions), while ``1.0`` ranks
+        them by average log prob per token.
     """
 
     def __init__(
@@ -43,14 +48,20 @@ class AutoRegressiveBeamSearch(object):
         max_steps: int = 50,
         beam_size: int = 5,
         per_node_beam_size: int = 2,
+        length_penalty: float = 0.0,
     ) -> None:
         self._end_index = end_index
         self.max_steps = max_steps
         self.beam_size = beam_size
         self.per_node_beam_size = per_node_beam_size or beam_size
+        self.length_penalty = length_penalty
 
     def search(
-        self, start_predictions: torch.Tensor, step: StepFunctionType
+        self,
+        start_predictions: torch.Tensor,
+        step: StepFunctionType,
+        start_state: Optional[StateType] = None,
+        context: Optional[Any] = None,
     ) -> Tuple[torch.Tensor, torch.Tensor]:
         r"""
         Given a starting state and a step function, apply beam search to find
@@ -82,24 +93,34 @@ class AutoRegressiveBeamSearch(object):
             ``(group_size, target_vocab_size)`` containing
             the log probs of the tokens for the next step.
 
+            If ``start_state`` is provided, the step function is *incremental*:
+            it is called as ``step(last_predictions, state)`` with predictions
+            of the last time-step only (shape ``(group_size, )``), and is
+            expected to return a tuple of log probs and updated state.
+        start_state : Dict[str, torch.Tensor], optional (default = None)
+            Initial state for an incremental step function, like cached keys
+            and values of a transformer (can be an empty dict). All tensors in
+            state must have ``group_size`` at dim 0. These are expanded for
+            every beam and reordered along with beams, after every time-step.
+        context : Any, optional (default = None)
+            Inputs of the step function which are same for all beams of an
+            example (like visual features), with an ``index_select(indices)``
+            method to select examples. If provided, it is passed as the first
+            argument to step function. Examples are dropped from the context
+            (and state) as soon as all their beams predict the end token, so
+            step function only runs for examples which are not finished.
+
         Returns
         -------
         Tuple[torch.Tensor, torch.Tensor]
             Tuple of ``(predictions, log_probs)``, where ``predictions``
             has shape ``(batch_size, beam_size, max_steps)`` and ``log_probs``
-            has shape ``(batch_size, beam_size)``.
+            has shape ``(batch_size, beam_size)``. Beams are sorted by log
+            probs, which are normalized by caption lengths as per
+            ``length_penalty``.
         """
         batch_size = start_predictions.size()[0]
 
-        # List of `(batch_size, beam_size)` tensors. One for each time step.
-        # Does not include the start symbols, which are implicit.
-        predictions: List[torch.Tensor] = []
-
-        # List of (batch_size, beam_size) tensors. One for each time step. None
-        # for the first.  Stores the index n for the parent prediction, i.e.
-        # predictions[t-1][i][n], that it came from.
-        backpointers: List[torch.Tensor] = []
-
         # Calculate the first timestep. This is done outside the main loop
         # because we are going from a single decoder input (the output from the
         # encoder) to the top `beam_size` decoder outputs. On the other hand,
@@ -107,8 +128,9 @@ class AutoRegressiveBeamSearch(object):
         # beam to `beam_size`^2 candidates from which we will select the top
         # `beam_size` elements for the next iteration.
         # shape: (batch_size, num_classes)
-        start_class_log_probs = step(start_predictions)
-
+        start_class_log_probs, state = _call_step(
+            step, context, start_predictions, start_state
+        )
         num_classes = start_class_log_probs.size()[1]
 
         # Make sure `per_node_beam_size` is not larger than `num_classes`.
@@ -134,12 +156,25 @@ class AutoRegressiveBeamSearch(object):
             )
             return start_predicted_classes.unsqueeze(-1), start_top_log_probs
 
-        # The log probs for the last time step.
+        # The log probs for the last time step, of all examples. These are not
+        # updated after an example is finished.
         # shape: (batch_size, beam_size)
         last_log_probs = start_top_log_probs
 
-        # shape: [(batch_size, beam_size)]
-        predictions.append(start_predicted_classes)
+        # Tokens predicted by every beam at every time-step, and the index of
+        # its parent beam at the previous time-step (backpointers). These are
+        # preallocated and written in place. Finished examples keep the end
+        # token and same beam order for all remaining time-steps.
+        # shape (both): (batch_size, beam_size, max_steps)
+        predictions = start_predicted_classes.new_full(
+            (batch_size, self.beam_size, self.max_steps), self._end_index
+        )
+        predictions[:, :, 0] = start_predicted_classes
+        backpointers = (
+            torch.arange(self.beam_size, device=predictions.device)
+            .view(1, self.beam_size, 1)
+            .repeat(batch_size, 1, self.max_steps)
+        )
 
         # Log probability tensor that mandates that the end token is selected.
         # shape: (batch_size * beam_size, num_classes)
@@ -148,85 +183,140 @@ class AutoRegressiveBeamSearch(object):
         )
         log_probs_after_end[:, self._end_index] = 0.0
 
-        for timestep in range(self.max_steps - 1):
-            # shape: (batch_size * beam_size,)
-            last_predictions = predictions[-1].reshape(batch_size * self.beam_size)
-
-            # If every predicted token from the last step is `self._end_index`,
-            # then we can stop early.
-            if (last_predictions == self._end_index).all():
+        if state is None:
+            # Tokens predicted so far for every beam (in order of ancestors),
+            # these are needed by a step function which is not incremental.
+            # shape: (batch_size * beam_size, max_steps)
+            predictions_so_far = predictions.view(-1, self.max_steps).clone()
+        else:
+            # Set the same state for each element in the beam.
+            state = {
+                key: _expand_for_beams(state_tensor, self.beam_size)
+                for key, state_tensor in state.items()
+            }
+
+        # Indices of examples which are not finished yet (the active batch).
+        active = torch.arange(batch_size, device=predictions.device)
+
+        num_steps = 1
+        for timestep in range(1, self.max_steps):
+            # shape: (num_active, beam_size)
+            last_predictions = predictions[active, :, timestep - 1]
+
+            # An example is finished when all its beams have predicted the end
+            # token. We can stop early when all examples are finished.
+            finished = (last_predictions == self._end_index).all(dim=1)
+            if finished.all():
                 break
 
+            # Drop finished examples from the active batch, only possible when
+            # inputs of the step function (context) are known.
+            if context is not None and finished.any():
+                keep = (~finished).nonzero().squeeze(1)
+                active = active[keep]
+                last_predictions = last_predictions[keep]
+                context = context.index_select(keep)
+                if state is None:
+                    predictions_so_far = _select_examples(
+                        predictions_so_far, keep, self.beam_size
+                    )
+                else:
+                    state = {
+                        key: _select_examples(state_tensor, keep, self.beam_size)
+                        for key, state_tensor in state.items()
+                    }
+
+            num_active = active.size(0)
+            group_size = num_active * self.beam_size
+
+            # shape: (group_size, )
+            last_predictions = last_predictions.reshape(group_size)
+
             # Take a step. This get the predicted log probs of the next classes.
-            predictions_so_far = torch.stack(predictions).permute(1, 2, 0).view(
-                batch_size * self.beam_size, -1
+            # Incremental step function needs predictions of last time-step.
+            # shape: (group_size, num_classes)
+            step_predictions = (
+                last_predictions if state is not None
+                else predictions_so_far[:, :timestep]
+            )
+            class_log_probs, state = _call_step(
+                step, context, step_predictions, state
             )
-            # shape: (batch_size * beam_size, num_classes)
-            class_log_probs = step(predictions_so_far)
 
-            # shape: (batch_size * beam_size, num_classes)
+            # shape: (group_size, num_classes)
             last_predictions_expanded = last_predictions.unsqueeze(-1).expand(
-                batch_size * self.beam_size, num_classes
+                group_size, num_classes
             )
             # Here we are finding any beams where we predicted the end token in
             # the previous timestep and replacing the distribution with a
             # one-hot distribution, forcing the beam to predict the end token
             # this timestep as well.
-            # shape: (batch_size * beam_size, num_classes)
+            # shape: (group_size, num_classes)
             cleaned_log_probs = torch.where(
                 last_predictions_expanded == self._end_index,
-                log_probs_after_end,
+                log_probs_after_end[:group_size],
                 class_log_probs,
             )
-            # shape (both): (batch_size * beam_size, per_node_beam_size)
+            # shape (both): (group_size, per_node_beam_size)
             top_log_probs, predicted_classes = cleaned_log_probs.topk(
                 self.per_node_beam_size
             )
-            # Here we expand the last log probs to `(batch_size * beam_size,
+            # Here we expand the last log probs to `(group_size,
             # per_node_beam_size)` so that we can add them to the current log
             # probs for this timestep. This lets us maintain the log
             # probability of each element on the beam.
-            # shape: (batch_size * beam_size, per_node_beam_size)
+            # shape: (group_size, per_node_beam_size)
             expanded_last_log_probs = (
-                last_log_probs.unsqueeze(2)
-                .expand(batch_size, self.beam_size, self.per_node_beam_size)
-                .reshape(batch_size * self.beam_size, self.per_node_beam_size)
+                last_log_probs[active]
+                .unsqueeze(2)
+                .expand(num_active, self.beam_size, self.per_node_beam_size)
+                .reshape(group_size, self.per_node_beam_size)
             )
-            # shape: (batch_size * beam_size, per_node_beam_size)
+            # shape: (group_size, per_node_beam_size)
             summed_top_log_probs = top_log_probs + expanded_last_log_probs
 
-            # shape: (batch_size, beam_size * per_node_beam_size)
+            # shape: (num_active, beam_size * per_node_beam_size)
             reshaped_summed = summed_top_log_probs.reshape(
-                batch_size, self.beam_size * self.per_node_beam_size
+                num_active, self.beam_size * self.per_node_beam_size
             )
-            # shape: (batch_size, beam_size * per_node_beam_size)
+            # shape: (num_active, beam_size * per_node_beam_size)
             reshaped_predicted_classes = predicted_classes.reshape(
-                batch_size, self.beam_size * self.per_node_beam_size
+                num_active, self.beam_size * self.per_node_beam_size
             )
             # Keep only the top `beam_size` beam indices.
-            # shape: (batch_size, beam_size), (batch_size, beam_size)
+            # shape: (num_active, beam_size), (num_active, beam_size)
             restricted_beam_log_probs, restricted_beam_indices = reshaped_summed.topk(
                 self.beam_size
             )
             # Use the beam indices to extract the corresponding classes.
-            # shape: (batch_size, beam_size)
+            # shape: (num_active, beam_size)
             restricted_predicted_classes = reshaped_predicted_classes.gather(
                 1, restricted_beam_indices
             )
-            predictions.append(restricted_predicted_classes)
-
-            # shape: (batch_size, beam_size)
-            last_log_probs = restricted_beam_log_probs
-
             # The beam indices come from a `beam_size * per_node_beam_size`
             # dimension where the indices with a common ancestor are grouped
             # together. Hence dividing by `per_node_beam_size` gives the
-            # ancestor. (Note that this is integer division as the tensor is a
-            # LongTensor.)
-            # shape: (batch_size, beam_size)
-            backpointer = restricted_beam_indices / self.per_node_beam_size
-
-            backpointers.append(backpointer)
+            # ancestor.
+            # shape: (num_active, beam_size)
+            backpointer = restricted_beam_indices // self.per_node_beam_size
+
+            predictions[active, :, timestep] = restricted_predicted_classes
+            backpointers[active, :, timestep] = backpointer
+            last_log_probs[active] = restricted_beam_log_probs
+            num_steps = timestep + 1
+
+            # Keep only the pieces of the state tensors (or predictions so far)
+            # corresponding to the ancestors created this iteration.
+            if state is None:
+                predictions_so_far[:, :timestep] = _reorder_for_beams(
+                    predictions_so_far[:, :timestep], backpointer
+                )
+                predictions_so_far[:, timestep] = restricted_predicted_classes.view(-1)
+            else:
+                state = {
+                    key: _reorder_for_beams(state_tensor, backpointer)
+                    for key, state_tensor in state.items()
+                }
 
         if not torch.isfinite(last_log_probs).all():
             warnings.warn(
@@ -237,29 +327,104 @@ class AutoRegressiveBeamSearch(object):
                 RuntimeWarning,
             )
 
-        # Reconstruct the captions.
-        # shape: [(batch_size, beam_size, 1)]
-        reconstructed_predictions = [predictions[-1].unsqueeze(2)]
+        # Reconstruct the captions in place, following backpointers from the
+        # beams of last time-step to their ancestors.
+        # shape: (batch_size, beam_size, num_steps)
+        predictions = predictions[:, :, :num_steps]
 
         # shape: (batch_size, beam_size)
-        cur_backpointers = backpointers[-1]
+        cur_backpointers = backpointers[:, :, 0]
 
-        for timestep in range(len(predictions) - 2, 0, -1):
-            # shape: (batch_size, beam_size, 1)
-            cur_preds = (
-                predictions[timestep].gather(1, cur_backpointers).unsqueeze(2)
+        for timestep in range(num_steps - 1, -1, -1):
+            predictions[:, :, timestep] = predictions[:, :, timestep].gather(
+                1, cur_backpointers
             )
-            reconstructed_predictions.append(cur_preds)
+            cur_backpointers = backpointers[:, :, timestep].gather(1, cur_backpointers)
 
+        if self.length_penalty != 0:
+            # Lengths of captions up to (and including) the first end token.
             # shape: (batch_size, beam_size)
-            cur_backpointers = backpointers[timestep - 1].gather(1, cur_backpointers)
+            is_end = (predictions == self._end_index).long()
+            lengths = (is_end.cumsum(dim=2) == 0).sum(dim=2) + 1
+            lengths = lengths.clamp(max=num_steps).to(last_log_probs)
+
+            # Rank beams again by normalized log probs.
+            last_log_probs = last_log_probs / lengths ** self.length_penalty
+            last_log_probs, beam_order = last_log_probs.sort(dim=1, descending=True)
+            predictions = predictions.gather(
+                1, beam_order.unsqueeze(2).expand_as(predictions)
+            )
+
+        return predictions, last_log_probs
+
+
+def _call_step(
+    step: StepFunctionType,
+    context: Optional[Any],
+    predictions: torch.Tensor,
+    state: Optional[StateType],
+) -> Tuple[torch.Tensor, Optional[StateType]]:
+    r"""
+    Call a step function with (optional) context and state as expected by it,
+    and return log probs with updated state (``None`` if step function is not
+    incremental).
+    """
+    args = (predictions,) if state is None else (predictions, state)
+    if context is not None:
+        args = (context,) + args
+
+    if state is None:
+        return step(*args), None
+    return step(*args)
 
-        # shape: (batch_size, beam_size, 1)
-        final_preds = predictions[0].gather(1, cur_backpointers).unsqueeze(2)
 
-        reconstructed_predictions.append(final_preds)
+def _select_examples(
+    state_tensor: torch.Tensor, indices: torch.Tensor, beam_size: int
+) -> torch.Tensor:
+    r"""
+    Select rows of all beams of some examples from a state tensor, as per a
+    tensor of example indices.
+    ``(batch_size * beam_size, *) -> (len(indices) * beam_size, *)``
+    """
+    group_size, *last_dims = state_tensor.size()
+    return (
+        state_tensor.reshape(group_size // beam_size, beam_size, *last_dims)
+        .index_select(0, indices)
+        .reshape(indices.size(0) * beam_size, *last_dims)
+    )
+
+
+def _expand_for_beams(state_tensor: torch.Tensor, beam_size: int) -> torch.Tensor:
+    r"""
+    Repeat every row of a state tensor for every beam.
+    ``(batch_size, *) -> (batch_size * beam_size, *)``
+    """
+    batch_size, *last_dims = state_tensor.size()
+    return (
+        state_tensor.unsqueeze(1)
+        .expand(batch_size, beam_size, *last_dims)
+        .reshape(batch_size * beam_size, *last_dims)
+    )
 
-        # shape: (batch_size, beam_size, max_steps)
-        all_predictions = torch.cat(list(reversed(reconstructed_predictions)), 2)
 
-        return all_predictions, last_log_probs
+def _reorder_for_beams(
+    state_tensor: torch.Tensor, backpointer: torch.Tensor
+) -> torch.Tensor:
+    r"""
+    Select rows of a state tensor of ancestors of beams, as per backpointers
+    of shape ``(batch_size, beam_size)``.
+    """
+    batch_size, beam_size = backpointer.size()
+    _, *last_dims = state_tensor.size()
+
+    # shape: (batch_size, beam_size, *)
+    expanded_backpointer = backpointer.view(
+        batch_size, beam_size, *([1] * len(last_dims))
+    ).expand(batch_size, beam_size, *last_dims)
+
+    # shape: (batch_size * beam_size, *)
+    return (
+        state_tensor.reshape(batch_size, beam_size, *last_dims)
+        .gather(1, expanded_backpointer)
+        .reshape(batch_size * beam_size, *last_dims)
+    )
@@ -1,7 +1,12 @@
 import argparse
+from collections import deque
 import os
+import queue
 import random
 import sys
+import threading
+import time
+from typing import Deque, Dict, Iterator, Optional, Tuple, Union
 
 from loguru import logger
 import numpy as np
@@ -11,30 +16,236 @@ from virtex.config import Config
 import virtex.utils.distributed as dist
 
 
-def cycle(dataloader, device, start_iteration: int = 0):
+def _epochs(dataloader, start_iteration: int = 0, start_batch: int = 0):
     r"""
-    A generator to yield batches of data from dataloader infinitely.
+    A generator to yield batches of data (on host) from dataloader infinitely,
+    setting the ``epoch`` for shuffling at the start of every epoch. Every
+    batch is yielded along with this ``epoch`` (shuffle seed) of its epoch.
 
-    Internally, it sets the ``epoch`` for dataloader sampler to shuffle the
-    examples. One may optionally provide the starting iteration to make sure
-    the shuffling seed is different and continues naturally.
+    If ``start_batch`` is more than zero, first epoch is resumed: it uses
+    ``start_iteration`` as its seed, and skips these many batches.
+
+    Streaming datasets (with their own ``set_epoch``) get ``start_iteration``
+    plus the number of finished epochs as seed instead, which is same on all
+    processes, see :class:`~virtex.data.readers.TarShardReader`.
     """
     iteration = start_iteration
+    num_epochs = 0
 
     while True:
         # Set the `epoch` of sampler as current iteration. This is just for
         # determinisitic shuffling after every epoch, so it is just a seed and
         # need not necessarily be the "epoch".
-        logger.info(f"Beginning new epoch, setting shuffle seed {iteration}")
-        dataloader.sampler.set_epoch(iteration)
+        epoch = iteration
+        logger.info(f"Beginning new epoch, setting shuffle seed {epoch}")
+        if hasattr(dataloader.sampler, "set_epoch"):
+            dataloader.sampler.set_epoch(epoch)
+        if hasattr(dataloader.batch_sampler, "set_epoch"):
+            dataloader.batch_sampler.set_epoch(epoch)
+
+        # Streaming datasets shuffle by themselves, and have no such sampler.
+        # Processes may finish their epochs at different iterations (unlike
+        # samplers, streams do not have same length on all processes), so
+        # count epochs -- all processes start from same iteration.
+        if hasattr(dataloader.dataset, "set_epoch"):
+            dataloader.dataset.set_epoch(start_iteration + num_epochs)
+        num_epochs += 1
+
+        # Skip batches consumed before resuming, only in first epoch. Samplers
+        # from `virtex.data.samplers` skip them without reading any data.
+        if start_batch > 0:
+            if hasattr(dataloader.batch_sampler, "set_start_index"):
+                dataloader.batch_sampler.set_start_index(start_batch)
+            elif hasattr(dataloader.sampler, "set_start_index"):
+                dataloader.sampler.set_start_index(
+                    start_batch * dataloader.batch_size
+                )
+            else:
+                logger.warning(
+                    "Sampler cannot resume from middle of epoch, batches "
+                    "consumed before resuming will be repeated."
+                )
+                start_batch = 0
+
+            logger.info(f"Resuming epoch, skipping {start_batch} batches")
+            iteration += start_batch
+            start_batch = 0
 
         for batch in dataloader:
-            for key in batch:
-                batch[key] = batch[key].to(device)
-            yield batch
+            yield epoch, batch
             iteration += 1
 
 
+def _epoch_position(dataloader, iteration: int) -> Tuple[int, int]:
+    r"""
+    Return position in epoch at an iteration: ``epoch`` (shuffle seed) of the
+    epoch and number of its batches consumed before this iteration. Every
+    epoch starts at an iteration which is a multiple of its length (and uses
+    it as seed), assuming training started at iteration 0. Streaming datasets
+    have no length, their epoch starts afresh at this iteration.
+    """
+    try:
+        epoch_length = len(dataloader)
+    except TypeError:
+        return iteration, 0
+
+    num_batches = iteration % epoch_length if epoch_length > 0 else 0
+    return iteration - num_batches, num_batches
+
+
+def cycle(dataloader, device, start_iteration: int = 0):
+    r"""
+    A generator to yield batches of data from dataloader infinitely.
+
+    Internally, it sets the ``epoch`` for dataloader sampler to shuffle the
+    examples. One may optionally provide the starting iteration to make sure
+    the shuffling seed is different and continues naturally.
+    """
+    for _, batch in _epochs(dataloader, start_iteration):
+        for key in batch:
+            batch[key] = batch[key].to(device, non_blocking=True)
+        yield batch
+
+
+class DataPrefetcher(object):
+    r"""
+    An iterator to yield batches of data from dataloader infinitely (exactly
+    like :func:`cycle`), which prepares the next batch while current batch is
+    being used by the training loop.
+
+    On GPU, next batch is transferred to device on a separate CUDA stream, so
+    this copy overlaps with compute of the current iteration. On CPU, next
+    batch is fetched from dataloader in a background thread.
+
+    Time spent by training loop waiting for data is recorded for every batch,
+    and reported by :attr:`wait_time` (average over last few batches).
+
+    This iterator records its position in current epoch (as the number of
+    batches yielded so far), which can be saved in checkpoints through
+    :meth:`state_dict`. After :meth:`load_state_dict`, it resumes the epoch
+    from this position, without repeating batches consumed before -- if the
+    dataloader uses a sampler from :mod:`virtex.data.samplers`.
+
+    Parameters
+    ----------
+    dataloader: torch.utils.data.DataLoader
+        A dataloader to read batches from, in host memory (preferably pinned).
+    device: torch.device
+        Device to move batches to.
+    start_iteration: int, optional (default = 0)
+        Iteration to start (or resume) from. Position in epoch at this
+        iteration is derived from length of the dataloader, assuming training
+        started from iteration 0 with same dataloader. This is overridden if
+        position is loaded by :meth:`load_state_dict`.
+    num_prefetch: int, optional (default = 2)
+        Number of batches to prefetch in background thread (on CPU).
+    window_size: int, optional (default = 20)
+        Number of past batches to average data wait time over.
+    """
+
+    def __init__(
+        self,
+        dataloader,
+        device: Union[torch.device, int, str],
+        start_iteration: int = 0,
+        num_prefetch: int = 2,
+        window_size: int = 20,
+    ):
+        self.dataloader = dataloader
+        self.device = torch.device(device)
+        self.num_prefetch = num_prefetch
+        self._wait_times: Deque[float] = deque([0.0], maxlen=window_size)
+
+        # Shuffle seed of current epoch, and number of its batches yielded.
+        self._epoch, self._num_batches = _epoch_position(dataloader, start_iteration)
+
+        # Batches are read from dataloader after first call to `__next__`, so
+        # position can be loaded from a checkpoint before that.
+        self._batches: Optional[Iterator] = None
+
+    @property
+    def wait_time(self) -> float:
+        r"""Average time (in seconds) spent waiting for a batch."""
+        return sum(self._wait_times) / len(self._wait_times)
+
+    def state_dict(self) -> Dict[str, int]:
+        r"""Return position in current epoch, to save in a checkpoint."""
+        return {"epoch": self._epoch, "num_batches": self._num_batches}
+
+    def load_state_dict(self, state_dict: Dict[str, int]):
+        r"""Load position in epoch to resume from, before reading any batch."""
+        if self._batches is not None:
+            raise RuntimeError("Cannot load state after reading batches.")
+
+        self._epoch = state_dict["epoch"]
+        self._num_batches = state_dict["num_batches"]
+
+    def _start(self):
+        r"""Start reading batches, from saved position if resuming."""
+        self._batches = _epochs(self.dataloader, self._epoch, self._num_batches)
+
+        if self.device.type == "cuda":
+            self._stream = torch.cuda.Stream(self.device)
+            self._next_batch = self._transfer(next(self._batches))
+        else:
+            # Start a thread to put batches in a queue, it stops with the main
+            # process (daemon) as this iterator never ends by itself.
+            self._queue: queue.Queue = queue.Queue(maxsize=self.num_prefetch)
+            self._thread = threading.Thread(target=self._produce, daemon=True)
+            self._thread.start()
+
+    def _transfer(self, epoch_batch):
+        r"""Transfer a batch to device asynchronously on the side stream."""
+        epoch, batch = epoch_batch
+        with torch.cuda.stream(self._stream):
+            for key in batch:
+                batch[key] = batch[key].to(self.device, non_blocking=True)
+        return epoch, batch
+
+    def _produce(self):
+        r"""Fetch batches in background thread and put them in queue."""
+        try:
+            for epoch, batch in self._batches:
+                for key in batch:
+                    batch[key] = batch[key].to(self.device)
+                self._queue.put((epoch, batch))
+        except Exception as exception:
+            # Re-raise this exception in main thread (in `__next__`).
+            self._queue.put(exception)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start_time = time.time()
+        if self._batches is None:
+            self._start()
+
+        if self.device.type == "cuda":
+            # Make the compute stream wait for transfer of this batch, and mark
+            # these tensors as used by compute stream (so their memory is not
+            # reused by side stream too early). Then prefetch next batch.
+            torch.cuda.current_stream().wait_stream(self._stream)
+            epoch, batch = self._next_batch
+            for key in batch:
+                batch[key].record_stream(torch.cuda.current_stream())
+
+            self._next_batch = self._transfer(next(self._batches))
+        else:
+            epoch_batch = self._queue.get()
+            if isinstance(epoch_batch, Exception):
+                raise epoch_batch
+            epoch, batch = epoch_batch
+
+        # Update position, count batches from zero in a new epoch.
+        if epoch != self._epoch:
+            self._epoch, self._num_batches = epoch, 0
+        self._num_batches += 1
+
+        self._wait_times.append(time.time() - start_time)
+        return batch
+
+
 def common_setup(_C: Config, _A: argparse.Namespace, job_type: str = "pretrain"):
     r"""
     Setup common stuff at the start of every pretraining or downstream
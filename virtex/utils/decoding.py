@@ -0,0 +1,272 @@
+from typing import Any, Optional, Tuple, Union
+
+import torch
+from torch.nn import functional as F
+
+from virtex.utils.beam_search import (
+    AutoRegressiveBeamSearch,
+    StateType,
+    StepFunctionType,
+    _call_step,
+    _select_examples,
+)
+
+
+class RepetitionPenalty(object):
+    r"""
+    Penalize tokens which would repeat parts of partial captions, by setting
+    their log probabilities to a large negative value. Blocked tokens of all
+    partial captions are penalized with a single batched scatter (no loop over
+    partial captions).
+
+    Parameters
+    ----------
+    block_last_token: bool, optional (default = True)
+        Whether to block the last token of every partial caption, so a token
+        is never predicted twice in a row.
+    no_repeat_ngram_size: int, optional (default = 0)
+        Block tokens which would complete an n-gram of this size that already
+        occurs in the partial caption (``1`` blocks every token seen so far).
+        Set to ``0`` to disable n-gram blocking.
+    penalty: float, optional (default = -1000000)
+        Log probability of blocked tokens.
+    """
+
+    def __init__(
+        self,
+        block_last_token: bool = True,
+        no_repeat_ngram_size: int = 0,
+        penalty: float = -1000000,
+    ):
+        self.block_last_token = block_last_token
+        self.no_repeat_ngram_size = no_repeat_ngram_size
+        self.penalty = penalty
+
+    def __call__(
+        self, logprobs: torch.Tensor, partial_captions: torch.Tensor
+    ) -> torch.Tensor:
+        r"""
+        Penalize log probabilities of blocked tokens (in-place).
+
+        Parameters
+        ----------
+        logprobs: torch.Tensor
+            Log probabilities over vocabulary for the next token of every
+            partial caption, a tensor of shape ``(group_size, vocab_size)``.
+        partial_captions: torch.Tensor
+            Tokens of partial captions predicted so far, a tensor of shape
+            ``(group_size, timesteps)`` with the last predicted token at the
+            end. Must have at least one token.
+
+        Returns
+        -------
+        torch.Tensor
+            Penalized ``logprobs``.
+        """
+        # Candidate tokens to block (last token and last tokens of n-grams),
+        # and whether to block them.
+        # shape: (group_size, num_candidates)
+        tokens = partial_captions[:, -1:]
+        blocked = torch.ones_like(tokens, dtype=torch.bool)
+        if not self.block_last_token:
+            tokens, blocked = tokens[:, :0], blocked[:, :0]
+
+        ngram_size = self.no_repeat_ngram_size
+        timesteps = partial_captions.size(1)
+        if ngram_size > 0 and timesteps >= ngram_size:
+            # All n-grams of partial captions.
+            # shape: (group_size, timesteps - ngram_size + 1, ngram_size)
+            ngrams = partial_captions.unfold(1, ngram_size, 1)
+
+            # Block last tokens of n-grams which start with the last
+            # (ngram_size - 1) tokens -- next token would repeat these n-grams.
+            prefix = partial_captions[:, timesteps - ngram_size + 1 :]
+            matches = (ngrams[:, :, :-1] == prefix.unsqueeze(1)).all(dim=2)
+
+            tokens = torch.cat([tokens, ngrams[:, :, -1]], dim=1)
+            blocked = torch.cat([blocked, matches], dim=1)
+
+        # A token may be a candidate many times, block it if any of them is
+        # blocked, so all values scattered to the same token are equal.
+        blocked = (
+            (tokens.unsqueeze(2) == tokens.unsqueeze(1)) & blocked.unsqueeze(1)
+        ).any(dim=2)
+
+        values = logprobs.gather(1, tokens).masked_fill_(blocked, self.penalty)
+        return logprobs.scatter_(1, tokens, values)
+
+
+class AutoRegressiveGreedySearch(object):
+    r"""
+    Decode captions by picking the most likely token at every time-step, for
+    a batch of images together. This is cheaper than beam search, and works
+    with the same step functions as
+    :class:`~virtex.utils.beam_search.AutoRegressiveBeamSearch` (both
+    incremental and not), its :meth:`search` has the same arguments and
+    return values (with a single beam).
+
+    Parameters
+    ----------
+    end_index: int
+        The index of the end token (``[EOS]``) in vocabulary.
+    max_steps: int, optional (default = 50)
+        The maximum number of decoding steps.
+    """
+
+    def __init__(self, end_index: int, max_steps: int = 50):
+        self._end_index = end_index
+        self.max_steps = max_steps
+
+    def search(
+        self,
+        start_predictions: torch.Tensor,
+        step: StepFunctionType,
+        start_state: Optional[StateType] = None,
+        context: Optional[Any] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        r"""
+        Decode a caption for every example, one token at a time, until all
+        captions end or for ``max_steps`` time-steps. Refer
+        :meth:`~virtex.utils.beam_search.AutoRegressiveBeamSearch.search` for
+        details on the arguments. As there, examples are dropped from
+        ``context`` (and state) as soon as their captions end, if provided.
+
+        Returns
+        -------
+        Tuple[torch.Tensor, torch.Tensor]
+            Tuple of ``(predictions, log_probs)``, where ``predictions``
+            has shape ``(batch_size, 1, max_steps)`` and ``log_probs``
+            has shape ``(batch_size, 1)``.
+        """
+        batch_size = start_predictions.size(0)
+
+        # Tokens predicted for every example, preallocated and written in
+        # place. Finished captions keep the end token for remaining time-steps.
+        # shape: (batch_size, max_steps)
+        predictions = start_predictions.new_full(
+            (batch_size, self.max_steps), self._end_index
+        )
+        # Indices of examples in the active batch, and whether their captions
+        # are finished (these stay in the batch if context is not provided).
+        active = torch.arange(batch_size, device=predictions.device)
+        finished = torch.zeros_like(active, dtype=torch.bool)
+
+        log_probs = None
+        state = start_state
+        num_steps = 0
+        for timestep in range(self.max_steps):
+            # Start token at first time-step, then tokens of last time-step for
+            # an incremental step function, else all predictions so far.
+            if timestep == 0:
+                step_predictions = start_predictions
+            elif state is not None:
+                step_predictions = predictions[active, timestep - 1]
+            else:
+                step_predictions = predictions[active, :timestep]
+
+            # shape: (num_active, num_classes)
+            class_log_probs, state = _call_step(
+                step, context, step_predictions, state
+            )
+            if log_probs is None:
+                log_probs = class_log_probs.new_zeros((batch_size,))
+
+            # shape (both): (num_active, )
+            tokens = self._select_tokens(class_log_probs)
+            token_log_probs = class_log_probs.gather(1, tokens.unsqueeze(1))
+
+            # Finished captions keep predicting the end token.
+            tokens = tokens.masked_fill(finished, self._end_index)
+            token_log_probs = token_log_probs.squeeze(1).masked_fill(finished, 0.0)
+
+            predictions[active, timestep] = tokens
+            log_probs[active] += token_log_probs
+            num_steps = timestep + 1
+
+            # We can stop early when all captions are finished.
+            finished = finished | (tokens == self._end_index)
+            if finished.all():
+                break
+
+            # Drop finished examples from the active batch, only possible when
+            # inputs of the step function (context) are known.
+            if context is not None and finished.any():
+                keep = (~finished).nonzero().squeeze(1)
+                active, finished = active[keep], finished[keep]
+                context = context.index_select(keep)
+                if state is not None:
+                    state = {
+                        key: _select_examples(state_tensor, keep, 1)
+                        for key, state_tensor in state.items()
+                    }
+
+        return predictions[:, None, :num_steps], log_probs.unsqueeze(1)
+
+    def _select_tokens(self, class_log_probs: torch.Tensor) -> torch.Tensor:
+        r"""
+        Select next tokens, given log probs of shape ``(group_size,
+        num_classes)``. Greedy search picks the most likely tokens.
+        """
+        return class_log_probs.argmax(dim=1)
+
+
+class AutoRegressiveSampling(AutoRegressiveGreedySearch):
+    r"""
+    Decode captions by sampling tokens from the predicted distribution at
+    every time-step, restricted to the ``top_k`` most likely tokens (top-k
+    sampling), and/or to the smallest set of most likely tokens with total
+    probability of at least ``top_p`` (nucleus sampling,
+    `Holtzman et al. 2020 <https://arxiv.org/abs/1904.09751>`_). Decoding
+    works same as :class:`AutoRegressiveGreedySearch` otherwise.
+
+    Parameters
+    ----------
+    end_index: int
+        The index of the end token (``[EOS]``) in vocabulary.
+    max_steps: int, optional (default = 50)
+        The maximum number of decoding steps.
+    top_k: int, optional (default = 0)
+        Sample from these many most likely tokens. Zero for all tokens.
+    top_p: float, optional (default = 1.0)
+        Sample from most likely tokens with at least this total probability.
+        One for all tokens.
+    """
+
+    def __init__(
+        self,
+        end_index: int,
+        max_steps: int = 50,
+        top_k: int = 0,
+        top_p: float = 1.0,
+    ):
+        super().__init__(end_index, max_steps=max_steps)
+        self.top_k = top_k
+        self.top_p = top_p
+
+    def _select_tokens(self, class_log_probs: torch.Tensor) -> torch.Tensor:
+        if self.top_k > 0:
+            # Log prob of k-th most likely token, for every partial caption.
+            # shape: (group_size, 1)
+            kth_log_probs = class_log_probs.topk(self.top_k)[0][:, -1:]
+            class_log_probs = class_log_probs.masked_fill(
+                class_log_probs < kth_log_probs, float("-inf")
+            )
+
+        if self.top_p < 1.0:
+            # Remove tokens after the total probability of more likely tokens
+            # reaches `top_p` (the most likely token is never removed).
+            sorted_log_probs, sorted_indices = class_log_probs.sort(
+                dim=1, descending=True
+            )
+            sorted_probs = F.softmax(sorted_log_probs, dim=1)
+            removed = sorted_probs.cumsum(dim=1) - sorted_probs >= self.top_p
+            class_log_probs = class_log_probs.masked_fill(
+                removed.scatter(1, sorted_indices, removed), float("-inf")
+            )
+
+        probs = F.softmax(class_log_probs, dim=1)
+        return torch.multinomial(probs, 1).squeeze(1)
+
+
+# Decoders which predict captions (in batches) with step functions of models.
+DecoderType = Union[AutoRegressiveBeamSearch, AutoRegressiveGreedySearch]